@@ -0,0 +1,403 @@
+# camera_manager/acquisition.py
+import functools
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import numpy as np
+from .backend import cv2, genicam, pylon
+from .change_detection import ChangeDetector, changed_runs
+from .frames import DEFAULT_QUALITY, DEFAULT_VARIANT, DeltaFrame, EncodedFrame
+from .metrics import stream_metrics
+from .pixel_formats import CONVERTERS, convert_raw
+
+# This module is shared by the in-process stream threads and the per-camera
+# worker processes, so it must not depend on Django being configured.
+
+GRAB_MODE_RETRIEVE = 'retrieve'
+GRAB_MODE_EVENT = 'event'
+GRAB_MODES = (GRAB_MODE_RETRIEVE, GRAB_MODE_EVENT)
+
+# Which buffered frames pylon hands out: only the newest (older ones are skipped and
+# counted), the newest N (OutputQueueSize), every frame in order, or the first frame
+# exposed after the application asks for one
+GRAB_STRATEGIES = ('LatestImageOnly', 'LatestImages', 'OneByOne', 'UpcomingImage')
+
+GRAB_TIMEOUT_MS = 2000
+# Event mode: how often the stream thread checks for a stop request or a lost camera
+EVENT_WATCH_INTERVAL = 0.1
+
+# pylon pixel type value -> name, for the formats pixel_formats can convert without
+# pylon; built on first use so importing this module does not load pylon
+_fast_pixel_types = None
+
+
+def _fast_pixel_type(pixel_type):
+    global _fast_pixel_types
+    if _fast_pixel_types is None:
+        _fast_pixel_types = {
+            getattr(pylon, f'PixelType_{name}'): name for name in CONVERTERS if hasattr(pylon, f'PixelType_{name}')
+        }
+    return _fast_pixel_types.get(pixel_type)
+
+
+def open_camera(serial_number):
+    """Creates and opens an InstantCamera for the given serial number."""
+    tl_factory = pylon.TlFactory.GetInstance()
+    info = pylon.CDeviceInfo()
+    info.SetSerialNumber(serial_number)
+    camera = pylon.InstantCamera(tl_factory.CreateDevice(info))
+    camera.Open()
+    return camera
+
+
+@contextmanager
+def owned_camera(serial_number):
+    """Opens a camera for the duration of the block and closes it afterwards."""
+    camera = open_camera(serial_number)
+    try:
+        yield camera
+    finally:
+        if camera.IsOpen(): camera.Close()
+        logging.info(f"[{serial_number}] Camera connection closed.")
+
+
+def create_converter():
+    """Generic pylon converter, used for pixel formats without a fast path."""
+    converter = pylon.ImageFormatConverter()
+    converter.OutputPixelFormat = pylon.PixelType_BGR8packed
+    return converter
+
+
+def grab_to_image(grab_result, converter):
+    """
+    Turns a successful grab result into an encodable 8-bit gray or BGR array that
+    stays valid after the grab result is released. Mono, Bayer and unpacked higher
+    bit depths are converted straight from a zero-copy view of the grab buffer, so
+    Mono8 stays single-channel instead of being tripled to BGR; anything else goes
+    through pylon's generic converter.
+    """
+    pixel_format = _fast_pixel_type(grab_result.GetPixelType())
+    if pixel_format is not None:
+        with grab_result.GetArrayZeroCopy() as raw:
+            return convert_raw(raw, pixel_format)
+    return converter.Convert(grab_result).GetArray()
+
+
+def encode_jpeg(frame_id, image, timestamp, quality=DEFAULT_QUALITY):
+    ret, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ret:
+        return None
+    height, width = image.shape[:2]
+    # Each consumer picks its own wire format; the payloads are cached on the frame
+    return EncodedFrame(frame_id, buffer.tobytes(), width, height, timestamp=timestamp)
+
+
+def encode_variants(frame_id, image, timestamp, variants):
+    """
+    Encodes one image once per distinct (max_width, quality) variant and returns a
+    dict mapping each requested variant to its EncodedFrame. Downscaled sizes are
+    resized from the nearest level of a half-resolution pyramid that is built on
+    demand, so a thumbnail never pays for a full-resolution resize.
+    """
+    full_width = image.shape[1]
+    pyramid = [image]
+    encoded = {}
+    frames = {}
+    for variant in variants:
+        max_width, quality = variant
+        width = min(max_width or full_width, full_width)
+        key = (width, quality)
+        if key not in encoded:
+            encoded[key] = encode_jpeg(frame_id, _scaled(pyramid, width), timestamp, quality)
+        if encoded[key] is not None:
+            frames[variant] = encoded[key]
+    return frames
+
+
+def _scaled(pyramid, width):
+    """The image at `width`, resized from the nearest pyramid level; pyramid[0] is full size."""
+    while pyramid[-1].shape[1] // 2 >= width:
+        previous = pyramid[-1]
+        half = (previous.shape[1] // 2, previous.shape[0] // 2)
+        pyramid.append(cv2.resize(previous, half, interpolation=cv2.INTER_AREA))
+    source = next(level for level in reversed(pyramid) if level.shape[1] >= width)
+    if source.shape[1] != width:
+        height = max(1, round(source.shape[0] * width / source.shape[1]))
+        source = cv2.resize(source, (width, height), interpolation=cv2.INTER_AREA)
+    return source
+
+
+def _scaled_edge(position, full_size, scaled_size):
+    return min(scaled_size, round(position * scaled_size / full_size))
+
+
+def encode_tiles(frame_id, image, timestamp, variants, changed, tile_size):
+    """
+    Encodes only the changed tiles of an image, once per variant, and returns a dict
+    mapping each variant to its DeltaFrame. `changed` is ChangeDetector's tile grid
+    in full-size coordinates; adjacent changed tiles in a row share one JPEG.
+    For scaled variants, tile edges are scaled and rounded the same way on both
+    sides of every boundary, so neighbouring tiles neither overlap nor leave gaps.
+    """
+    full_height, full_width = image.shape[:2]
+    runs = changed_runs(changed)
+    pyramid = [image]
+    frames = {}
+    for variant in variants:
+        max_width, quality = variant
+        scaled = _scaled(pyramid, min(max_width or full_width, full_width))
+        height, width = scaled.shape[:2]
+        tiles = []
+        for row, column, count in runs:
+            left = _scaled_edge(column * tile_size, full_width, width)
+            right = _scaled_edge((column + count) * tile_size, full_width, width)
+            top = _scaled_edge(row * tile_size, full_height, height)
+            bottom = _scaled_edge((row + 1) * tile_size, full_height, height)
+            if right <= left or bottom <= top:
+                continue
+            ok, buffer = cv2.imencode('.jpg', scaled[top:bottom, left:right], [cv2.IMWRITE_JPEG_QUALITY, quality])
+            if ok:
+                tiles.append((left, top, right - left, bottom - top, buffer.tobytes()))
+        frames[variant] = DeltaFrame(frame_id, tiles, width, height, timestamp=timestamp)
+    return frames
+
+
+def transcode_variants(frame, variants):
+    """
+    Produces the requested variants from an already encoded full-size frame. Used
+    where only the default variant is available, e.g. frames read from a worker ring.
+    """
+    frames = {DEFAULT_VARIANT: frame}
+    missing = [variant for variant in variants if variant != DEFAULT_VARIANT]
+    if missing:
+        image = cv2.imdecode(np.frombuffer(frame.data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        if image is not None:
+            frames.update(encode_variants(frame.frame_id, image, frame.timestamp, missing))
+    return frames
+
+
+class EncodePipeline:
+    """
+    Encode and publish stages of the acquisition pipeline.
+    Converted images are encoded on a pool of worker threads (cv2.imencode releases
+    the GIL, so consecutive frames are encoded in parallel) and a single emitter
+    thread publishes the results strictly in grab order. At most `depth` frames are
+    in flight; beyond that submit() blocks the grab stage, which is what bounds latency.
+
+    Every frame is encoded once for each variant returned by variants() at the time
+    it is submitted, and published as a dict mapping variant to EncodedFrame. A frame
+    submitted with a changed-tile grid is encoded as a DeltaFrame for the variants
+    returned by delta_variants(), whose consumers all composite deltas.
+    """
+    def __init__(self, serial_number, publish, variants, workers=2, depth=4, delta_variants=None, tile_size=None):
+        self.serial_number = serial_number
+        self._publish = publish
+        self._variants = variants
+        self._delta_variants = delta_variants or frozenset
+        self._tile_size = tile_size
+        self._metrics = stream_metrics(serial_number)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"encode-{serial_number}")
+        self._in_flight = queue.Queue(maxsize=depth)
+        self._emitter = threading.Thread(target=self._emit, daemon=True)
+        self._emitter.start()
+
+    def submit(self, frame_id, image, timestamp, changed=None):
+        variants = self._variants() or {DEFAULT_VARIANT}
+        deltas = self._delta_variants() & variants if changed is not None else frozenset()
+        self._in_flight.put(self._pool.submit(self._encode, frame_id, image, timestamp, variants, deltas, changed))
+
+    def close(self):
+        self._in_flight.put(None)
+        self._emitter.join()
+        self._pool.shutdown(wait=True)
+
+    def _encode(self, frame_id, image, timestamp, variants, deltas, changed):
+        started = time.perf_counter()
+        frames = encode_variants(frame_id, image, timestamp, [variant for variant in variants if variant not in deltas])
+        if deltas:
+            frames.update(encode_tiles(frame_id, image, timestamp, deltas, changed, self._tile_size))
+        self._metrics.encode.observe(time.perf_counter() - started)
+        return frames
+
+    def _emit(self):
+        while True:
+            future = self._in_flight.get()
+            if future is None:
+                return
+            try:
+                frames = future.result()
+                if frames:
+                    self._publish(frames)
+            except Exception as e:
+                logging.warning(f"[{self.serial_number}] Failed to encode or publish frame: {e}")
+
+
+class FrameProcessor:
+    """
+    Per-frame work shared by both grab modes: convert, check for changes, submit
+    to the encode pipeline. handle() returns the grab buffer to pylon as soon as
+    the image has been converted.
+    """
+    def __init__(self, serial_number, pipeline, detector=None, keyframe_requested=None):
+        self.serial_number = serial_number
+        self._pipeline = pipeline
+        self._detector = detector
+        self._keyframe_requested = keyframe_requested
+        self._converter = create_converter()
+        self._metrics = stream_metrics(serial_number)
+        self._frame_id = 0
+        # perf_counter() when the last frame arrived, for stall detection in event mode
+        self.last_frame = time.perf_counter()
+
+    def handle(self, grab_result, waited):
+        """Processes one grab result; `waited` is how long the grab stage waited for it, in seconds."""
+        metrics = self._metrics
+        grabbed = self.last_frame = time.perf_counter()
+        metrics.grab_wait.observe(waited)
+        try:
+            if not grab_result.GrabSucceeded():
+                metrics.grab_failures.inc()
+                return
+            timestamp = time.time() * 1000.0
+            skipped = grab_result.GetNumberOfSkippedImages()
+            if skipped:
+                metrics.images_skipped.inc(skipped)
+            image = grab_to_image(grab_result, self._converter)
+        finally:
+            grab_result.Release()
+        converted = time.perf_counter()
+        metrics.convert.observe(converted - grabbed)
+        metrics.frames_grabbed.inc()
+
+        changed = None
+        if self._detector:
+            force_keyframe = bool(self._keyframe_requested and self._keyframe_requested())
+            decision = self._detector.detect(image, converted, force_keyframe)
+            metrics.detect.observe(time.perf_counter() - converted)
+            if decision is None:
+                metrics.frames_unchanged.inc()
+                return
+            _, changed = decision
+
+        self._frame_id += 1
+        self._pipeline.submit(self._frame_id, image, timestamp, changed)
+
+
+@functools.lru_cache(maxsize=None)
+def _grab_events_class():
+    # Defined on first use: subclassing a pylon class at import time would load pylon
+    class GrabEvents(pylon.ImageEventHandler):
+        """Hands every grab result from pylon's grab loop thread to a FrameProcessor."""
+        def __init__(self, processor):
+            super().__init__()
+            self._processor = processor
+            self._idle_since = time.perf_counter()
+
+        def OnImageGrabbed(self, camera, grab_result):
+            try:
+                self._processor.handle(grab_result, time.perf_counter() - self._idle_since)
+            except Exception as e:
+                # Raising here would stop pylon from notifying any further handlers
+                logging.warning(f"[{self._processor.serial_number}] Failed to process frame: {e}")
+            finally:
+                self._idle_since = time.perf_counter()
+
+    return GrabEvents
+
+
+def configure_grabbing(camera, max_num_buffer=None, output_queue_size=None, packet_size=None):
+    """
+    Sets the InstantCamera's buffer count and LatestImages queue size, and a GigE
+    camera's packet size, which is locked while grabbing, before grabbing starts.
+    """
+    if packet_size:
+        node = camera.GetNodeMap().GetNode('GevSCPSPacketSize')
+        if node is not None and genicam.IsWritable(node):
+            node.SetValue(packet_size)
+    if max_num_buffer:
+        camera.MaxNumBuffer.SetValue(max_num_buffer)
+    if output_queue_size:
+        camera.OutputQueueSize.SetValue(output_queue_size)
+
+
+def _grab_by_retrieving(serial_number, camera, strategy, processor, is_running):
+    """Blocks in RetrieveResult on the calling thread; the camera sets the pace."""
+    metrics = stream_metrics(serial_number)
+    camera.StartGrabbing(strategy)
+    while is_running() and camera.IsGrabbing():
+        try:
+            started = time.perf_counter()
+            grab_result = camera.RetrieveResult(GRAB_TIMEOUT_MS, pylon.TimeoutHandling_ThrowException)
+            processor.handle(grab_result, time.perf_counter() - started)
+        except pylon.TimeoutException:
+            metrics.grab_timeouts.inc()
+            logging.warning(f"[{serial_number}] Frame grab timeout.")
+            continue
+
+
+def _grab_by_events(serial_number, camera, strategy, processor, is_running):
+    """
+    Lets pylon's own grab loop thread deliver frames through an ImageEventHandler,
+    so each frame is processed the moment its buffer is filled. This thread only
+    watches for the stream being stopped, a lost device or a stalled camera.
+    """
+    metrics = stream_metrics(serial_number)
+    handler = _grab_events_class()(processor)
+    camera.RegisterImageEventHandler(handler, pylon.RegistrationMode_Append, pylon.Cleanup_None)
+    try:
+        camera.StartGrabbing(strategy, pylon.GrabLoop_ProvidedByInstantCamera)
+        while is_running() and camera.IsGrabbing():
+            if camera.IsCameraDeviceRemoved():
+                raise RuntimeError("The camera device was removed.")
+            if time.perf_counter() - processor.last_frame > GRAB_TIMEOUT_MS / 1000.0:
+                metrics.grab_timeouts.inc()
+                logging.warning(f"[{serial_number}] Frame grab timeout.")
+                processor.last_frame = time.perf_counter()
+            time.sleep(EVENT_WATCH_INTERVAL)
+    finally:
+        # Joins pylon's grab loop thread, so no callback runs after this
+        if camera.IsGrabbing(): camera.StopGrabbing()
+        camera.DeregisterImageEventHandler(handler)
+
+
+def run_acquisition(serial_number, is_running, publish, variants=None, camera_source=None,
+                    encode_workers=2, pipeline_depth=4, change_detection=None,
+                    delta_variants=None, keyframe_requested=None, grab_mode=GRAB_MODE_RETRIEVE,
+                    grab_strategy='LatestImageOnly', max_num_buffer=None, output_queue_size=None,
+                    packet_size=None):
+    """
+    Grabs and converts frames until is_running() returns False and feeds them through
+    an EncodePipeline that hands every {variant: EncodedFrame} dict to publish(), in order.
+    variants() returns the set of variants currently wanted; by default only DEFAULT_VARIANT.
+    camera_source(serial_number) is a context manager yielding an open camera; by default
+    the camera is opened privately for the duration of the stream.
+    change_detection holds ChangeDetector arguments; when given, unchanged frames are
+    skipped and, for the variants delta_variants() returns, changed frames are sent as
+    tiles between keyframes. keyframe_requested() returning True forces the next keyframe.
+    grab_mode is GRAB_MODE_RETRIEVE or GRAB_MODE_EVENT, grab_strategy a GRAB_STRATEGIES
+    name; max_num_buffer and output_queue_size (LatestImages only) tune pylon's buffering.
+    packet_size sets a GigE camera's stream packet size.
+    Fatal errors propagate to the caller.
+    """
+    if grab_strategy not in GRAB_STRATEGIES:
+        raise ValueError(f"Unknown grab strategy '{grab_strategy}'. Available: {', '.join(GRAB_STRATEGIES)}.")
+    if grab_mode not in GRAB_MODES:
+        raise ValueError(f"Unknown grab mode '{grab_mode}'. Available: {', '.join(GRAB_MODES)}.")
+    grab = _grab_by_events if grab_mode == GRAB_MODE_EVENT else _grab_by_retrieving
+    with (camera_source or owned_camera)(serial_number) as camera:
+        pipeline = None
+        try:
+            configure_grabbing(camera, max_num_buffer, output_queue_size, packet_size)
+            detector = ChangeDetector(**change_detection) if change_detection else None
+            pipeline = EncodePipeline(serial_number, publish, variants or (lambda: {DEFAULT_VARIANT}),
+                                      encode_workers, pipeline_depth, delta_variants,
+                                      detector.tile_size if detector else None)
+            processor = FrameProcessor(serial_number, pipeline, detector, keyframe_requested)
+            grab(serial_number, camera, getattr(pylon, f'GrabStrategy_{grab_strategy}'), processor, is_running)
+        finally:
+            # A shared camera stays open for its other users
+            if camera.IsGrabbing(): camera.StopGrabbing()
+            if pipeline: pipeline.close()
@@ -0,0 +1,65 @@
+# camera_manager/backend.py
+import importlib
+import threading
+import time
+import logging
+
+# pypylon and OpenCV take a noticeable share of process startup, which migrations,
+# the shell and admin-only workers never need. Modules use the stand-ins below
+# instead of importing them directly; the real module is imported the first time
+# one of its attributes is used. Serving processes call warm_up() at startup so
+# the first camera request does not pay for the imports either.
+# Like acquisition.py this module does not depend on Django.
+
+_import_lock = threading.Lock()
+
+
+class _LazyModule:
+    """Stands in for a module that is imported the first time one of its attributes is used."""
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def load(self):
+        if self._module is None:
+            with _import_lock:
+                if self._module is None:
+                    module = importlib.import_module(self._name)
+                    # Later lookups find the module's attributes on the stand-in itself,
+                    # without going through __getattr__
+                    self.__dict__.update(
+                        (name, value) for name, value in vars(module).items()
+                        if not name.startswith('__') and not hasattr(_LazyModule, name)
+                    )
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    def __dir__(self):
+        return dir(self.load())
+
+
+pylon = _LazyModule('pypylon.pylon')
+genicam = _LazyModule('pypylon.genicam')
+cv2 = _LazyModule('cv2')
+
+
+def _warm_up():
+    started = time.monotonic()
+    try:
+        for module in (pylon, genicam, cv2):
+            module.load()
+        # Creating the factory loads and initializes pylon's transport layers
+        pylon.TlFactory.GetInstance()
+        logging.info(f"Camera libraries ready in {time.monotonic() - started:.2f}s.")
+    except Exception as e:
+        logging.error(f"Warming up the camera libraries failed: {e}")
+
+
+def warm_up():
+    """Imports the camera libraries and initializes pylon's transport layers on a background thread."""
+    thread = threading.Thread(target=_warm_up, name='camera-backend-warm-up', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,326 @@
+# camera_manager/bandwidth.py
+import functools
+import ipaddress
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from django.conf import settings
+from django.utils import timezone
+from .backend import genicam, pylon
+from .discovery import discovery_service
+from .session_pool import session_pool
+
+# GigE cameras behind one host interface share its link. When their combined
+# bursts exceed it, the switch drops packets and frames arrive incomplete or time
+# out. The planner groups streaming cameras by the host interface pylon reports
+# for them (or by their subnet), works out what each camera needs on the wire
+# from its image size, pixel format and frame rate, and shares the usable part of
+# the link between them in proportion to that need. Each camera then gets a
+# throughput limit (DeviceLinkThroughputLimit) or, where the camera has none, the
+# equivalent inter-packet delay (GevSCPD).
+
+# IP (20) + UDP (8) + GVSP (8) headers inside every stream packet
+PACKET_HEADER_BYTES = 36
+# Ethernet header, FCS, preamble and inter-frame gap around every packet
+ETHERNET_OVERHEAD_BYTES = 38
+# GigE Vision timestamp tick frequency when the camera does not report it (8 ns ticks)
+DEFAULT_TICK_FREQUENCY = 125000000
+DEFAULT_PACKET_SIZE = 1500
+# Cameras whose parameters a plan reads at once
+MAX_PARALLEL_READS = 16
+
+@functools.lru_cache(maxsize=None)
+def _pixel_types():
+    """pylon pixel type names, lowercased -> pixel type."""
+    return {name[len('PixelType_'):].lower(): getattr(pylon, name) for name in dir(pylon) if name.startswith('PixelType_')}
+
+
+def bits_per_pixel(pixel_format):
+    """Bits one pixel takes in the stream; raises ValueError for formats pylon does not know."""
+    name = pixel_format.lower()
+    pixel_types = _pixel_types()
+    # SFNC spells some packed formats without the suffix (RGB8 is RGB8Packed)
+    pixel_type = pixel_types.get(name, pixel_types.get(name + 'packed'))
+    if pixel_type is None:
+        raise ValueError(f"Unknown pixel format '{pixel_format}'.")
+    return pylon.BitPerPixel(pixel_type)
+
+
+def frame_bytes(width, height, pixel_format):
+    return width * height * bits_per_pixel(pixel_format) // 8
+
+
+def wire_bytes_per_second(payload_size, fps, packet_size):
+    """Bytes per second one camera puts on the link, counting every packet's overhead."""
+    per_packet = packet_size - PACKET_HEADER_BYTES
+    packets = -(-payload_size // per_packet)
+    # Leader and trailer packets frame every image
+    return fps * (payload_size + (packets + 2) * (PACKET_HEADER_BYTES + ETHERNET_OVERHEAD_BYTES))
+
+
+def inter_packet_delay(packet_size, allotted, link_bytes_per_second, tick_frequency):
+    """GevSCPD ticks that stretch a camera's packets out to its allotted bytes per second."""
+    wire_packet = packet_size + ETHERNET_OVERHEAD_BYTES
+    delay = wire_packet / allotted - wire_packet / link_bytes_per_second
+    return max(0, int(delay * tick_frequency))
+
+
+def link_group(camera_info):
+    """
+    The key cameras sharing a link are grouped by: the host interface pylon found the
+    camera on, else its subnet, else its own address. None for non-GigE cameras.
+    """
+    if camera_info.get('interface'):
+        return camera_info['interface']
+    ip_address = camera_info.get('ip_address')
+    if not ip_address:
+        return None
+    if camera_info.get('subnet_mask'):
+        try:
+            return str(ipaddress.ip_interface(f"{ip_address}/{camera_info['subnet_mask']}").network)
+        except ValueError:
+            pass
+    return ip_address
+
+
+def plan_link(cameras, link_bytes_per_second, reserve):
+    """
+    Shares one link between `cameras`, dicts with serial_number, payload_size, fps,
+    packet_size and tick_frequency. All but `reserve` (a fraction) of the link is
+    split in proportion to what each camera needs, so the allotments always add up
+    to the usable bandwidth: spare capacity shortens every frame's transfer, and on
+    an oversubscribed link every camera slows down by the same factor.
+    """
+    usable = link_bytes_per_second * (1.0 - reserve)
+    needs = [wire_bytes_per_second(camera['payload_size'], camera['fps'], camera['packet_size']) for camera in cameras]
+    required = sum(needs)
+    share = usable / required if required else 1.0
+    entries = []
+    for camera, need in zip(cameras, needs):
+        allotted = need * share
+        entries.append({
+            **camera,
+            'required': int(need),
+            'allotted': int(allotted),
+            'throughput_limit': int(allotted),
+            'inter_packet_delay': inter_packet_delay(camera['packet_size'], allotted, link_bytes_per_second,
+                                                     camera['tick_frequency']),
+            'expected_fps': round(camera['fps'] * min(share, 1.0), 2),
+        })
+    return {
+        'link_bytes_per_second': int(link_bytes_per_second),
+        'usable_bytes_per_second': int(usable),
+        'required_bytes_per_second': int(required),
+        'utilization': round(required / usable, 3) if usable else None,
+        'oversubscribed': required > usable,
+        'cameras': entries,
+    }
+
+
+def _read(nodemap, *names):
+    for name in names:
+        node = nodemap.GetNode(name)
+        if node is not None and genicam.IsReadable(node):
+            return node.GetValue()
+    return None
+
+
+def read_stream_parameters(camera):
+    """What the planner needs to know about an open camera's current stream."""
+    nodemap = camera.GetNodeMap()
+    width, height = _read(nodemap, 'Width'), _read(nodemap, 'Height')
+    pixel_format = _read(nodemap, 'PixelFormat')
+    payload_size = _read(nodemap, 'PayloadSize')
+    if payload_size is None:
+        payload_size = frame_bytes(width, height, pixel_format)
+    throughput_limit = nodemap.GetNode('DeviceLinkThroughputLimit')
+    return {
+        'width': width,
+        'height': height,
+        'pixel_format': pixel_format,
+        'payload_size': payload_size,
+        # What the camera is set to deliver. ResultingFrameRate already reflects the
+        # throughput limit of the last plan, so the demand would shrink with every replan
+        'fps': _read(nodemap, 'AcquisitionFrameRate', 'AcquisitionFrameRateAbs', 'ResultingFrameRate', 'ResultingFrameRateAbs'),
+        'packet_size': _read(nodemap, 'GevSCPSPacketSize') or DEFAULT_PACKET_SIZE,
+        'tick_frequency': _read(nodemap, 'GevTimestampTickFrequency') or DEFAULT_TICK_FREQUENCY,
+        'supports_throughput_limit': throughput_limit is not None and genicam.IsAvailable(throughput_limit),
+    }
+
+
+def read_camera(serial_number):
+    """
+    read_stream_parameters() for a camera by serial number. A camera the session pool
+    does not hold open already is closed again right away rather than kept for the
+    pool's idle timeout, so a dry run does not tie up devices.
+    """
+    with session_pool.session(serial_number, keep=session_pool.is_open(serial_number)) as session, session.lock:
+        return read_stream_parameters(session.camera)
+
+
+def read_cameras(serial_numbers, timeout):
+    """
+    {serial number: stream parameters, or the exception reading them raised} for the
+    cameras, read in parallel. Cameras that have not answered within `timeout`
+    seconds get a TimeoutError; their reads finish in the background.
+    """
+    if not serial_numbers:
+        return {}
+    executor = ThreadPoolExecutor(max_workers=min(len(serial_numbers), MAX_PARALLEL_READS), thread_name_prefix='bandwidth-read')
+    try:
+        futures = {serial_number: executor.submit(read_camera, serial_number) for serial_number in serial_numbers}
+        deadline = time.monotonic() + timeout
+        results = {}
+        for serial_number, future in futures.items():
+            try:
+                results[serial_number] = future.result(timeout=max(deadline - time.monotonic(), 0))
+            except FutureTimeoutError:
+                results[serial_number] = TimeoutError(f"No answer within {timeout:g}s.")
+            except Exception as e:
+                results[serial_number] = e
+        return results
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def apply_entry(camera, entry):
+    """
+    Writes one camera's plan: the throughput limit where the camera has one, else the
+    inter-packet delay. Both can change while the camera streams; the packet size
+    cannot, so streams set CAMERA_GIGE_PACKET_SIZE before they start grabbing.
+    Returns the names of the features written.
+    """
+    nodemap = camera.GetNodeMap()
+    written = []
+
+    def write(name, value):
+        node = nodemap.GetNode(name)
+        if node is None or not genicam.IsWritable(node):
+            return
+        if isinstance(value, int):
+            value = min(max(value, node.GetMin()), node.GetMax())
+            value -= (value - node.GetMin()) % node.GetInc()
+        node.SetValue(value)
+        written.append(name)
+
+    if entry['supports_throughput_limit']:
+        write('DeviceLinkThroughputLimitMode', 'On')
+        write('DeviceLinkThroughputLimit', entry['throughput_limit'])
+        write('GevSCPD', 0)
+    else:
+        write('GevSCPD', entry['inter_packet_delay'])
+    return written
+
+
+class BandwidthPlanner:
+    """
+    Plans the links of the cameras that are streaming. `plan()` only reads from the
+    cameras and reports; `request_replan()` wakes a background thread that plans and
+    applies, so stream start and stop never wait for camera I/O. Requests arriving
+    within `settle` seconds of each other are handled by one pass.
+    """
+    def __init__(self, settle=0.5):
+        self.settle = settle
+        self._streaming = frozenset()
+        self._last_plan = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def plan(self, serial_numbers, cameras=None):
+        """
+        The plan for `serial_numbers` streaming at once, from each camera's payload size
+        and frame rate setting. Addresses come from `cameras` (discover_cameras()
+        dicts), by default the latest discovered cameras. The cameras are read in
+        parallel; those not answering within CAMERA_BANDWIDTH_READ_TIMEOUT seconds are skipped.
+        """
+        if cameras is None:
+            cameras = discovery_service.cameras()
+        known = {camera['serial_number']: camera for camera in cameras}
+        packet_size = getattr(settings, 'CAMERA_GIGE_PACKET_SIZE', None)
+        links = getattr(settings, 'CAMERA_GIGE_LINK_SPEEDS', {})
+        default_speed = getattr(settings, 'CAMERA_GIGE_LINK_SPEED', 1000)
+        reserve = getattr(settings, 'CAMERA_GIGE_LINK_RESERVE', 0.1)
+        groups = {}
+        skipped = []
+        gige = {}
+        for serial_number in sorted(serial_numbers):
+            group = link_group(known.get(serial_number, {}))
+            if group is None:
+                skipped.append({'serial_number': serial_number, 'reason': 'Not a GigE camera or not discovered.'})
+            else:
+                gige[serial_number] = group
+        read = read_cameras(list(gige), getattr(settings, 'CAMERA_BANDWIDTH_READ_TIMEOUT', 3.0))
+        for serial_number, group in gige.items():
+            parameters = read[serial_number]
+            if isinstance(parameters, Exception):
+                skipped.append({'serial_number': serial_number, 'reason': f"Could not read the camera: {parameters}"})
+                continue
+            if not parameters['fps'] or not parameters['payload_size']:
+                skipped.append({'serial_number': serial_number, 'reason': 'Frame rate or payload size unknown.'})
+                continue
+            if packet_size:
+                # What the stream will use once it (re)starts grabbing
+                parameters['packet_size'] = packet_size
+            groups.setdefault(group, []).append({'serial_number': serial_number, **parameters})
+        return {
+            'planned_at': timezone.now().isoformat(),
+            'links': [
+                {'interface': group, **plan_link(members, links.get(group, default_speed) * 1e6 / 8, reserve)}
+                for group, members in sorted(groups.items())
+            ],
+            'skipped': skipped,
+        }
+
+    def apply(self, plan):
+        """Writes a plan to its cameras; returns {serial number: features written or error}."""
+        results = {}
+        for link in plan['links']:
+            for entry in link['cameras']:
+                serial_number = entry['serial_number']
+                try:
+                    with session_pool.session(serial_number) as session, session.lock:
+                        results[serial_number] = apply_entry(session.camera, entry)
+                except Exception as e:
+                    logging.error(f"[{serial_number}] Applying the bandwidth plan failed: {e}")
+                    results[serial_number] = str(e)
+            if link['oversubscribed']:
+                logging.warning(
+                    f"Link {link['interface']} is oversubscribed ({link['utilization'] * 100:.0f}% of usable bandwidth); "
+                    f"its cameras will deliver fewer frames."
+                )
+        return results
+
+    def last_plan(self):
+        with self._lock:
+            return self._last_plan
+
+    def request_replan(self, streaming):
+        """Plans and applies for the cameras in `streaming` on the planner thread."""
+        with self._lock:
+            self._streaming = frozenset(streaming)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            time.sleep(self.settle)
+            self._wake.clear()
+            with self._lock:
+                streaming = self._streaming
+            try:
+                plan = self.plan(streaming)
+                plan['applied'] = self.apply(plan)
+            except Exception as e:
+                logging.error(f"Bandwidth planning failed: {e}")
+                continue
+            with self._lock:
+                self._last_plan = plan
+            logging.info(f"Bandwidth plan applied to {len(plan['applied'])} camera(s) on {len(plan['links'])} link(s).")
+
+
+bandwidth_planner = BandwidthPlanner()
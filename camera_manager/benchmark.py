@@ -0,0 +1,410 @@
+# camera_manager/benchmark.py
+import itertools
+import os
+import platform
+import resource
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+from django.conf import settings
+from .backend import cv2, pylon
+from .consumers import CameraStreamConsumer
+from .frames import TRANSPORT_BINARY, Subscription
+from .metrics import stream_metrics
+from .pixel_formats import CONVERTERS
+from .session_pool import session_pool
+from .stream_manager import CameraStreamManager, acquisition_options
+
+# Streaming benchmark: runs the real stream manager, acquisition pipeline and
+# WebSocket consumer serialization against cameras that need no hardware, either
+# pylon's camera emulator (PYLON_CAMEMU) or a synthetic source that hands out
+# pre-generated raw buffers at a fixed rate. Only the socket write is replaced by
+# a counter, so the numbers cover everything from the grab result to the transport.
+
+SOURCE_SYNTHETIC = 'synthetic'
+SOURCE_CAMEMU = 'camemu'
+SOURCES = (SOURCE_SYNTHETIC, SOURCE_CAMEMU)
+
+# Version of the JSON result document
+RESULT_VERSION = 1
+# Stage histograms reported as mean milliseconds per frame
+STAGES = ('grab_wait', 'convert', 'encode', 'publish', 'send')
+COUNTERS = ('frames_grabbed', 'grab_failures', 'grab_timeouts', 'images_skipped', 'frames_dropped')
+# Raw buffers generated per synthetic camera; the source cycles through them
+SYNTHETIC_FRAMES = 8
+
+
+def parse_resolution(text):
+    """'1920x1080' -> (1920, 1080)."""
+    width, _, height = text.lower().partition('x')
+    return int(width), int(height)
+
+
+def synthetic_pixel_format(name):
+    """Canonical pixel_formats name for a case-insensitive one; only fast-path formats can be synthesized."""
+    for known in CONVERTERS:
+        if known.lower() == name.lower():
+            return known
+    raise ValueError(f"Unsupported synthetic pixel format '{name}'. Available: {', '.join(CONVERTERS)}.")
+
+
+def synthetic_frames(width, height, pixel_format, count=SYNTHETIC_FRAMES, seed=0):
+    """
+    Raw buffers shaped and typed like pylon's for the pixel format: a moving gradient
+    with sensor-like noise, so JPEG sizes and encode times resemble real footage.
+    """
+    rng = np.random.default_rng(seed)
+    bits = next((bits for suffix, bits in (('10', 10), ('12', 12), ('16', 16)) if pixel_format.endswith(suffix)), 8)
+    dtype = np.uint8 if bits == 8 else np.uint16
+    channels = 3 if pixel_format in ('BGR8packed', 'RGB8packed') else 1
+    ys, xs = np.mgrid[0:height, 0:width]
+    frames = []
+    for index in range(count):
+        shift = index * width // count
+        gradient = ((xs + shift) % width) / width * 0.7 + ys / height * 0.3
+        noise = rng.normal(0.0, 0.02, size=(height, width))
+        plane = np.clip(gradient + noise, 0.0, 1.0) * ((1 << bits) - 1)
+        image = plane.astype(dtype)
+        if channels == 3:
+            image = np.stack([image, np.flipud(image), np.fliplr(image)], axis=2)
+        frames.append(np.ascontiguousarray(image))
+    return frames
+
+
+class SyntheticGrabResult:
+    """The parts of a pylon grab result that run_acquisition uses."""
+    def __init__(self, array, pixel_type, skipped):
+        self._array = array
+        self._pixel_type = pixel_type
+        self._skipped = skipped
+
+    def GrabSucceeded(self):
+        return True
+
+    def GetPixelType(self):
+        return self._pixel_type
+
+    def GetNumberOfSkippedImages(self):
+        return self._skipped
+
+    @contextmanager
+    def GetArrayZeroCopy(self):
+        yield self._array
+
+    def Release(self):
+        self._array = None
+
+
+class _SyntheticParameter:
+    """Stands in for an InstantCamera parameter such as MaxNumBuffer."""
+    def __init__(self, value):
+        self.value = value
+
+    def GetValue(self):
+        return self.value
+
+    def SetValue(self, value):
+        self.value = value
+
+
+class SyntheticCamera:
+    """
+    Stands in for an InstantCamera grabbing with GrabStrategy_LatestImageOnly at a
+    fixed frame rate: frames the caller was too slow to retrieve are skipped and
+    counted, the way pylon reports them. Like pylon it can also run its own grab
+    loop thread that hands each frame to registered image event handlers.
+    """
+    def __init__(self, frames, pixel_format, fps):
+        self._frames = frames
+        self._pixel_type = getattr(pylon, f'PixelType_{pixel_format}')
+        self._period = 1.0 / fps
+        self._grabbing = False
+        self._next_frame = 0.0
+        self._index = 0
+        self._handlers = []
+        self._grab_loop = None
+        self.MaxNumBuffer = _SyntheticParameter(10)
+        self.OutputQueueSize = _SyntheticParameter(1)
+
+    def RegisterImageEventHandler(self, handler, *args):
+        self._handlers.append(handler)
+
+    def DeregisterImageEventHandler(self, handler):
+        self._handlers.remove(handler)
+
+    def StartGrabbing(self, strategy=None, grab_loop=None):
+        self._grabbing = True
+        self._next_frame = time.monotonic()
+        if grab_loop == pylon.GrabLoop_ProvidedByInstantCamera:
+            self._grab_loop = threading.Thread(target=self._run_grab_loop, daemon=True)
+            self._grab_loop.start()
+
+    def StopGrabbing(self):
+        self._grabbing = False
+        if self._grab_loop and self._grab_loop is not threading.current_thread():
+            self._grab_loop.join()
+        self._grab_loop = None
+
+    def IsGrabbing(self):
+        return self._grabbing
+
+    def IsCameraDeviceRemoved(self):
+        return False
+
+    def _run_grab_loop(self):
+        while self._grabbing:
+            try:
+                grab_result = self.RetrieveResult(100)
+            except pylon.TimeoutException:
+                continue
+            for handler in list(self._handlers):
+                handler.OnImageGrabbed(self, grab_result)
+
+    def RetrieveResult(self, timeout_ms, *args):
+        now = time.monotonic()
+        if self._next_frame - now > timeout_ms / 1000.0:
+            time.sleep(timeout_ms / 1000.0)
+            raise pylon.TimeoutException("Synthetic grab timed out.")
+        skipped = 0
+        if now > self._next_frame + self._period:
+            skipped = int((now - self._next_frame) / self._period)
+            self._next_frame += skipped * self._period
+        elif now < self._next_frame:
+            time.sleep(self._next_frame - now)
+        self._next_frame += self._period
+        self._index += 1 + skipped
+        array = self._frames[self._index % len(self._frames)]
+        return SyntheticGrabResult(array, self._pixel_type, skipped)
+
+
+class SyntheticSource:
+    """camera_source for CameraStreamManager serving SyntheticCameras."""
+    def __init__(self, width, height, pixel_format, fps):
+        self.pixel_format = synthetic_pixel_format(pixel_format)
+        self.fps = fps
+        self._frames = synthetic_frames(width, height, self.pixel_format)
+
+    @contextmanager
+    def __call__(self, serial_number):
+        yield SyntheticCamera(self._frames, self.pixel_format, self.fps)
+
+
+def configure_emulator(serial_number, width, height, pixel_format, fps):
+    """
+    Sets an emulated camera's image size, pixel format and frame rate through the
+    session pool. Returns the pixel format's name as the camera spells it.
+    """
+    with session_pool.session(serial_number) as session, session.lock:
+        nodemap = session.camera.GetNodeMap()
+        formats = nodemap.GetNode('PixelFormat')
+        symbolic = next((name for name in formats.GetSymbolics() if name.lower() == pixel_format.lower()), None)
+        if symbolic is None:
+            raise ValueError(f"Emulated camera {serial_number} has no pixel format '{pixel_format}'.")
+        formats.SetValue(symbolic)
+        for name, value in (('OffsetX', 0), ('OffsetY', 0), ('Width', width), ('Height', height)):
+            node = nodemap.GetNode(name)
+            node.SetValue(min(value, node.GetMax()))
+        nodemap.GetNode('AcquisitionFrameRateEnable').SetValue(True)
+        nodemap.GetNode('AcquisitionFrameRateAbs').SetValue(fps)
+    return symbolic
+
+
+def emulated_serials(count):
+    """Serial numbers of the first `count` emulated cameras; PYLON_CAMEMU must allow at least that many."""
+    devices = [device for device in pylon.TlFactory.GetInstance().EnumerateDevices()
+               if device.GetDeviceClass() == 'BaslerCamEmu']
+    if len(devices) < count:
+        raise ValueError(f"{count} emulated camera(s) needed but {len(devices)} found; "
+                         f"set PYLON_CAMEMU={count} before starting.")
+    return sorted(device.GetSerialNumber() for device in devices)[:count]
+
+
+class BenchmarkConsumer(CameraStreamConsumer):
+    """
+    A stream consumer that runs CameraStreamConsumer's serialization but hands the
+    message to a counter instead of a socket, recording each frame's latency.
+    """
+    def __init__(self, serial_number, transport, subscription):
+        super().__init__()
+        self.serial_number = serial_number
+        self.transport = transport
+        self.subscription = subscription
+        self.scope = {'client': None}
+        self.base_send = self._count
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.frames = 0
+            self.bytes = 0
+            self.latencies = []
+
+    def _count(self, message):
+        self.bytes += len(message.get('bytes') or message.get('text') or '')
+
+    def send_frame(self, frame):
+        super().send_frame(frame)
+        latency = time.time() * 1000.0 - frame.timestamp
+        with self._lock:
+            self.frames += 1
+            self.latencies.append(latency)
+
+
+def _snapshot(serial_numbers):
+    """Totals of the stage histograms and counters of the given cameras' stream metrics."""
+    totals = {f'{stage}_{part}': 0.0 for stage in STAGES for part in ('sum', 'count')}
+    totals.update({counter: 0 for counter in COUNTERS})
+    for serial_number in serial_numbers:
+        metrics = stream_metrics(serial_number)
+        for stage in STAGES:
+            histogram = getattr(metrics, stage)
+            totals[f'{stage}_sum'] += histogram.sum
+            totals[f'{stage}_count'] += histogram.count
+        for counter in COUNTERS:
+            totals[counter] += getattr(metrics, counter).value
+    return totals
+
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _cpu_seconds():
+    times = os.times()
+    return times.user + times.system
+
+
+def _percentiles(values):
+    if not values:
+        return {'p50': None, 'p90': None, 'p99': None, 'max': None}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {'p50': round(float(p50), 2), 'p90': round(float(p90), 2), 'p99': round(float(p99), 2),
+            'max': round(float(max(values)), 2)}
+
+
+def run_case(source, cameras, width, height, pixel_format, consumers, fps=30.0, duration=5.0, warmup=1.0,
+             transport=TRANSPORT_BINARY, max_width=None):
+    """
+    Streams `cameras` cameras to `consumers` consumers each for `duration` seconds after
+    a warm-up and returns one result dict.
+    """
+    if source == SOURCE_CAMEMU:
+        serial_numbers = emulated_serials(cameras)
+        for serial_number in serial_numbers:
+            pixel_format = configure_emulator(serial_number, width, height, pixel_format, fps)
+        manager = CameraStreamManager()
+    else:
+        serial_numbers = [f'synthetic-{index}' for index in range(cameras)]
+        camera_source = SyntheticSource(width, height, pixel_format, fps)
+        pixel_format = camera_source.pixel_format
+        manager = CameraStreamManager(camera_source=camera_source)
+
+    subscription = Subscription(max_width=max_width)
+    attached = [(serial_number, BenchmarkConsumer(serial_number, transport, subscription))
+                for serial_number in serial_numbers for _ in range(consumers)]
+    try:
+        for serial_number, consumer in attached:
+            manager.start_stream(serial_number, consumer)
+        time.sleep(warmup)
+
+        for _, consumer in attached:
+            consumer.reset()
+        before = _snapshot(serial_numbers)
+        rss_before = _rss_bytes()
+        cpu_before = _cpu_seconds()
+        started = time.monotonic()
+        time.sleep(duration)
+        elapsed = time.monotonic() - started
+        cpu = _cpu_seconds() - cpu_before
+        after = _snapshot(serial_numbers)
+        rss_after = _rss_bytes()
+        samples = [(consumer.frames, consumer.bytes, list(consumer.latencies)) for _, consumer in attached]
+    finally:
+        for serial_number, consumer in attached:
+            manager.stop_stream(serial_number, consumer)
+
+    delta = {key: after[key] - before[key] for key in after}
+    latencies = [latency for _, _, consumer_latencies in samples for latency in consumer_latencies]
+    frames_delivered = sum(frames for frames, _, _ in samples)
+    return {
+        'source': source,
+        'cameras': cameras,
+        'width': width,
+        'height': height,
+        'pixel_format': pixel_format,
+        'consumers_per_camera': consumers,
+        'transport': transport,
+        'max_width': max_width,
+        'target_fps': fps,
+        'duration': round(elapsed, 3),
+        'fps_grabbed_per_camera': round(delta['frames_grabbed'] / elapsed / cameras, 2),
+        'fps_delivered_per_consumer': round(frames_delivered / elapsed / len(samples), 2),
+        'megabytes_sent_per_second': round(sum(sent for _, sent, _ in samples) / elapsed / 1e6, 3),
+        'latency_ms': _percentiles(latencies),
+        'stage_ms': {
+            stage: round(delta[f'{stage}_sum'] / delta[f'{stage}_count'] * 1000.0, 3) if delta[f'{stage}_count'] else None
+            for stage in STAGES
+        },
+        'grab_failures': delta['grab_failures'],
+        'grab_timeouts': delta['grab_timeouts'],
+        'images_skipped': delta['images_skipped'],
+        'frames_dropped': delta['frames_dropped'],
+        'cpu_percent': round(cpu / elapsed * 100.0, 1),
+        'cpu_percent_per_stream': round(cpu / elapsed * 100.0 / cameras, 1),
+        'rss_megabytes': round(rss_after / 1e6, 1) if rss_after is not None else None,
+        'rss_growth_megabytes': round((rss_after - rss_before) / 1e6, 1) if rss_after is not None else None,
+    }
+
+
+def case_key(result):
+    """Identifies a case across runs, for comparisons."""
+    return (result['source'], result['cameras'], result['width'], result['height'], result['pixel_format'],
+            result['consumers_per_camera'], result['transport'], result['max_width'], result['target_fps'])
+
+
+def environment():
+    """Host and configuration details stored with every result document."""
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'pypylon': getattr(pylon, '__version__', None),
+        'stream_mode': getattr(settings, 'CAMERA_STREAM_MODE', 'thread'),
+        'stream_queue_size': getattr(settings, 'CAMERA_STREAM_QUEUE_SIZE', 2),
+        **acquisition_options(),
+    }
+
+
+def sweep(source, cameras, resolutions, pixel_formats, consumers, progress=None, **options):
+    """
+    Runs run_case() for every combination and returns the result document.
+    progress(result) is called after each case.
+    """
+    document = {
+        'version': RESULT_VERSION,
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': environment(),
+        'peak_rss_megabytes': None,
+        'results': [],
+    }
+    for camera_count, (width, height), pixel_format, consumer_count in itertools.product(
+            cameras, resolutions, pixel_formats, consumers):
+        result = run_case(source, camera_count, width, height, pixel_format, consumer_count, **options)
+        document['results'].append(result)
+        if progress:
+            progress(result)
+    document['peak_rss_megabytes'] = round(_peak_rss_bytes() / 1e6, 1)
+    return document
@@ -1,7 +1,10 @@
-import pypylon.pylon as pylon
 import time
 import logging
 import sys
+from .backend import pylon
+from .acquisition import create_converter, grab_to_image
+from .session_pool import session_pool
+from . import configuration, feature_schema
 
 # Set up basic logging
 logging.basicConfig(level=logging.INFO)
@@ -13,8 +16,11 @@ def discover_cameras():
     found_cameras = []
     
     for device_info in devices:
-        # Check if the device is a GigE camera, as only they have IP addresses
-        if "GigE" in device_info.GetDeviceClass():
+        # GigE enumeration already carries the address from the discovery reply;
+        # only ask the device itself when it is missing
+        if device_info.IsIpAddressAvailable():
+            ip_address = device_info.GetIpAddress()
+        elif "GigE" in device_info.GetDeviceClass():
             ip_address = tl_factory.GetDeviceAccessibilityInfo(device_info.GetFullName()).GetAddress()
         else:
             ip_address = None # For USB or other camera types
@@ -24,6 +30,9 @@ def discover_cameras():
             'model_name': device_info.GetModelName(),
             'serial_number': device_info.GetSerialNumber(),
             'ip_address': ip_address,
+            # The host adapter a GigE camera was found on, for grouping cameras that share a link
+            'interface': device_info.GetInterface() if device_info.IsInterfaceAvailable() else None,
+            'subnet_mask': device_info.GetSubnetMask() if device_info.IsSubnetMaskAvailable() else None,
         })
         
     return found_cameras
@@ -31,62 +40,26 @@ def discover_cameras():
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def is_valid_node(node):
-    return all([
-        hasattr(node, "IsAvailable") and node.IsAvailable(),
-        hasattr(node, "IsReadable") and node.IsReadable()
-    ])
-
-def extract_feature(node):
-    try:
-        feature = {"name": node.GetName(), "type": "Unknown", "value": None, "details": {}}
-
-        if pylon.IInteger.IsImplementedBy(node):
-            feature["type"] = "Integer"
-            feature["value"] = node.GetValue()
-            feature["details"] = {"min": node.GetMin(), "max": node.GetMax()}
-        elif pylon.IFloat.IsImplementedBy(node):
-            feature["type"] = "Float"
-            feature["value"] = node.GetValue()
-            feature["details"] = {"min": node.GetMin(), "max": node.GetMax()}
-        elif pylon.IEnumeration.IsImplementedBy(node):
-            feature["type"] = "Enum"
-            feature["value"] = node.GetCurrentEntry().GetSymbolic()
-            entries = [entry.GetSymbolic() for entry in node.GetEntries()
-                       if hasattr(entry, 'IsAvailable') and entry.IsAvailable()]
-            feature["details"] = {"options": entries}
-        elif pylon.IBoolean.IsImplementedBy(node):
-            feature["type"] = "Boolean"
-            feature["value"] = node.GetValue()
-        else:
-            return None
-        return feature
-    except Exception as e:
-        logging.warning(f"Failed to extract feature from node {node.GetName()}: {e}")
-        return None
-
-def get_camera_features(serial_number):
+def get_camera_features(serial_number, refresh=False):
+    """
+    Returns the camera's readable features as {"name", "type", "value", "details"} dicts.
+    Which nodes to read and their types come from the per-model schema index; values
+    are read from the device and cached briefly unless refresh is set, which also
+    rebuilds the schema and re-reads every range and enum option. Otherwise ranges
+    and options are only re-read where a value they depend on changed.
+    """
+    cached = None if refresh else feature_schema.cached_values(serial_number)
+    if cached is not None:
+        return cached
     logging.info(f"Attempting to get features for camera SN: {serial_number}")
     try:
-        tl_factory = pylon.TlFactory.GetInstance()
-        info = pylon.CDeviceInfo()
-        info.SetSerialNumber(serial_number)
-        camera = pylon.InstantCamera(tl_factory.CreateDevice(info))
-        camera.Open()
-        logging.info(f"Successfully opened camera SN: {serial_number}")
-
-        nodemap = camera.GetNodeMap()
-        features_list = []
-
-        for node_name in nodemap.GetNodeNames():
-            node = nodemap.GetNode(node_name)
-            if node is None or not is_valid_node(node):
-                continue
-            feature = extract_feature(node)
-            if feature:
-                features_list.append(feature)
-
-        camera.Close()
+        # Borrow the shared session so this works while the camera is streaming
+        with session_pool.session(serial_number) as session, session.lock:
+            schema = feature_schema.get_schema(session.camera, rebuild=refresh)
+            previous = None if refresh else feature_schema.last_read(serial_number)
+            features_list = feature_schema.read_features(session.camera.GetNodeMap(), schema, previous)
+
+        feature_schema.store_values(serial_number, features_list)
         logging.info(f"Successfully retrieved {len(features_list)} features for SN: {serial_number}")
         return features_list
 
@@ -97,59 +70,121 @@ def get_camera_features(serial_number):
         logging.error(f"GENERAL_ERROR for SN {serial_number}: {e}")
         raise Exception(f"A general error occurred: {e}")
     
-def apply_configuration(serial_number, settings_dict):
+def get_camera_settings(serial_number):
+    """The current values of the camera's features that a profile stores, as {name: value}."""
+    with session_pool.session(serial_number) as session, session.lock:
+        nodemap = session.camera.GetNodeMap()
+        schema = [
+            entry for entry in feature_schema.get_schema(session.camera)
+            if nodemap.GetNode(entry["name"]) is not None and feature_schema.is_setting(nodemap.GetNode(entry["name"]))
+        ]
+        features = feature_schema.read_features(nodemap, schema)
+    return {feature["name"]: feature["value"] for feature in features}
+
+
+def apply_configuration(serial_number, settings_dict, pin=None):
     """
-    Applies a dictionary of settings to a camera by dynamically finding each feature.
-    
+    Applies a dictionary of settings to a camera, writing only values that differ
+    from the camera's current ones, in dependency order (see configuration.py).
+    When the profile has a valid pinned copy (`pin`, see configuration.load_pinned)
+    it is loaded in one step instead.
+
     Example settings_dict: {"Gain": 15.0, "PixelFormat": "Mono8", "ReverseX": True}
+    Returns (success, message, report) where report has one written/skipped/rejected
+    entry per feature; success means nothing was rejected.
     """
     try:
-        tl_factory = pylon.TlFactory.GetInstance()
-        info = pylon.CDeviceInfo()
-        info.SetSerialNumber(serial_number)
-        camera = pylon.InstantCamera(tl_factory.CreateDevice(info))
-        camera.Open()
-        nodemap = camera.GetNodeMap()
-
-        for feature_name, new_value in settings_dict.items():
-            node = nodemap.GetNode(feature_name)
-            if pylon.IsWritable(node):
-                # This dynamically sets the value regardless of feature type
-                node.SetValue(new_value)
-        
-        camera.Close()
-        return True, "Settings applied successfully."
+        started = time.monotonic()
+        with session_pool.session(serial_number) as session, session.lock:
+            loaded = None
+            try:
+                loaded = configuration.load_pinned(session.camera, serial_number, settings_dict, pin)
+            except Exception as e:
+                logging.warning(f"[{serial_number}] Loading the pinned configuration failed, writing features instead: {e}")
+            if loaded is None:
+                report = configuration.apply_settings(session.camera, settings_dict)
+        feature_schema.invalidate_values(serial_number)
     except Exception as e:
-        return False, str(e)
-
-
-def start_grabbing_frames(serial_number, frame_queue):
-    """Grabs frames from a camera and puts them in a queue."""
-    # This function will run in a separate thread managed by the consumer.
-    try:
-        tl_factory = pylon.TlFactory.GetInstance()
-        camera = pylon.InstantCamera(tl_factory.CreateDevice(pylon.CDeviceInfo().SetSerialNumber(serial_number)))
-        camera.Open()
+        logging.error(f"[{serial_number}] Applying settings failed: {e}")
+        return False, str(e), []
 
-        # Set camera to continuous frame acquisition
-        camera.StartGrabbing(pylon.GrabStrategy_LatestOneOnly)
-        converter = pylon.ImageFormatConverter()
-        converter.OutputPixelFormat = pylon.PixelType_BGR8packed
-        converter.OutputBitAlignment = pylon.OutputBitAlignment_MsbAligned
+    if loaded is not None:
+        source = f"user set {pin['user_set']}" if loaded == "user_set" else "the cached feature file"
+        message = f"Loaded {len(settings_dict)} setting(s) from {source}."
+        logging.info(f"[{serial_number}] {message} ({(time.monotonic() - started) * 1000:.0f} ms)")
+        return True, message, []
 
-        while camera.IsGrabbing():
-            grab_result = camera.RetrieveResult(5000, pylon.TimeoutHandling_ThrowException)
+    counts = configuration.summarize(report)
+    message = (
+        f"{counts['written']} setting(s) changed, {counts['skipped']} unchanged, "
+        f"{counts['rejected']} rejected."
+    )
+    logging.info(f"[{serial_number}] {message} ({(time.monotonic() - started) * 1000:.0f} ms)")
+    return counts['rejected'] == 0, message, report
 
-            if grab_result.GrabSucceeded():
-                image = converter.Convert(grab_result)
-                frame = image.GetArray()
-                # Put the frame into the queue for the WebSocket to send
-                frame_queue.put(frame)
 
+def pin_configuration(serial_number, settings_dict, user_set=None):
+    """
+    Applies a profile and stores the result on the camera (in `user_set`, if given)
+    and as a .pfs string, so later activations can load it in one step.
+    Returns (success, message, pin fields or None, report).
+    """
+    success, message, report = apply_configuration(serial_number, settings_dict)
+    if not success:
+        return False, f"Not pinned, the profile could not be applied: {message}", None, report
+    try:
+        with session_pool.session(serial_number) as session, session.lock:
+            pfs_data = configuration.save_pinned(session.camera, user_set)
+            key = configuration.pin_key(session.camera)
+    except Exception as e:
+        logging.error(f"[{serial_number}] Pinning settings failed: {e}")
+        return False, str(e), None, report
+    pin = {
+        'user_set': user_set or '',
+        'pfs_data': pfs_data,
+        'pin_key': key,
+        'pin_digest': configuration.settings_digest(settings_dict),
+    }
+    target = f"user set {user_set} and a feature file" if user_set else "a feature file"
+    return True, f"Profile pinned to {target}.", pin, report
+
+
+def grab_one(serial_number, timeout_ms=1000):
+    """
+    Grabs a single frame through the shared session while no stream is running.
+    Returns (frame id, timestamp in ms since the epoch, image).
+    """
+    with session_pool.session(serial_number) as session, session.lock:
+        grab_result = session.camera.GrabOne(timeout_ms)
+        try:
+            if not grab_result.GrabSucceeded():
+                raise Exception(f"Grab failed: {grab_result.GetErrorDescription()}")
+            image = grab_to_image(grab_result, create_converter())
+            return grab_result.GetID(), time.time() * 1000.0, image
+        finally:
             grab_result.Release()
-            time.sleep(0.03) # Adjust for desired frame rate
 
-        camera.Close()
+
+def start_grabbing_frames(serial_number, frame_queue):
+    """Grabs frames from a camera and puts them in a queue."""
+    # This function will run in a separate thread managed by the consumer.
+    try:
+        with session_pool.camera(serial_number) as camera:
+            # Set camera to continuous frame acquisition
+            camera.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)
+            converter = create_converter()
+
+            while camera.IsGrabbing():
+                grab_result = camera.RetrieveResult(5000, pylon.TimeoutHandling_ThrowException)
+
+                if grab_result.GrabSucceeded():
+                    # Mono frames stay single-channel; see acquisition.grab_to_image
+                    frame = grab_to_image(grab_result, converter)
+                    # Put the frame into the queue for the WebSocket to send
+                    frame_queue.put(frame)
+
+                grab_result.Release()
+                time.sleep(0.03) # Adjust for desired frame rate
     except Exception as e:
         logging.error(f"Error in grabbing frames for {serial_number}: {e}")
         frame_queue.put(None) # Signal error/end
\ No newline at end of file
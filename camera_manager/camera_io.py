@@ -0,0 +1,74 @@
+# camera_manager/camera_io.py
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+from .metrics import call_metrics
+
+# Blocking pylon calls made on behalf of HTTP requests run on this bounded pool
+# instead of the server's request thread, so a slow camera only ever occupies
+# one of these workers while list and profile queries keep being answered.
+# Identical requests that arrive while one is already running share its result.
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'CAMERA_IO_WORKERS', 8), thread_name_prefix='camera-io'
+)
+# key -> concurrent.futures.Future of the call currently running for that key
+_in_flight = {}
+_lock = threading.Lock()
+
+
+def _run(fn, args, kwargs):
+    # Pool threads live for the whole process; drop database connections that went stale
+    close_old_connections()
+    metrics = call_metrics(fn.__name__)
+    started = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    except Exception:
+        metrics.errors.inc()
+        raise
+    finally:
+        metrics.duration.observe(time.perf_counter() - started)
+        close_old_connections()
+
+
+def _forget(key, future):
+    with _lock:
+        if _in_flight.get(key) is future:
+            del _in_flight[key]
+
+
+def submit(key, fn, *args, **kwargs):
+    """
+    Runs fn(*args, **kwargs) on the camera I/O pool and returns its Future.
+    While a call with the same non-None key is in flight, its Future is returned instead.
+    """
+    if key is None:
+        return _executor.submit(_run, fn, args, kwargs)
+    with _lock:
+        future = _in_flight.get(key)
+        if future is not None:
+            call_metrics(fn.__name__).coalesced.inc()
+            return future
+        future = _executor.submit(_run, fn, args, kwargs)
+        _in_flight[key] = future
+    future.add_done_callback(lambda done: _forget(key, done))
+    return future
+
+
+async def call(key, fn, *args, timeout=None, **kwargs):
+    """
+    Awaits a submit()ted call. Raises asyncio.TimeoutError after `timeout` seconds
+    (CAMERA_IO_TIMEOUT by default); the call itself keeps running for any other waiters.
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'CAMERA_IO_TIMEOUT', 10.0)
+    future = submit(key, fn, *args, **kwargs)
+    try:
+        return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+    except asyncio.TimeoutError:
+        call_metrics(fn.__name__).timeouts.inc()
+        raise
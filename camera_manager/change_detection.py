@@ -0,0 +1,80 @@
+# camera_manager/change_detection.py
+import numpy as np
+from .backend import cv2
+
+# Change detection for mostly static scenes. Each frame is reduced to a small
+# grayscale copy in which every tile of the full image becomes a CELLS x CELLS block
+# of averaged pixels, and compared with the copy of what clients currently show.
+# Averaging suppresses sensor noise; taking the largest cell difference per tile
+# still catches small objects. Like acquisition.py this must not depend on Django.
+
+# Cells per tile side in the reduced copy
+CELLS = 4
+# Above this share of changed tiles a full frame is cheaper than the tiles
+KEYFRAME_SHARE = 0.5
+
+
+class ChangeDetector:
+    """
+    Decides per grabbed frame whether it is sent as a keyframe, as changed tiles, or
+    not at all. The reference follows what a client compositing the tiles displays:
+    replaced entirely by a keyframe, tile by tile by a delta, so slow drifts add up
+    until they cross the threshold.
+    """
+    def __init__(self, tile_size=64, threshold=4.0, keyframe_interval=2.0):
+        if tile_size % CELLS:
+            raise ValueError(f"tile_size must be a multiple of {CELLS}.")
+        self.tile_size = tile_size
+        self.threshold = threshold
+        self.keyframe_interval = keyframe_interval
+        self._reference = None
+        self._next_keyframe = 0.0
+
+    def reduce(self, image):
+        """Grayscale copy of the image with CELLS x CELLS cells per tile; partial edge tiles are padded."""
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        height, width = gray.shape
+        pad_bottom = -height % self.tile_size
+        pad_right = -width % self.tile_size
+        if pad_bottom or pad_right:
+            gray = cv2.copyMakeBorder(gray, 0, pad_bottom, 0, pad_right, cv2.BORDER_REPLICATE)
+        factor = self.tile_size // CELLS
+        return cv2.resize(gray, (gray.shape[1] // factor, gray.shape[0] // factor), interpolation=cv2.INTER_AREA)
+
+    def detect(self, image, now, force_keyframe=False):
+        """
+        Returns (True, None) for a keyframe, (False, changed) for a delta where
+        `changed` is a boolean (rows, cols) tile grid, or None for a frame to skip.
+        `now` is a monotonic time in seconds.
+        """
+        small = self.reduce(image)
+        rows, cols = small.shape[0] // CELLS, small.shape[1] // CELLS
+        if not force_keyframe and self._reference is not None and self._reference.shape == small.shape \
+                and now < self._next_keyframe:
+            cells = cv2.absdiff(small, self._reference).reshape(rows, CELLS, cols, CELLS)
+            changed = cells.max(axis=(1, 3)) > self.threshold
+            if not changed.any():
+                return None
+            if changed.mean() <= KEYFRAME_SHARE:
+                np.copyto(self._reference.reshape(rows, CELLS, cols, CELLS), small.reshape(rows, CELLS, cols, CELLS),
+                          where=changed[:, None, :, None])
+                return False, changed
+        self._reference = small
+        self._next_keyframe = now + self.keyframe_interval
+        return True, None
+
+
+def changed_runs(changed):
+    """Horizontal runs of changed tiles as (row, first column, column count), one JPEG each."""
+    runs = []
+    for row, flags in enumerate(changed):
+        column = 0
+        while column < len(flags):
+            if not flags[column]:
+                column += 1
+                continue
+            start = column
+            while column < len(flags) and flags[column]:
+                column += 1
+            runs.append((row, start, column - start))
+    return runs
@@ -0,0 +1,331 @@
+# camera_manager/configuration.py
+import hashlib
+import json
+import math
+import threading
+import logging
+from . import feature_schema
+from .backend import genicam, pylon
+
+# Applying a profile reads the current value of every feature it names in one pass,
+# then writes only the ones that differ. Writes are ordered so that a feature goes
+# after the features its value or range depends on: selectors before the features
+# they select, and nodes listed in another node's pDependent (the GenICam invalidator
+# relation, e.g. Width -> OffsetX) before that node. A write that is rejected because
+# something later in the profile still had to move (OffsetX before a wider Width) is
+# retried once the others have been written. A write can also move features that
+# were unchanged when read; those are read again and written in the next pass.
+# Registers, invisible nodes and read-only features are not settings: their values
+# follow from the features, and writing back a stale copy would undo them.
+
+# Interactions the XML does not express as dependencies: auto functions lock their
+# manual value, the frame rate limit must be enabled before it is set, and binning
+# and pixel format change the allowed image size.
+WRITE_BEFORE = (
+    ('ExposureAuto', ('ExposureTime', 'ExposureTimeAbs', 'ExposureTimeRaw')),
+    ('GainAuto', ('Gain', 'GainAbs', 'GainRaw')),
+    ('BalanceWhiteAuto', ('BalanceRatio', 'BalanceRatioAbs', 'BalanceRatioRaw')),
+    ('AcquisitionFrameRateEnable', ('AcquisitionFrameRate', 'AcquisitionFrameRateAbs')),
+    ('PixelFormat', ('Width', 'Height', 'OffsetX', 'OffsetY')),
+    ('BinningHorizontal', ('Width', 'OffsetX')),
+    ('BinningVertical', ('Height', 'OffsetY')),
+    ('DecimationHorizontal', ('Width', 'OffsetX')),
+    ('DecimationVertical', ('Height', 'OffsetY')),
+    ('Width', ('OffsetX',)),
+    ('Height', ('OffsetY',)),
+)
+
+WRITTEN = 'written'
+SKIPPED = 'skipped'
+REJECTED = 'rejected'
+
+# schema key -> {feature name: set of node names that depend on it}
+_dependents = {}
+_dependents_lock = threading.Lock()
+
+
+def values_equal(current, target, feature_type):
+    if feature_type == "Float":
+        return math.isclose(float(current), float(target), rel_tol=1e-6, abs_tol=1e-9)
+    if feature_type == "Boolean":
+        return bool(current) == bool(target)
+    if feature_type == "Integer":
+        return int(current) == int(target)
+    return current == target
+
+
+def coerce_value(value, feature_type):
+    if feature_type == "Integer":
+        return int(value)
+    if feature_type == "Float":
+        return float(value)
+    if feature_type == "Boolean":
+        return bool(value)
+    return str(value)
+
+
+def _is_category(node):
+    return isinstance(node, genicam.ICategory)
+
+
+def dependents_of(nodemap, name):
+    """
+    Names of all nodes whose value, range or access depends on `name`, following
+    pDependent through intermediate nodes (e.g. Width -> OffsetXMax -> OffsetX).
+    Category nodes are not followed.
+    """
+    seen = set()
+    stack = [name]
+    while stack:
+        node = nodemap.GetNode(stack.pop())
+        if node is None:
+            continue
+        inner = node.GetNode()
+        if 'pDependent' not in inner.GetPropertyNames():
+            continue
+        for dependent in inner.GetProperty('pDependent')[0].split('\t'):
+            if not dependent or dependent in seen:
+                continue
+            child = nodemap.GetNode(dependent)
+            if child is None or _is_category(child):
+                continue
+            seen.add(dependent)
+            stack.append(dependent)
+    return seen
+
+
+def selectors_of(node):
+    names = []
+    for selector in node.GetNode().GetSelectingFeatures():
+        try:
+            names.append(selector.GetNode().GetName())
+        except genicam.GenericException:
+            # Unbound selector parameter; nothing to order against
+            continue
+    return names
+
+
+def cached_dependents(nodemap, key, name):
+    """dependents_of(), cached per schema key."""
+    with _dependents_lock:
+        known = _dependents.setdefault(key, {})
+        dependents = known.get(name)
+    if dependents is None:
+        dependents = dependents_of(nodemap, name)
+        with _dependents_lock:
+            known[name] = dependents
+    return dependents
+
+
+def write_order(nodemap, key, names):
+    """
+    Orders feature names so that dependencies are written first. Ties keep the
+    profile's order; a dependency cycle is broken at its earliest feature.
+    """
+    position = {name: index for index, name in enumerate(names)}
+    before = {name: set() for name in names}
+    for name in names:
+        dependents = cached_dependents(nodemap, key, name)
+        for dependent in dependents & position.keys():
+            if dependent != name:
+                before[dependent].add(name)
+        node = nodemap.GetNode(name)
+        if node is not None:
+            for selector in selectors_of(node):
+                if selector in position and selector != name:
+                    before[name].add(selector)
+    for first, thens in WRITE_BEFORE:
+        if first in position:
+            for then in thens:
+                if then in position:
+                    before[then].add(first)
+
+    ordered = []
+    remaining = list(names)
+    unwritten = set(names)
+    while remaining:
+        # Cycle: fall back to profile order for its earliest member
+        name = next((name for name in remaining if not before[name] & unwritten), remaining[0])
+        ordered.append(name)
+        remaining.remove(name)
+        unwritten.discard(name)
+    return ordered
+
+
+def is_locked(nodemap, node):
+    """True while a node is write-protected by its pIsLocked flag, e.g. TLParamsLocked during grabbing."""
+    inner = node.GetNode()
+    if 'pIsLocked' not in inner.GetPropertyNames():
+        return False
+    lock = nodemap.GetNode(inner.GetProperty('pIsLocked')[0])
+    return lock is not None and genicam.IsReadable(lock) and bool(lock.GetValue())
+
+
+def _entry(name, status, value, reason=None):
+    entry = {"name": name, "status": status, "value": value}
+    if reason:
+        entry["reason"] = reason
+    return entry
+
+
+def _write(node, name, target, feature_type):
+    """Writes one value and returns its report entry; raises if the device refuses it."""
+    node.SetValue(coerce_value(target, feature_type))
+    actual = feature_schema.read_value(node, feature_type) if genicam.IsReadable(node) else target
+    if feature_type in ("Integer", "Float") and not values_equal(actual, target, feature_type):
+        return _entry(name, WRITTEN, actual, f"clamped from {target}")
+    return _entry(name, WRITTEN, actual)
+
+
+def _unchanged(node, feature_type, target):
+    return genicam.IsReadable(node) and values_equal(feature_schema.read_value(node, feature_type), target, feature_type)
+
+
+def apply_settings(camera, settings_dict, max_passes=3):
+    """
+    Applies {feature name: value} to an open camera, writing only changed values in
+    dependency order. Returns one {"name", "status", "value"[, "reason"]} entry per
+    feature, in the profile's order.
+    Callers hold the camera session's lock.
+    """
+    nodemap = camera.GetNodeMap()
+    key = feature_schema.schema_key(camera)
+    report = {}
+    pending = {}
+
+    # One read pass: unknown, unreadable and unchanged features are settled up front
+    for name, target in settings_dict.items():
+        node = nodemap.GetNode(name)
+        feature_type = feature_schema.node_type(node) if node is not None else None
+        if feature_type is None:
+            report[name] = _entry(name, REJECTED, target, "not a supported feature on this camera")
+            continue
+        if not feature_schema.is_setting(node):
+            report[name] = _entry(name, SKIPPED, target, "not a setting")
+            continue
+        try:
+            if _unchanged(node, feature_type, target):
+                report[name] = _entry(name, SKIPPED, target, "unchanged")
+                continue
+        except (TypeError, ValueError) as e:
+            report[name] = _entry(name, REJECTED, target, f"invalid value: {e}")
+            continue
+        pending[name] = (node, feature_type, target)
+
+    order = write_order(nodemap, key, list(pending))
+    failed = {}
+    for _ in range(max_passes):
+        failed = {}
+        # Features whose value may have moved since it was read, because a feature
+        # they depend on was written (e.g. a narrower Width clamps OffsetX)
+        affected = set()
+        for name in order:
+            node, feature_type, target = pending[name]
+            if name in affected and _unchanged(node, feature_type, target):
+                report[name] = _entry(name, SKIPPED, target, "unchanged")
+                continue
+            if not genicam.IsWritable(node):
+                failed[name] = None
+                continue
+            try:
+                report[name] = _write(node, name, target, feature_type)
+            except genicam.GenericException as e:
+                failed[name] = str(e).split(' : ')[0]
+                continue
+            affected |= cached_dependents(nodemap, key, name)
+        # Features found unchanged before the writes are checked again
+        moved = []
+        for name in affected & settings_dict.keys():
+            entry = report.get(name)
+            if entry is None or entry.get("reason") != "unchanged" or name in pending and name in failed:
+                continue
+            node = nodemap.GetNode(name)
+            feature_type = feature_schema.node_type(node)
+            if not _unchanged(node, feature_type, settings_dict[name]):
+                pending[name] = (node, feature_type, settings_dict[name])
+                moved.append(name)
+        # Retry only while the previous pass made progress
+        if not moved and (not failed or len(failed) == len(order)):
+            break
+        order = write_order(nodemap, key, [name for name in order if name in failed] + moved)
+    else:
+        for name in order:
+            if name not in failed:
+                failed[name] = "changed again by another feature of the profile"
+    for name, reason in failed.items():
+        node, _, target = pending[name]
+        if reason is None and not is_locked(nodemap, node):
+            # Read-only values (e.g. WidthMax) and values an active auto function controls
+            # are saved with profiles but are not settings to restore
+            report[name] = _entry(name, SKIPPED, target, "read-only in the camera's current state")
+            continue
+        reason = reason or "locked while the camera is grabbing"
+        report[name] = _entry(name, REJECTED, target, reason)
+        logging.warning(f"Feature {name} rejected: {reason}")
+
+    return [report[name] for name in settings_dict if name in report]
+
+
+def summarize(report):
+    counts = {WRITTEN: 0, SKIPPED: 0, REJECTED: 0}
+    for entry in report:
+        counts[entry["status"]] += 1
+    return counts
+
+
+# --- Pinned copies ---
+# A profile can be pinned to an on-camera user set and/or cached as a pylon
+# feature-persistence (.pfs) string. Activating a valid pinned copy is one
+# UserSetLoad or one bulk load instead of a read and write per feature.
+
+def settings_digest(settings_dict):
+    """Identifies the profile contents a pinned copy was made from."""
+    return hashlib.sha256(json.dumps(settings_dict, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def pin_key(camera):
+    """Model and firmware a .pfs string was saved on; it only loads cleanly on the same pair."""
+    return "/".join(feature_schema.schema_key(camera))
+
+
+def save_pinned(camera, user_set=None):
+    """
+    Stores the camera's current configuration: in `user_set` on the device when
+    given, and always as a .pfs string. Returns the .pfs string.
+    Callers hold the camera session's lock.
+    """
+    nodemap = camera.GetNodeMap()
+    if user_set:
+        selector = nodemap.GetNode("UserSetSelector")
+        save = nodemap.GetNode("UserSetSave")
+        if selector is None or save is None or not genicam.IsWritable(save):
+            raise ValueError("This camera cannot save user sets.")
+        if user_set not in selector.GetSymbolics():
+            raise ValueError(f"Unknown user set '{user_set}'. Available: {', '.join(selector.GetSymbolics())}.")
+        selector.SetValue(user_set)
+        save.Execute()
+    return pylon.FeaturePersistence.SaveToString(nodemap)
+
+
+def load_pinned(camera, serial_number, settings_dict, pin):
+    """
+    Activates a profile's pinned copy if it is still valid for this camera and the
+    profile's current contents. `pin` holds the profile's user_set, pfs_data,
+    pin_key, pin_digest and the serial number the user set lives on.
+    Returns how the profile was loaded ("user_set" or "pfs"), or None when the
+    caller should fall back to apply_settings. Callers hold the session's lock.
+    """
+    if not pin or pin.get("pin_digest") != settings_digest(settings_dict):
+        return None
+    if camera.IsGrabbing():
+        # Both bulk paths touch locked transport parameters
+        return None
+    nodemap = camera.GetNodeMap()
+    if pin.get("user_set") and pin.get("serial_number") == serial_number:
+        nodemap.GetNode("UserSetSelector").SetValue(pin["user_set"])
+        nodemap.GetNode("UserSetLoad").Execute()
+        return "user_set"
+    if pin.get("pfs_data") and pin.get("pin_key") == pin_key(camera):
+        pylon.FeaturePersistence.LoadFromString(pin["pfs_data"], nodemap, True)
+        return "pfs"
+    return None
@@ -0,0 +1,70 @@
+# camera_manager/connections.py
+import functools
+
+# What the server knows about a client connection that ASGI does not tell the
+# application. Daphne's send() returns as soon as Twisted has buffered a message,
+# so a client that reads slowly never makes a sender wait: its frames pile up in
+# the server's write buffer instead. Stream senders look at the bytes still
+# unsent to that client and hold back while they exceed a budget, which lets
+# their channel drop frames (latest wins) the way a blocking send would.
+
+SCOPE_KEY = 'camera_manager.connection'
+
+
+def _unsent(transport):
+    # Twisted's FileDescriptor: data handed to write() that the socket has not taken yet
+    while transport is not None:
+        if hasattr(transport, 'dataBuffer'):
+            # Read from another thread than the reactor's, so only an estimate
+            return max(len(transport.dataBuffer) - transport.offset + transport._tempDataLen, 0)
+        # TLS and other wrapping protocols
+        transport = getattr(transport, 'transport', None)
+    return None
+
+
+class Connection:
+    """One client connection, as seen by ConnectionMiddleware."""
+
+    def __init__(self, receive, send):
+        self._receive = receive
+        # Daphne hands applications partial(server.handle_reply, protocol)
+        protocol = send.args[0] if isinstance(send, functools.partial) and send.args else None
+        self._transport = getattr(protocol, 'transport', None)
+
+    def unsent_bytes(self):
+        """
+        Bytes sent to this client that the server has not written to its socket yet,
+        or None where the server does not say (servers whose send() waits for the
+        socket already slow the sender down themselves).
+        """
+        try:
+            return _unsent(self._transport)
+        except AttributeError:
+            return None
+
+    async def disconnected(self):
+        """
+        Returns once an HTTP client has gone away. Only for requests whose body was
+        read already: Django 4.2 stops listening for http.disconnect once it has the body.
+        """
+        while True:
+            message = await self._receive()
+            if message['type'] == 'http.disconnect':
+                return
+
+
+class ConnectionMiddleware:
+    """Adds a Connection to every HTTP and WebSocket scope under SCOPE_KEY."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] in ('http', 'websocket'):
+            scope = dict(scope, **{SCOPE_KEY: Connection(receive, send)})
+        return await self.app(scope, receive, send)
+
+
+def connection_of(scope):
+    """The scope's Connection, or None outside ConnectionMiddleware (e.g. in tests)."""
+    return scope.get(SCOPE_KEY) if scope else None
@@ -1,13 +1,31 @@
 # camera_manager/consumers.py
 import json
+import threading
+import logging
+from urllib.parse import parse_qs
 from channels.generic.websocket import WebsocketConsumer
+from django.db import close_old_connections
+from .connections import connection_of
+from .events import event_log
+from .models import Camera
 # Import the global manager instance we just created
 from .stream_manager import stream_manager
+from .frames import TRANSPORT_BINARY, TRANSPORT_JSON, TRANSPORTS, Subscription
 
 class CameraStreamConsumer(WebsocketConsumer):
     def connect(self):
         # Get the serial number from the URL
         self.serial_number = self.scope['url_route']['kwargs']['serial_number']
+        # Clients opt into binary frames with ?transport=binary; JSON stays the default
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        requested = query.get('transport', [TRANSPORT_JSON])[0]
+        self.transport = requested if requested in TRANSPORTS else TRANSPORT_JSON
+        # Initial subscription may also come from the URL, e.g. ?max_width=320&quality=60&fps=5;
+        # ?delta=1 asks for changed tiles between full frames when change detection is on
+        try:
+            self.subscription = Subscription.from_dict({key: values[0] for key, values in query.items()})
+        except ValueError:
+            self.subscription = Subscription()
         self.accept()
         
         # Register this consumer with the manager
@@ -17,6 +35,102 @@ class CameraStreamConsumer(WebsocketConsumer):
         # Unregister this consumer from the manager
         stream_manager.stop_stream(self.serial_number, self)
 
-    def receive(self, text_data):
-        # We don't need to handle incoming messages for this app
-        pass
\ No newline at end of file
+    def receive(self, text_data=None, bytes_data=None):
+        # Clients may switch transport, e.g. {"transport": "json"}, and/or change what they
+        # receive, e.g. {"max_width": 320, "quality": 60, "fps": 5}
+        if not text_data:
+            return
+        try:
+            message = json.loads(text_data)
+        except ValueError:
+            return
+        if not isinstance(message, dict):
+            return
+        if message.get('transport') in TRANSPORTS:
+            self.transport = message['transport']
+        if any(field in message for field in Subscription.FIELDS):
+            try:
+                self.subscription = Subscription.from_dict(message, base=self.subscription)
+            except ValueError as e:
+                self.send(text_data=json.dumps({'error': str(e)}))
+                return
+            stream_manager.update_subscription(self.serial_number, self, self.subscription)
+
+    def send_frame(self, frame):
+        """Sends one EncodedFrame in this consumer's negotiated wire format."""
+        if self.transport == TRANSPORT_BINARY:
+            self.send(bytes_data=frame.as_bytes())
+        else:
+            self.send(text_data=frame.as_json())
+
+    def unsent_bytes(self):
+        """Bytes of earlier frames still in the server's buffer for this client, if known."""
+        connection = connection_of(self.scope)
+        return connection.unsent_bytes() if connection else None
+
+
+class CameraEventsConsumer(WebsocketConsumer):
+    """
+    Pushes camera inventory and activity events. A new client first receives a
+    {"type": "snapshot"} of all cameras and running streams, then every event after
+    it. A client reconnecting with ?since=<seq>&epoch=<epoch> gets
+    {"type": "resumed"} and only the events it missed, from whichever worker it
+    reconnects to; when those are no longer kept, or the epoch names another
+    database, it gets a fresh snapshot instead.
+    """
+    # Seconds between checks whether the client is still connected
+    POLL_INTERVAL = 1.0
+
+    def connect(self):
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        try:
+            since = int(query['since'][0])
+        except (KeyError, ValueError):
+            since = None
+        epoch = query.get('epoch', [None])[0]
+        self._closed = threading.Event()
+        self.accept()
+        # Events are sent from a thread tailing the log, like stream frames from their sender thread
+        threading.Thread(target=self._run, args=(since, epoch), daemon=True).start()
+
+    def disconnect(self, close_code):
+        self._closed.set()
+        event_log.wake()
+
+    def _send_snapshot(self):
+        # Taken before reading the table: events racing with the read are sent again
+        # afterwards, and applying one twice leaves the same state
+        seq = event_log.latest_seq()
+        try:
+            cameras = list(Camera.objects.values('serial_number', 'friendly_name', 'model_name', 'current_ip', 'status'))
+        finally:
+            close_old_connections()
+        self.send(text_data=json.dumps({
+            'type': 'snapshot',
+            'epoch': event_log.epoch,
+            'seq': seq,
+            'cameras': cameras,
+            'streams': sorted(stream_manager.get_consumer_counts()),
+        }))
+        return seq
+
+    def _run(self, since, epoch):
+        try:
+            if since is not None and epoch == event_log.epoch and event_log.events_after(since) is not None:
+                seq = since
+                self.send(text_data=json.dumps({'type': 'resumed', 'epoch': event_log.epoch, 'seq': seq}))
+            else:
+                seq = self._send_snapshot()
+            while not self._closed.is_set():
+                pending = event_log.wait_after(seq, self.POLL_INTERVAL)
+                if pending is None:
+                    # Fell behind the kept history
+                    seq = self._send_snapshot()
+                    continue
+                for seq, text in pending:
+                    if self._closed.is_set():
+                        return
+                    self.send(text_data=text)
+        except Exception as e:
+            logging.warning(f"Camera event subscriber stopped: {e}")
+
@@ -0,0 +1,183 @@
+# camera_manager/discovery.py
+import threading
+import time
+import logging
+from concurrent.futures import Future
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from .models import Camera
+from .camera_interface import discover_cameras
+from . import events
+
+# Enumerating a plant network takes seconds, so it runs on a background thread on a
+# fixed interval instead of inside the scan request. Each pass is diffed against the
+# Camera table and only cameras that appeared, changed or disappeared are written,
+# in at most three bulk queries.
+
+SYNCED_FIELDS = ('model_name', 'current_ip', 'status')
+
+
+def diff_inventory(found_cameras, known):
+    """
+    Compares one enumeration with the table's current rows.
+    `known` maps serial number -> (model_name, current_ip, status).
+    Returns (rows to upsert as field dicts, serial numbers to mark offline).
+    """
+    upserts = []
+    found_serials = set()
+    for cam_data in found_cameras:
+        serial_number = cam_data['serial_number']
+        found_serials.add(serial_number)
+        row = (cam_data['model_name'], cam_data.get('ip_address'), 'Online')
+        if known.get(serial_number) != row:
+            upserts.append(dict(zip(SYNCED_FIELDS, row), serial_number=serial_number))
+    gone = [
+        serial_number for serial_number, (_, _, camera_status) in known.items()
+        if serial_number not in found_serials and camera_status != 'Offline'
+    ]
+    return upserts, gone
+
+
+def inventory_events(upserts, gone, known):
+    """
+    Events for one diff_inventory() result: [(event type, serial number, data)].
+    A camera that is new or was offline appeared; an online camera whose model or
+    address changed reports the changed fields as [old, new].
+    """
+    changes = []
+    for fields in upserts:
+        serial_number = fields['serial_number']
+        previous = known.get(serial_number)
+        if previous is None or previous[2] != 'Online':
+            changes.append((events.CAMERA_APPEARED, serial_number,
+                            {'model_name': fields['model_name'], 'current_ip': fields['current_ip']}))
+            continue
+        changed = {
+            field: [old, fields[field]]
+            for field, old in zip(SYNCED_FIELDS, previous) if old != fields[field]
+        }
+        changes.append((events.CAMERA_CHANGED, serial_number, {'changes': changed}))
+    changes.extend((events.CAMERA_DISAPPEARED, serial_number, {}) for serial_number in gone)
+    return changes
+
+
+def sync_inventory(found_cameras):
+    """Writes the difference between an enumeration and the Camera table. Returns the number of rows changed."""
+    rows = Camera.objects.values_list('id', 'serial_number', *SYNCED_FIELDS)
+    ids = {serial_number: pk for pk, serial_number, *_ in rows}
+    known = {serial_number: tuple(fields) for _, serial_number, *fields in rows}
+    upserts, gone = diff_inventory(found_cameras, known)
+    # Bulk writes bypass auto_now on updates, so the timestamp is set explicitly
+    now = timezone.now()
+    # Known rows are updated and new ones inserted separately: an upsert on
+    # serial_number needs ON CONFLICT targets, which the MySQL backend does not support
+    changed = [
+        Camera(id=ids[fields['serial_number']], **fields, updated_at=now)
+        for fields in upserts if fields['serial_number'] in ids
+    ]
+    if changed:
+        Camera.objects.bulk_update(changed, [*SYNCED_FIELDS, 'updated_at'])
+    new = [Camera(**fields, updated_at=now) for fields in upserts if fields['serial_number'] not in ids]
+    if new:
+        Camera.objects.bulk_create(new)
+    if gone:
+        Camera.objects.filter(serial_number__in=gone).update(status='Offline', updated_at=now)
+    for event_type, serial_number, data in inventory_events(upserts, gone, known):
+        events.publish(event_type, serial_number, **data)
+    return len(upserts) + len(gone)
+
+
+class DiscoveryService:
+    """
+    Background camera enumeration. `snapshot()` returns the latest result without
+    touching the network; `request_scan()` wakes the thread early and returns a
+    Future resolved with the snapshot of the next completed pass, shared by every
+    caller that asked while it was pending.
+    Only one process should run the loop (see CAMERA_DISCOVERY_IN_SERVER and the
+    run_discovery command); in the others a requested scan is a single pass.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self._cameras = []
+        self._scanned_at = None
+        self._pending = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        logging.info(f"Camera discovery started (every {self.interval}s).")
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'scanned_at': self._scanned_at.isoformat() if self._scanned_at else None,
+                'cameras': list(self._cameras),
+            }
+
+    def request_scan(self):
+        with self._lock:
+            one_off = self._pending is None and self._thread is None
+            if self._pending is None:
+                self._pending = Future()
+            future = self._pending
+        if one_off:
+            threading.Thread(target=self.scan_once, daemon=True).start()
+        else:
+            self._wake.set()
+        return future
+
+    def cameras(self):
+        """
+        The latest discovered cameras. Without the background loop in this process,
+        enumerates first when the last pass is older than the interval.
+        """
+        with self._lock:
+            stale = self._thread is None and (
+                self._scanned_at is None or (timezone.now() - self._scanned_at).total_seconds() > self.interval
+            )
+        if stale:
+            self.scan_once()
+        return self.snapshot()['cameras']
+
+    def scan_once(self):
+        """Runs one enumeration and database sync on the calling thread."""
+        with self._lock:
+            # Callers that ask from now on need a pass that starts after their request
+            waiting, self._pending = self._pending, None
+        try:
+            started = time.monotonic()
+            found_cameras = discover_cameras()
+            close_old_connections()
+            changed = sync_inventory(found_cameras)
+            with self._lock:
+                self._cameras = found_cameras
+                self._scanned_at = timezone.now()
+            if changed:
+                logging.info(
+                    f"Discovery found {len(found_cameras)} camera(s); updated {changed} row(s) "
+                    f"in {time.monotonic() - started:.2f}s."
+                )
+        except Exception as e:
+            logging.error(f"Camera discovery failed: {e}")
+            if waiting is not None:
+                waiting.set_exception(e)
+            return
+        if waiting is not None:
+            waiting.set_result(self.snapshot())
+
+    def run(self):
+        """Runs discovery passes on the calling thread, every `interval` seconds."""
+        while True:
+            self.scan_once()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+
+discovery_service = DiscoveryService(getattr(settings, 'CAMERA_DISCOVERY_INTERVAL', 10.0))
@@ -0,0 +1,169 @@
+# camera_manager/events.py
+import collections
+import hashlib
+import json
+import threading
+import time
+import logging
+from django.conf import settings
+from django.db import close_old_connections, connections
+from .models import CameraEvent
+
+# Camera inventory and activity events for dashboards, pushed over ws/camera_events/.
+# Events are stored in the CameraEvent table, whose ids are their sequence numbers,
+# so every process sees the same history: discovery running on its own
+# (run_discovery) and each server worker publish into it, and each process tails
+# it into memory for its subscribers. A client that reconnects, to any worker, with
+# ?since=<seq>&epoch=<epoch> only receives what it missed, as long as those events
+# are still within CAMERA_EVENT_HISTORY.
+
+CAMERA_APPEARED = 'camera_appeared'
+CAMERA_DISAPPEARED = 'camera_disappeared'
+CAMERA_CHANGED = 'camera_changed'
+STREAM_STARTED = 'stream_started'
+STREAM_STOPPED = 'stream_stopped'
+PROFILE_APPLIED = 'profile_applied'
+# A pre-trigger dump finished writing (state 'written') or failed (state 'failed', with the error)
+TRIGGER_DUMPED = 'trigger_dumped'
+
+
+class EventLog:
+    """
+    Bounded, sequence-numbered event history backed by the CameraEvent table.
+    publish() only queues the event, so it never waits for the database and may be
+    called with locks held or on the event loop; one thread per process stores
+    queued events and tails the table for those stored by any process, checking at
+    least every `poll_interval` seconds. `epoch` identifies the database holding the
+    history; sequence numbers from another epoch cannot be resumed.
+    """
+    def __init__(self, size, poll_interval=0.5):
+        self.size = size
+        self.poll_interval = poll_interval
+        # (seq, JSON text), oldest first
+        self._events = collections.deque(maxlen=size)
+        self._seq = 0
+        # Published here and not stored yet
+        self._outbox = collections.deque()
+        self._changed = threading.Condition()
+        self._loaded = threading.Event()
+        self._thread = None
+        self._stopping = False
+
+    @property
+    def epoch(self):
+        database = connections['default'].settings_dict
+        return hashlib.md5(f"{database['ENGINE']}|{database['HOST']}|{database['NAME']}".encode()).hexdigest()[:12]
+
+    def publish(self, event_type, serial_number=None, **data):
+        event = CameraEvent(
+            event_type=event_type,
+            serial_number=serial_number or '',
+            timestamp=time.time() * 1000.0,
+            # Serialized now, so later changes to the caller's objects do not show
+            data=json.loads(json.dumps(data, default=str)),
+        )
+        with self._changed:
+            self._outbox.append(event)
+            self._start()
+            self._changed.notify_all()
+
+    def _start(self):
+        # Called with the condition held
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='camera-events', daemon=True)
+            self._thread.start()
+
+    def _wait_loaded(self):
+        with self._changed:
+            self._start()
+        # Without the database the log stays empty rather than blocking subscribers
+        self._loaded.wait(5.0)
+
+    def _run(self):
+        while True:
+            with self._changed:
+                pending = list(self._outbox)
+                self._outbox.clear()
+            try:
+                if pending:
+                    CameraEvent.objects.bulk_create(pending)
+                if not self._loaded.is_set():
+                    rows = list(CameraEvent.objects.order_by('-id')[:self.size])[::-1]
+                else:
+                    rows = list(CameraEvent.objects.filter(id__gt=self._seq).order_by('id'))
+                if rows and rows[-1].id > self.size:
+                    CameraEvent.objects.filter(id__lte=rows[-1].id - self.size).delete()
+            except Exception as e:
+                logging.warning(f"Camera event log could not reach the database: {e}")
+                with self._changed:
+                    self._outbox.extendleft(reversed(pending))
+                    # While the database is unreachable only the latest events are kept
+                    while len(self._outbox) > self.size:
+                        self._outbox.popleft()
+                close_old_connections()
+                time.sleep(self.poll_interval)
+                continue
+            with self._changed:
+                for row in rows:
+                    self._events.append((row.id, row.as_json()))
+                    self._seq = row.id
+                self._loaded.set()
+                self._changed.notify_all()
+                if self._stopping and not self._outbox:
+                    close_old_connections()
+                    return
+                if not self._outbox:
+                    self._changed.wait(self.poll_interval)
+
+    def latest_seq(self):
+        self._wait_loaded()
+        with self._changed:
+            return self._seq
+
+    def _after(self, seq):
+        # Called with the condition held. A seq beyond the latest one comes from a
+        # process that has read newer events than this one yet
+        if seq >= self._seq:
+            return []
+        if not self._events or self._events[0][0] > seq + 1:
+            return None
+        # Sequence numbers of events stored concurrently by several processes may have gaps
+        return [event for event in self._events if event[0] > seq]
+
+    def events_after(self, seq):
+        """[(seq, text)] published after `seq`, or None when some of them are no longer kept."""
+        self._wait_loaded()
+        with self._changed:
+            return self._after(seq)
+
+    def wait_after(self, seq, timeout):
+        """Like events_after(), but waits up to `timeout` seconds for something new."""
+        self._wait_loaded()
+        with self._changed:
+            if self._seq <= seq:
+                self._changed.wait(timeout)
+            return self._after(seq)
+
+    def stop(self):
+        """
+        Ends the log's thread once it has stored the events queued so far. The next
+        publish or subscriber starts it again.
+        """
+        with self._changed:
+            self._stopping = True
+            self._changed.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        with self._changed:
+            if self._thread is thread:
+                self._thread, self._stopping = None, False
+
+    def wake(self):
+        """Releases every waiting subscriber, e.g. so a closed one can exit."""
+        with self._changed:
+            self._changed.notify_all()
+
+
+event_log = EventLog(getattr(settings, 'CAMERA_EVENT_HISTORY', 1000), getattr(settings, 'CAMERA_EVENT_POLL_INTERVAL', 0.5))
+publish = event_log.publish
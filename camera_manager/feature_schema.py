@@ -0,0 +1,256 @@
+# camera_manager/feature_schema.py
+import threading
+import time
+import logging
+from django.conf import settings
+from .backend import genicam
+from .models import Camera, FeatureSchema
+
+# Walking every GenICam node and finding its type, selectors and dependents costs
+# thousands of calls, but the result only depends on the camera model and firmware.
+# The schema is therefore built once per (model, firmware), kept in memory and in
+# the FeatureSchema table, and a features request only reads values. Ranges and
+# enum options change with pixel format, binning and selectors, so they are kept
+# from the camera's previous read and re-read only for nodes that depend on a
+# value that changed since; the last ones seen are stored on the Camera row for
+# when the camera is offline.
+
+_schemas = {}
+# serial number -> firmware version last stored on its Camera row
+_firmware = {}
+_schemas_lock = threading.Lock()
+
+# serial number -> (expiry, features list)
+_values = {}
+# serial number -> features list of the last read, whose details later reads reuse
+_last_read = {}
+_values_lock = threading.Lock()
+
+
+def is_valid_node(node):
+    return genicam.IsAvailable(node) and genicam.IsReadable(node)
+
+
+def node_type(node):
+    if isinstance(node, genicam.IInteger):
+        return "Integer"
+    if isinstance(node, genicam.IFloat):
+        return "Float"
+    if isinstance(node, genicam.IEnumeration):
+        return "Enum"
+    if isinstance(node, genicam.IBoolean):
+        return "Boolean"
+    return None
+
+
+def read_value(node, feature_type):
+    if feature_type == "Enum":
+        return node.GetCurrentEntry().GetSymbolic()
+    return node.GetValue()
+
+
+VISIBILITIES = {0: "Beginner", 1: "Expert", 2: "Guru", 3: "Invisible"}
+
+# Features the SFNC defines as read-only, though some devices (the emulator among
+# them) accept writes to them; they follow from other settings
+READ_ONLY_FEATURES = frozenset((
+    'PayloadSize', 'WidthMax', 'HeightMax', 'SensorWidth', 'SensorHeight',
+    'ResultingFrameRate', 'ResultingFrameRateAbs',
+))
+
+
+def is_setting(node):
+    """
+    Whether a node belongs in a profile: not a register or other invisible node behind
+    a feature (Width_Reg), whose value follows the feature's, and not read-only by spec.
+    """
+    inner = node.GetNode()
+    return inner.IsFeature() and inner.GetVisibility() != genicam.Invisible and inner.GetName() not in READ_ONLY_FEATURES
+
+
+def describe_node(node, feature_type):
+    """Current metadata for a node: numeric range or the enum options available right now."""
+    if feature_type in ("Integer", "Float"):
+        return {"min": node.GetMin(), "max": node.GetMax()}
+    if feature_type == "Enum":
+        return {"options": [entry.GetSymbolic() for entry in node.GetEntries() if genicam.IsAvailable(entry)]}
+    return {}
+
+
+def static_metadata(nodemap, node):
+    """What the camera description says about a node, whatever state the camera is in."""
+    info = node.GetNode()
+    dependents = []
+    if "pDependent" in info.GetPropertyNames():
+        # Every node invalidated by a write to this one, categories included
+        for name in info.GetProperty("pDependent")[0].split("\t"):
+            dependent = nodemap.GetNode(name) if name else None
+            if dependent is not None and node_type(dependent) is not None:
+                dependents.append(name)
+    return {
+        # False for registers and other implementation nodes behind the features
+        "feature": info.IsFeature(),
+        "visibility": VISIBILITIES.get(info.GetVisibility(), "Invisible"),
+        "selectors": [selector.GetNode().GetName() for selector in info.GetSelectingFeatures()],
+        "dependents": dependents,
+    }
+
+
+def build_schema(nodemap):
+    """
+    Walks the whole nodemap once and returns the list of schema entries. Nodes that
+    are unavailable right now (e.g. for the current pixel format) are kept; they are
+    skipped per request while unavailable.
+    """
+    schema = []
+    for node in nodemap.GetNodes():
+        feature_type = node_type(node)
+        if feature_type is None:
+            continue
+        try:
+            schema.append({"name": node.GetNode().GetName(), "type": feature_type, **static_metadata(nodemap, node)})
+        except Exception as e:
+            logging.warning(f"Failed to describe node {node.GetNode().GetName()}: {e}")
+    return schema
+
+
+def schema_key(camera):
+    """(model name, firmware version) identifying which schema a camera uses."""
+    model_name = camera.GetDeviceInfo().GetModelName()
+    firmware = camera.GetNodeMap().GetNode("DeviceFirmwareVersion")
+    if firmware is not None and genicam.IsReadable(firmware):
+        return model_name, firmware.GetValue()
+    return model_name, camera.GetDeviceInfo().GetDeviceVersion()
+
+
+def _record_firmware(serial_number, firmware_version):
+    """Stores the firmware on the camera's row, so its schema can be found while it is offline."""
+    with _schemas_lock:
+        if _firmware.get(serial_number) == firmware_version:
+            return
+    Camera.objects.filter(serial_number=serial_number).update(firmware_version=firmware_version)
+    with _schemas_lock:
+        _firmware[serial_number] = firmware_version
+
+
+def get_schema(camera, rebuild=False):
+    """Returns the schema for an open camera, building and persisting it on first use."""
+    key = schema_key(camera)
+    _record_firmware(camera.GetDeviceInfo().GetSerialNumber(), key[1])
+    with _schemas_lock:
+        schema = None if rebuild else _schemas.get(key)
+    if schema is not None:
+        return schema
+
+    model_name, firmware_version = key
+    stored = None if rebuild else FeatureSchema.objects.filter(
+        model_name=model_name, firmware_version=firmware_version
+    ).first()
+    if stored is not None:
+        schema = stored.features
+    else:
+        schema = build_schema(camera.GetNodeMap())
+        FeatureSchema.objects.update_or_create(
+            model_name=model_name, firmware_version=firmware_version, defaults={"features": schema}
+        )
+        logging.info(f"Built feature schema for {model_name} ({firmware_version}): {len(schema)} features.")
+    with _schemas_lock:
+        _schemas[key] = schema
+    return schema
+
+
+def stale_nodes(schema, changed):
+    """
+    The nodes whose ranges and options may differ after the values of `changed` did:
+    those nodes, the nodes they select and the nodes listed as their dependents, transitively.
+    """
+    affected = {}
+    for entry in schema:
+        affected.setdefault(entry["name"], []).extend(entry["dependents"])
+        for selector in entry["selectors"]:
+            affected.setdefault(selector, []).append(entry["name"])
+    stale = set()
+    pending = list(changed)
+    while pending:
+        name = pending.pop()
+        if name not in stale:
+            stale.add(name)
+            pending.extend(affected.get(name, ()))
+    return stale
+
+
+def read_features(nodemap, schema, previous=None):
+    """
+    Reads the current values, ranges and options of the schema's nodes that are readable
+    now. Given the features of an earlier read of the same camera (`previous`), ranges
+    and options are only re-read for nodes that were not readable then or that may have
+    changed since (see stale_nodes); the others are taken from `previous`.
+    """
+    values = {}
+    for entry in schema:
+        node = nodemap.GetNode(entry["name"])
+        if node is None or not is_valid_node(node):
+            continue
+        try:
+            values[entry["name"]] = (node, read_value(node, entry["type"]))
+        except Exception as e:
+            logging.warning(f"Failed to read feature {entry['name']}: {e}")
+
+    known = {feature["name"]: feature for feature in previous or ()}
+    changed = [name for name, (node, value) in values.items() if name in known and known[name]["value"] != value]
+    for name in stale_nodes(schema, changed):
+        known.pop(name, None)
+
+    features = []
+    for entry in schema:
+        if entry["name"] not in values:
+            continue
+        node, value = values[entry["name"]]
+        if entry["name"] in known:
+            details = known[entry["name"]]["details"]
+        else:
+            try:
+                details = describe_node(node, entry["type"])
+            except Exception as e:
+                logging.warning(f"Failed to read feature {entry['name']}: {e}")
+                continue
+        features.append({"name": entry["name"], "type": entry["type"], "value": value, "details": details})
+    return features
+
+
+def cached_values(serial_number):
+    with _values_lock:
+        cached = _values.get(serial_number)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    return None
+
+
+def last_read(serial_number):
+    """The features read from the camera last time, cached or not, whose details read_features can reuse."""
+    with _values_lock:
+        return _last_read.get(serial_number)
+
+
+def store_values(serial_number, features):
+    ttl = getattr(settings, 'CAMERA_FEATURE_CACHE_TTL', 2.0)
+    with _values_lock:
+        previous = _last_read.get(serial_number)
+        _values[serial_number] = (time.monotonic() + ttl, features)
+        _last_read[serial_number] = features
+    details = {feature["name"]: feature["details"] for feature in features}
+    if previous is None or details != {feature["name"]: feature["details"] for feature in previous}:
+        # The last ranges and options seen, shown while the camera is offline
+        Camera.objects.filter(serial_number=serial_number).update(feature_details=details)
+
+
+def invalidate_values(serial_number):
+    """Drops cached feature values, e.g. after settings were written to the camera."""
+    with _values_lock:
+        _values.pop(serial_number, None)
+
+
+def schema_for_model(model_name, firmware_version):
+    """The stored schema for a camera model and firmware, or None. Used when the camera is offline."""
+    stored = FeatureSchema.objects.filter(model_name=model_name, firmware_version=firmware_version).first()
+    return stored.features if stored else None
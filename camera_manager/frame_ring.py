@@ -0,0 +1,186 @@
+# camera_manager/frame_ring.py
+import os
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+from .frames import EncodedFrame
+
+# Shared-memory layout:
+#   ring header | LEASE_COUNT reader leases | slot_count x (slot header + slot_size bytes)
+#
+# A single writer (the camera's worker process) fills the slots round-robin.
+# Any number of readers in any process poll the latest sequence number and copy
+# the slot out. Each slot carries its sequence number before and after the
+# metadata and is zeroed while being rewritten, so a reader that races the
+# writer detects the torn read and simply skips that frame.
+
+RING_MAGIC = b'BFR1'
+# magic, slot count, slot size, writer pid, latest sequence number
+RING_HEADER = struct.Struct('<4sIIIQ')
+# reader pid, last heartbeat (time.time())
+LEASE = struct.Struct('<Qd')
+LEASE_COUNT = 32
+# sequence, frame id, timestamp, width, height, codec, payload length, sequence again
+SLOT_HEADER = struct.Struct('<QIdHHBxxxIQ')
+
+_U32 = struct.Struct('<I')
+_U64 = struct.Struct('<Q')
+_WRITER_PID_OFFSET = 12
+_LATEST_SEQ_OFFSET = 16
+
+
+def ring_name(serial_number):
+    """Shared-memory name used for a camera's frame ring."""
+    safe = ''.join(c if c.isalnum() else '_' for c in serial_number)
+    return f"basler_{safe}"
+
+
+def pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _untrack(shm):
+    # The ring's lifetime is managed explicitly through the lease table. Without this,
+    # multiprocessing's resource tracker unlinks the segment when whichever process
+    # happened to touch it first exits, pulling it out from under the others.
+    try:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+
+
+class FrameRing:
+    def __init__(self, shm, created=False):
+        self._shm = shm
+        self._buf = shm.buf
+        self.created = created
+        magic, self.slot_count, self.slot_size, _, _ = RING_HEADER.unpack_from(self._buf, 0)
+        if magic != RING_MAGIC:
+            raise ValueError(f"Shared memory '{shm.name}' is not a frame ring.")
+        self._slots_offset = RING_HEADER.size + LEASE.size * LEASE_COUNT
+        self._slot_stride = SLOT_HEADER.size + self.slot_size
+
+    @classmethod
+    def open(cls, name, slot_count, slot_size):
+        """Attaches to the named ring, creating it if no other process has yet."""
+        size = RING_HEADER.size + LEASE.size * LEASE_COUNT + slot_count * (SLOT_HEADER.size + slot_size)
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            return cls.attach(name)
+        _untrack(shm)
+        RING_HEADER.pack_into(shm.buf, 0, RING_MAGIC, slot_count, slot_size, 0, 0)
+        return cls(shm, created=True)
+
+    @classmethod
+    def attach(cls, name, timeout=1.0):
+        """Attaches to an existing ring, waiting briefly for its creator to initialise it."""
+        shm = shared_memory.SharedMemory(name=name)
+        _untrack(shm)
+        deadline = time.monotonic() + timeout
+        while bytes(shm.buf[:len(RING_MAGIC)]) != RING_MAGIC:
+            if time.monotonic() > deadline:
+                shm.close()
+                raise ValueError(f"Shared memory '{name}' is not a frame ring.")
+            time.sleep(0.01)
+        return cls(shm)
+
+    def close(self, unlink=False):
+        self._buf.release()
+        self._shm.close()
+        if unlink:
+            # unlink() unregisters the name again, so hand it back to the tracker first
+            resource_tracker.register(self._shm._name, 'shared_memory')
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+
+    # --- Writer side ---
+
+    @property
+    def writer_pid(self):
+        return _U32.unpack_from(self._buf, _WRITER_PID_OFFSET)[0]
+
+    @writer_pid.setter
+    def writer_pid(self, pid):
+        _U32.pack_into(self._buf, _WRITER_PID_OFFSET, pid)
+
+    def writer_alive(self):
+        return pid_alive(self.writer_pid)
+
+    def latest_seq(self):
+        return _U64.unpack_from(self._buf, _LATEST_SEQ_OFFSET)[0]
+
+    def publish(self, frame):
+        """Writes an EncodedFrame into the next slot. Returns False if it does not fit."""
+        length = len(frame.data)
+        if length > self.slot_size:
+            return False
+        seq = self.latest_seq() + 1
+        offset = self._slots_offset + (seq % self.slot_count) * self._slot_stride
+        data_offset = offset + SLOT_HEADER.size
+        # Invalidate the slot first so readers cannot mistake a half-written frame for a whole one
+        SLOT_HEADER.pack_into(self._buf, offset, 0, 0, 0.0, 0, 0, 0, 0, 0)
+        self._buf[data_offset:data_offset + length] = frame.data
+        SLOT_HEADER.pack_into(
+            self._buf, offset, seq, frame.frame_id & 0xFFFFFFFF, frame.timestamp,
+            frame.width, frame.height, frame.codec, length, seq
+        )
+        _U64.pack_into(self._buf, _LATEST_SEQ_OFFSET, seq)
+        return True
+
+    # --- Reader side ---
+
+    def read_latest(self, after_seq):
+        """
+        Returns (seq, EncodedFrame) for the newest frame if it is newer than after_seq,
+        otherwise None. A read that raced the writer also returns None.
+        """
+        seq = self.latest_seq()
+        if seq <= after_seq:
+            return None
+        offset = self._slots_offset + (seq % self.slot_count) * self._slot_stride
+        head, frame_id, timestamp, width, height, codec, length, tail = SLOT_HEADER.unpack_from(self._buf, offset)
+        if head != seq or tail != seq or length > self.slot_size:
+            return None
+        data_offset = offset + SLOT_HEADER.size
+        data = bytes(self._buf[data_offset:data_offset + length])
+        if _U64.unpack_from(self._buf, offset)[0] != seq:
+            return None
+        return seq, EncodedFrame(frame_id, data, width, height, codec=codec, timestamp=timestamp)
+
+    def acquire_lease(self, pid):
+        """Claims a reader lease slot for pid and returns its index."""
+        now = time.time()
+        start = pid % LEASE_COUNT
+        for i in range(LEASE_COUNT):
+            index = (start + i) % LEASE_COUNT
+            owner, _ = LEASE.unpack_from(self._buf, RING_HEADER.size + index * LEASE.size)
+            if owner in (0, pid) or not pid_alive(owner):
+                LEASE.pack_into(self._buf, RING_HEADER.size + index * LEASE.size, pid, now)
+                return index
+        raise RuntimeError("No free reader lease in frame ring.")
+
+    def renew_lease(self, index, pid):
+        LEASE.pack_into(self._buf, RING_HEADER.size + index * LEASE.size, pid, time.time())
+
+    def release_lease(self, index):
+        LEASE.pack_into(self._buf, RING_HEADER.size + index * LEASE.size, 0, 0.0)
+
+    def has_readers(self, timeout):
+        """True while at least one reader renewed its lease within the last timeout seconds."""
+        cutoff = time.time() - timeout
+        for index in range(LEASE_COUNT):
+            owner, heartbeat = LEASE.unpack_from(self._buf, RING_HEADER.size + index * LEASE.size)
+            if owner and heartbeat >= cutoff:
+                return True
+        return False
@@ -0,0 +1,154 @@
+# camera_manager/frames.py
+import base64
+import json
+import struct
+import time
+
+# Every binary WebSocket message starts with this fixed little-endian header,
+# followed directly by the encoded image bytes:
+#   version (u8), codec (u8), flags (u16), frame id (u32),
+#   timestamp in ms since the epoch (f64), width (u16), height (u16)
+FRAME_HEADER = struct.Struct('<BBHIdHH')
+FRAME_HEADER_VERSION = 1
+
+CODEC_JPEG = 1
+
+# Header flag of a delta frame: the body is a u16 tile count followed by one
+# x, y, width, height (u16 each), length (u32) record and image per tile, to be
+# drawn over the previous frame. Width and height in the header are the full size.
+FLAG_DELTA = 1
+TILE_HEADER = struct.Struct('<HHHHI')
+
+TRANSPORT_JSON = 'json'
+TRANSPORT_BINARY = 'binary'
+TRANSPORTS = (TRANSPORT_JSON, TRANSPORT_BINARY)
+
+DEFAULT_QUALITY = 75
+# Narrowest image a client may ask for
+MIN_WIDTH = 16
+
+
+class Subscription:
+    """
+    What a consumer asked to receive: an optional width cap, a JPEG quality, an
+    optional frame rate cap, and whether it can composite delta frames. Consumers
+    asking for the same (max_width, quality) variant share a single encode of every frame.
+    """
+    FIELDS = ('max_width', 'quality', 'fps', 'delta')
+
+    def __init__(self, max_width=None, quality=DEFAULT_QUALITY, fps=None, delta=False):
+        self.max_width = int(max_width) if max_width else None
+        self.quality = int(quality)
+        self.fps = float(fps) if fps else None
+        # Query string values arrive as text
+        self.delta = delta if isinstance(delta, bool) else str(delta).lower() in ('1', 'true', 'yes')
+        if self.max_width is not None and self.max_width < MIN_WIDTH:
+            raise ValueError(f"max_width must be at least {MIN_WIDTH}.")
+        if not 1 <= self.quality <= 100:
+            raise ValueError("quality must be between 1 and 100.")
+        if self.fps is not None and self.fps <= 0:
+            raise ValueError("fps must be positive.")
+
+    @classmethod
+    def from_dict(cls, data, base=None):
+        """
+        Builds a subscription from client-supplied values, keeping base's values for
+        keys that are not given. Raises ValueError on invalid input.
+        """
+        base = base or cls()
+        values = {field: data.get(field, getattr(base, field)) for field in cls.FIELDS}
+        try:
+            return cls(**values)
+        except TypeError as e:
+            raise ValueError(str(e))
+
+    @property
+    def variant(self):
+        return (self.max_width, self.quality)
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+
+DEFAULT_VARIANT = Subscription().variant
+
+
+class EncodedFrame:
+    """
+    One encoded image ready to be fanned out to stream consumers.
+    The wire payloads are built lazily and cached, so a frame is serialized
+    at most once per transport no matter how many consumers receive it.
+    """
+    flags = 0
+    delta = False
+
+    def __init__(self, frame_id, data, width, height, codec=CODEC_JPEG, timestamp=None):
+        self.frame_id = frame_id
+        self.data = data
+        self.width = width
+        self.height = height
+        self.codec = codec
+        self.timestamp = timestamp if timestamp is not None else time.time() * 1000.0
+        self._binary = None
+        self._json = None
+
+    def header(self):
+        return FRAME_HEADER.pack(
+            FRAME_HEADER_VERSION, self.codec, self.flags, self.frame_id & 0xFFFFFFFF,
+            self.timestamp, self.width, self.height
+        )
+
+    def as_bytes(self):
+        if self._binary is None:
+            self._binary = self.header() + self.data
+        return self._binary
+
+    def as_json(self):
+        if self._json is None:
+            self._json = json.dumps({
+                'image': base64.b64encode(self.data).decode('ascii'),
+                'frame_id': self.frame_id,
+                'timestamp': self.timestamp,
+                'width': self.width,
+                'height': self.height,
+            })
+        return self._json
+
+
+class DeltaFrame(EncodedFrame):
+    """
+    The changed regions of a frame as (x, y, width, height, image bytes) tiles, for
+    consumers that draw them over the frames they already show.
+    """
+    flags = FLAG_DELTA
+    delta = True
+
+    def __init__(self, frame_id, tiles, width, height, codec=CODEC_JPEG, timestamp=None):
+        self.tiles = tiles
+        body = [struct.pack('<H', len(tiles))]
+        for x, y, tile_width, tile_height, data in tiles:
+            body.append(TILE_HEADER.pack(x, y, tile_width, tile_height, len(data)))
+            body.append(data)
+        super().__init__(frame_id, b''.join(body), width, height, codec, timestamp)
+
+    def merged_over(self, older):
+        """One delta equivalent to drawing `older` and then this frame."""
+        replaced = {tile[:4] for tile in self.tiles}
+        tiles = [tile for tile in older.tiles if tile[:4] not in replaced] + self.tiles
+        return DeltaFrame(self.frame_id, tiles, self.width, self.height, self.codec, self.timestamp)
+
+    def as_json(self):
+        if self._json is None:
+            self._json = json.dumps({
+                'tiles': [
+                    {'x': x, 'y': y, 'width': tile_width, 'height': tile_height,
+                     'image': base64.b64encode(data).decode('ascii')}
+                    for x, y, tile_width, tile_height, data in self.tiles
+                ],
+                'frame_id': self.frame_id,
+                'timestamp': self.timestamp,
+                'width': self.width,
+                'height': self.height,
+            })
+        return self._json
+
@@ -0,0 +1,106 @@
+# camera_manager/management/commands/benchmark_streams.py
+import json
+import os
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from camera_manager.acquisition import GRAB_MODES, GRAB_STRATEGIES
+from camera_manager.benchmark import SOURCE_CAMEMU, SOURCE_SYNTHETIC, SOURCES, case_key, parse_resolution, sweep
+from camera_manager.frames import TRANSPORTS, TRANSPORT_BINARY
+
+
+def _int_list(text):
+    return [int(value) for value in text.split(',') if value]
+
+
+def _str_list(text):
+    return [value.strip() for value in text.split(',') if value.strip()]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks live streaming without real cameras, sweeping camera count, resolution, "
+        "pixel format and consumers per camera. Reports fps, end-to-end latency percentiles, "
+        "per-stage times, CPU per stream and memory, and can write the results as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', choices=SOURCES, default=SOURCE_SYNTHETIC,
+                            help="synthetic frames, or pylon's camera emulator (PYLON_CAMEMU).")
+        parser.add_argument('--cameras', type=_int_list, default=[1, 2], help="Comma-separated camera counts.")
+        parser.add_argument('--resolutions', type=_str_list, default=['640x480', '1920x1080'],
+                            help="Comma-separated WIDTHxHEIGHT values.")
+        parser.add_argument('--pixel-formats', type=_str_list, default=['Mono8', 'BayerRG8'],
+                            help="Comma-separated pylon pixel format names.")
+        parser.add_argument('--consumers', type=_int_list, default=[1, 4], help="Comma-separated consumers per camera.")
+        parser.add_argument('--fps', type=float, default=30.0, help="Frame rate of each source camera.")
+        parser.add_argument('--duration', type=float, default=5.0, help="Measured seconds per case.")
+        parser.add_argument('--warmup', type=float, default=1.0, help="Unmeasured seconds before each case.")
+        parser.add_argument('--transport', choices=TRANSPORTS, default=TRANSPORT_BINARY)
+        parser.add_argument('--max-width', type=int, default=None, help="Width cap the consumers subscribe with.")
+        parser.add_argument('--grab-mode', choices=GRAB_MODES, help="Overrides CAMERA_GRAB_MODE.")
+        parser.add_argument('--grab-strategy', choices=list(GRAB_STRATEGIES), help="Overrides CAMERA_GRAB_STRATEGY.")
+        parser.add_argument('--max-num-buffer', type=int, help="Overrides CAMERA_MAX_NUM_BUFFER.")
+        parser.add_argument('--output', help="Write the result document to this JSON file.")
+        parser.add_argument('--compare', help="Print changes against a previous result document.")
+
+    def handle(self, *args, **options):
+        try:
+            resolutions = [parse_resolution(value) for value in options['resolutions']]
+        except ValueError:
+            raise CommandError("Resolutions must look like 1920x1080.")
+        if options['source'] == SOURCE_CAMEMU:
+            # Only takes effect if pylon has not enumerated devices yet in this process
+            os.environ.setdefault('PYLON_CAMEMU', str(max(options['cameras'])))
+        baseline = self._load(options['compare']) if options['compare'] else None
+        overrides = {name: options[option] for name, option in (
+            ('CAMERA_GRAB_MODE', 'grab_mode'),
+            ('CAMERA_GRAB_STRATEGY', 'grab_strategy'),
+            ('CAMERA_MAX_NUM_BUFFER', 'max_num_buffer'),
+        ) if options[option] is not None}
+
+        self.stdout.write(f"{'cams':>4} {'resolution':>10} {'format':>10} {'cons':>4} {'fps':>7} "
+                          f"{'p50 ms':>7} {'p99 ms':>7} {'cpu/str':>7} {'rss MB':>7} {'drops':>6}")
+        try:
+            with override_settings(**overrides):
+                document = sweep(
+                    options['source'], options['cameras'], resolutions, options['pixel_formats'], options['consumers'],
+                    progress=lambda result: self._report(result, baseline),
+                    fps=options['fps'], duration=options['duration'], warmup=options['warmup'],
+                    transport=options['transport'], max_width=options['max_width'],
+                )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(document, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}."))
+
+    def _load(self, path):
+        try:
+            with open(path) as f:
+                return {case_key(result): result for result in json.load(f)['results']}
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f"Could not read {path}: {e}")
+
+    def _report(self, result, baseline):
+        latency = result['latency_ms']
+        self.stdout.write(
+            f"{result['cameras']:>4} {result['width']:>5}x{result['height']:<4} {result['pixel_format']:>10} "
+            f"{result['consumers_per_camera']:>4} {result['fps_delivered_per_consumer']:>7.1f} "
+            f"{latency['p50'] or 0:>7.1f} {latency['p99'] or 0:>7.1f} {result['cpu_percent_per_stream']:>6.1f}% "
+            f"{result['rss_megabytes'] or 0:>7.1f} {result['frames_dropped']:>6}"
+        )
+        previous = baseline.get(case_key(result)) if baseline else None
+        if previous:
+            self.stdout.write(
+                f"{'':>4} vs baseline: fps {self._change(previous['fps_delivered_per_consumer'], result['fps_delivered_per_consumer'])}, "
+                f"p50 {self._change(previous['latency_ms']['p50'], latency['p50'])}, "
+                f"p99 {self._change(previous['latency_ms']['p99'], latency['p99'])}, "
+                f"cpu/stream {self._change(previous['cpu_percent_per_stream'], result['cpu_percent_per_stream'])}"
+            )
+
+    def _change(self, before, after):
+        if not before or after is None:
+            return "n/a"
+        return f"{(after - before) / before * 100.0:+.1f}%"
@@ -0,0 +1,29 @@
+# camera_manager/management/commands/run_discovery.py
+from django.core.management.base import BaseCommand, CommandError
+from camera_manager.discovery import discovery_service
+from camera_manager.events import event_log
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs background camera discovery in the foreground, keeping the camera inventory "
+        "up to date for every server worker. Use it instead of discovery inside the server "
+        "processes (CAMERA_DISCOVERY_IN_SERVER = False) when the server runs several workers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help="Overrides CAMERA_DISCOVERY_INTERVAL.")
+
+    def handle(self, *args, **options):
+        if options['interval'] is not None:
+            if options['interval'] <= 0:
+                raise CommandError("The interval must be positive.")
+            discovery_service.interval = options['interval']
+        self.stdout.write(f"Discovering cameras every {discovery_service.interval}s; press Ctrl+C to stop.")
+        try:
+            discovery_service.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # Store the inventory events of the last pass for the server workers
+            event_log.stop()
@@ -0,0 +1,252 @@
+# camera_manager/metrics.py
+import bisect
+import threading
+
+# Minimal in-process metrics rendered in the Prometheus text format.
+# Metric objects are created once per camera (or per call name) and kept by the
+# code that updates them, so the per-frame cost is a few integer and float
+# additions on preallocated slots: no locks, no lookups, no allocations. Updates
+# race only where several threads share a metric (e.g. encode workers), where an
+# occasional lost increment is acceptable for monitoring.
+# Like acquisition.py this module does not depend on Django. Worker processes
+# (CAMERA_STREAM_MODE = 'process') keep their own grab-side metrics, which are not
+# exported; the server process reports what it relays and sends.
+
+# Upper bounds in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        # One slot per bound plus +Inf; rendered cumulatively
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ''
+    escaped = ('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in items)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """Metric families by name; each family holds one metric per label set."""
+    def __init__(self):
+        # name -> [type, help, {labels tuple: metric}]
+        self._families = {}
+        # callables returning [(name, type, help, labels dict, value)] at scrape time
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _get(self, cls, kind, name, help_text, labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self._families.setdefault(name, [kind, help_text, {}])
+            metric = family[2].get(key)
+            if metric is None:
+                metric = family[2][key] = cls()
+        return metric
+
+    def counter(self, name, help_text, **labels):
+        return self._get(Counter, 'counter', name, help_text, labels)
+
+    def gauge(self, name, help_text, **labels):
+        return self._get(Gauge, 'gauge', name, help_text, labels)
+
+    def histogram(self, name, help_text, **labels):
+        return self._get(Histogram, 'histogram', name, help_text, labels)
+
+    def add_collector(self, collect):
+        with self._lock:
+            self._collectors.append(collect)
+
+    def remove(self, label, keep):
+        """Forgets every metric whose `label` has a value not in `keep`."""
+        with self._lock:
+            for _, _, metrics in self._families.values():
+                for key in list(metrics):
+                    labels = dict(key)
+                    if label in labels and labels[label] not in keep:
+                        del metrics[key]
+
+    def render(self, allowed=None):
+        """
+        All metrics in the Prometheus text exposition format (version 0.0.4). With
+        `allowed` ({label: values}), series whose label has another value are left out.
+        """
+        allowed = allowed or {}
+
+        def wanted(labels):
+            return all(labels[label] in values for label, values in allowed.items() if label in labels)
+
+        with self._lock:
+            families = [(name, kind, help_text, [(labels, metric) for labels, metric in metrics.items() if wanted(dict(labels))])
+                        for name, (kind, help_text, metrics) in sorted(self._families.items())]
+            collectors = list(self._collectors)
+        lines = []
+        for name, kind, help_text, metrics in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in metrics:
+                if kind == 'histogram':
+                    cumulative = 0
+                    for bound, count in zip(metric.bounds + (float('inf'),), metric.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(f"{name}_bucket{_format_labels(labels, ('le', le))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {metric.sum!r}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {metric.count}")
+                else:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(metric.value)}")
+        seen = set()
+        for collect in collectors:
+            for name, kind, help_text, labels, value in collect():
+                if not wanted(labels):
+                    continue
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# HELP {name} {help_text}")
+                    lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class StreamMetrics:
+    """Handles for one camera's stream stages, created once and reused for every frame."""
+    def __init__(self, serial_number):
+        labels = {'camera': serial_number}
+        self.grab_wait = registry.histogram(
+            'camera_grab_wait_seconds', 'Time spent waiting for a frame, in RetrieveResult or between grab events.', **labels)
+        self.convert = registry.histogram(
+            'camera_convert_seconds', 'Time converting a grab result to an encodable image.', **labels)
+        self.detect = registry.histogram(
+            'camera_change_detect_seconds', 'Time comparing a frame with the last one sent, when change detection is on.', **labels)
+        self.encode = registry.histogram(
+            'camera_encode_seconds', 'Time encoding all requested variants of one frame.', **labels)
+        self.publish = registry.histogram(
+            'camera_publish_seconds', 'Time handing one frame to all consumer channels.', **labels)
+        self.send = registry.histogram(
+            'camera_send_seconds', 'Time a consumer took to send one frame.', **labels)
+        self.frames_grabbed = registry.counter(
+            'camera_frames_grabbed_total', 'Frames grabbed successfully.', **labels)
+        self.grab_failures = registry.counter(
+            'camera_grab_failures_total', 'Grab results that reported a failure.', **labels)
+        self.grab_timeouts = registry.counter(
+            'camera_grab_timeouts_total', 'Waits for a frame that timed out.', **labels)
+        self.images_skipped = registry.counter(
+            'camera_images_skipped_total', 'Images pylon skipped before a grab result (NumberOfSkippedImages).', **labels)
+        self.frames_unchanged = registry.counter(
+            'camera_frames_unchanged_total', 'Grabbed frames skipped because nothing visibly changed.', **labels)
+        self.frames_sent = registry.counter(
+            'camera_frames_sent_total', 'Frames delivered to consumers.', **labels)
+        self.bytes_sent = registry.counter(
+            'camera_bytes_sent_total', 'Encoded image bytes delivered to consumers.', **labels)
+        self.frames_dropped = registry.counter(
+            'camera_frames_dropped_total', 'Frames dropped because a consumer fell behind.', **labels)
+        self.fps = registry.gauge(
+            'camera_stream_fps', 'Published frames per second, smoothed.', **labels)
+        self._last_publish = None
+        self._interval = None
+
+    def published(self, now):
+        """Updates the smoothed frame rate; `now` is time.perf_counter() at this publish."""
+        if self._last_publish is not None:
+            # Smooth the interval, not the rate: frames leaving the encoders in a burst
+            # would otherwise swamp the average with huge instantaneous rates
+            interval = now - self._last_publish
+            self._interval = interval if self._interval is None else 0.9 * self._interval + 0.1 * interval
+            if self._interval > 0:
+                self.fps.value = 1.0 / self._interval
+        self._last_publish = now
+
+    def stopped(self):
+        self.fps.value = 0.0
+        self._last_publish = None
+        self._interval = None
+
+
+_streams = {}
+_streams_lock = threading.Lock()
+
+
+def stream_metrics(serial_number):
+    with _streams_lock:
+        metrics = _streams.get(serial_number)
+        if metrics is None:
+            metrics = _streams[serial_number] = StreamMetrics(serial_number)
+    return metrics
+
+
+def forget_streams(keep):
+    """
+    Drops the stream metrics of cameras not in `keep`, e.g. serial numbers a client
+    asked for that are not in the inventory. A stream still running for one of them
+    goes on updating its handles, which are no longer exported.
+    """
+    with _streams_lock:
+        for serial_number in [serial_number for serial_number in _streams if serial_number not in keep]:
+            del _streams[serial_number]
+        registry.remove('camera', keep)
+
+
+class CallMetrics:
+    """Handles for one kind of REST-triggered camera call."""
+    def __init__(self, call):
+        self.duration = registry.histogram(
+            'camera_io_call_seconds', 'Duration of blocking camera calls made for HTTP requests.', call=call)
+        self.errors = registry.counter(
+            'camera_io_call_errors_total', 'Camera calls for HTTP requests that raised.', call=call)
+        self.timeouts = registry.counter(
+            'camera_io_call_timeouts_total', 'HTTP requests that stopped waiting for a camera call.', call=call)
+        self.coalesced = registry.counter(
+            'camera_io_call_coalesced_total', 'Requests that joined an identical call already in flight.', call=call)
+
+
+_calls = {}
+_calls_lock = threading.Lock()
+
+
+def call_metrics(call):
+    with _calls_lock:
+        metrics = _calls.get(call)
+        if metrics is None:
+            metrics = _calls[call] = CallMetrics(call)
+    return metrics
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.23 on 2026-10-17 01:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('camera_manager', '0002_alter_camera_current_ip'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeatureSchema',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(max_length=100)),
+                ('firmware_version', models.CharField(blank=True, max_length=100)),
+                ('features', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('model_name', 'firmware_version')},
+            },
+        ),
+    ]
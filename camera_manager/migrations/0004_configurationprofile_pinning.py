@@ -0,0 +1,33 @@
+# Generated by Django 4.2.23 on 2026-10-17 01:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('camera_manager', '0003_featureschema'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='configurationprofile',
+            name='pfs_data',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='configurationprofile',
+            name='pin_digest',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='configurationprofile',
+            name='pin_key',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='configurationprofile',
+            name='user_set',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.23 on 2026-10-17 01:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('camera_manager', '0004_configurationprofile_pinning'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AlterField(
+            model_name='camera',
+            name='status',
+            field=models.CharField(db_index=True, default='Offline', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='configurationprofile',
+            index=models.Index(fields=['camera', 'created_at'], name='camera_mana_camera__07ee05_idx'),
+        ),
+    ]
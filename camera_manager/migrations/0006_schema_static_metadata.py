@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+def drop_stored_schemas(apps, schema_editor):
+    # Schemas stored before held ranges and enum options instead of static metadata;
+    # they are rebuilt the next time a camera of each model is read
+    apps.get_model('camera_manager', 'FeatureSchema').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('camera_manager', '0005_camera_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='firmware_version',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.RunPython(drop_stored_schemas, migrations.RunPython.noop),
+    ]
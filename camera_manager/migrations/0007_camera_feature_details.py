@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-17 02:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('camera_manager', '0006_schema_static_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='feature_details',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
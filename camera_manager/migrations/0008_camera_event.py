@@ -0,0 +1,23 @@
+# Generated by Django 4.2.23 on 2026-10-17 02:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('camera_manager', '0007_camera_feature_details'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CameraEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(max_length=50)),
+                ('serial_number', models.CharField(blank=True, max_length=100)),
+                ('timestamp', models.FloatField()),
+                ('data', models.JSONField(default=dict)),
+            ],
+        ),
+    ]
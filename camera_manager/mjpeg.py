@@ -0,0 +1,87 @@
+# camera_manager/mjpeg.py
+import asyncio
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+# multipart/x-mixed-replace (MJPEG over HTTP) for ffmpeg, VLC, recorders and <img>
+# tags. Each connection is one more consumer of the camera's stream fan-out, so it
+# receives the JPEG the stream already encoded for its variant and adds no grab or
+# encode work of its own.
+
+TRANSPORT_MJPEG = 'mjpeg'
+BOUNDARY = 'frame'
+CONTENT_TYPE = f'multipart/x-mixed-replace; boundary={BOUNDARY}'
+
+
+def multipart_part(frame):
+    header = (
+        f"--{BOUNDARY}\r\n"
+        f"Content-Type: image/jpeg\r\n"
+        f"Content-Length: {len(frame.data)}\r\n"
+        f"X-Frame-Id: {frame.frame_id}\r\n"
+        f"X-Timestamp: {frame.timestamp:.0f}\r\n\r\n"
+    )
+    return header.encode('ascii') + frame.data + b"\r\n"
+
+
+class MjpegConsumer:
+    """
+    Stream manager consumer feeding an async multipart HTTP response.
+    send_frame() runs on the consumer's sender thread and returns only once the
+    response has taken the frame. Under servers whose send() returns before the
+    client has the data (Daphne), unsent_bytes() tells the channel how far the
+    client is behind; either way a client that reads slowly backs up into its
+    channel, which drops the oldest frames instead of buffering them here.
+    """
+    transport = TRANSPORT_MJPEG
+
+    def __init__(self, loop, subscription, client=None, connection=None):
+        self.subscription = subscription
+        self.scope = {'client': client}
+        self._connection = connection
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=1)
+        self._closed = threading.Event()
+
+    def send_frame(self, frame):
+        try:
+            future = asyncio.run_coroutine_threadsafe(self._queue.put(frame), self._loop)
+        except RuntimeError:
+            # The response's event loop is gone
+            self._closed.set()
+            return
+        while not self._closed.is_set():
+            try:
+                future.result(timeout=0.5)
+                return
+            except FutureTimeoutError:
+                continue
+        future.cancel()
+
+    def unsent_bytes(self):
+        """Bytes of earlier parts still in the server's buffer for this client, if known."""
+        return self._connection.unsent_bytes() if self._connection else None
+
+    def close(self, code=None):
+        """Ends the response, e.g. when the stream failed."""
+        self._closed.set()
+        try:
+            self._loop.call_soon_threadsafe(self._finish)
+        except RuntimeError:
+            pass
+
+    def _finish(self):
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._queue.put_nowait(None)
+
+    async def parts(self):
+        """Yields one multipart part per frame until the stream ends."""
+        try:
+            while True:
+                frame = await self._queue.get()
+                if frame is None:
+                    return
+                yield multipart_part(frame)
+        finally:
+            self._closed.set()
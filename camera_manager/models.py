@@ -1,4 +1,6 @@
+import json
 from django.db import models
+from django.utils import timezone
 
 class Camera(models.Model):
     # A unique identifier from the camera itself
@@ -8,7 +10,14 @@ class Camera(models.Model):
     model_name = models.CharField(max_length=100)
     current_ip = models.GenericIPAddressField(blank=True, null=True)
     # e.g., 'Online', 'Offline'
-    status = models.CharField(max_length=20, default='Offline')
+    status = models.CharField(max_length=20, default='Offline', db_index=True)
+    # Firmware seen the last time the camera was opened; selects its feature schema while offline
+    firmware_version = models.CharField(max_length=100, blank=True)
+    # {feature name: ranges or enum options} as last read from the camera, shown while it is offline
+    feature_details = models.JSONField(default=dict, blank=True)
+    # Changes with the camera or any of its profiles; the camera list's ETag and
+    # Last-Modified are derived from it
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.friendly_name} ({self.serial_number})"
@@ -21,6 +30,65 @@ class ConfigurationProfile(models.Model):
     # Store all camera settings (gain, exposure, etc.) as a flexible JSON object
     settings_json = models.JSONField()
     created_at = models.DateTimeField(auto_now_add=True)
+    # Optional pinned copies that activate in one step instead of per-feature writes:
+    # an on-camera user set (e.g. "UserSet1") on this profile's camera, and the
+    # camera's configuration as a pylon feature-persistence (.pfs) string
+    user_set = models.CharField(max_length=20, blank=True)
+    pfs_data = models.TextField(blank=True)
+    # "model/firmware" the .pfs string was saved on, and a digest of settings_json at
+    # pin time; a pinned copy is only used while both still match
+    pin_key = models.CharField(max_length=200, blank=True)
+    pin_digest = models.CharField(max_length=64, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['camera', 'created_at'])]
+
+    def __str__(self):
+        return f"{self.name} for {self.camera.friendly_name}"
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Cameras are listed with their profile summaries
+        Camera.objects.filter(pk=self.camera_id).update(updated_at=timezone.now())
+
+    def delete(self, *args, **kwargs):
+        camera_id = self.camera_id
+        result = super().delete(*args, **kwargs)
+        Camera.objects.filter(pk=camera_id).update(updated_at=timezone.now())
+        return result
+
+class FeatureSchema(models.Model):
+    # Static GenICam node metadata (types, visibility, selectors, dependents) shared
+    # by every camera of one model and firmware, so it only has to be walked once
+    model_name = models.CharField(max_length=100)
+    firmware_version = models.CharField(max_length=100, blank=True)
+    # List of {"name", "type", "feature", "visibility", "selectors", "dependents"}
+    # entries, in nodemap order
+    features = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('model_name', 'firmware_version')
 
     def __str__(self):
-        return f"{self.name} for {self.camera.friendly_name}"
\ No newline at end of file
+        return f"{self.model_name} ({self.firmware_version or 'unknown firmware'})"
+
+
+class CameraEvent(models.Model):
+    # Camera inventory and activity events (see events.py). The id is the sequence
+    # number dashboards resume from, shared by every server and discovery process;
+    # only the latest CAMERA_EVENT_HISTORY rows are kept
+    event_type = models.CharField(max_length=50)
+    serial_number = models.CharField(max_length=100, blank=True)
+    # Milliseconds since the epoch
+    timestamp = models.FloatField()
+    data = models.JSONField(default=dict)
+
+    def as_json(self):
+        return json.dumps({
+            'seq': self.id,
+            'type': self.event_type,
+            'serial_number': self.serial_number or None,
+            'timestamp': self.timestamp,
+            'data': self.data,
+        })
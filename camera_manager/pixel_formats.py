@@ -0,0 +1,66 @@
+# camera_manager/pixel_formats.py
+import numpy as np
+from .backend import cv2
+
+# Fast conversion of raw grab buffers into something cv2.imencode accepts
+# (8-bit grayscale or BGR), keyed by pylon pixel type names without the
+# "PixelType_" prefix. Formats not listed here (packed bit depths, YUV, ...)
+# are left to pylon's generic ImageFormatConverter.
+
+# GenICam names Bayer patterns by their first row, OpenCV by the second one.
+# OpenCV's conversion codes are looked up when a frame is converted, so importing
+# this module does not load OpenCV
+_BAYER_TO_BGR = {
+    'BayerRG': 'COLOR_BayerBG2BGR',
+    'BayerBG': 'COLOR_BayerRG2BGR',
+    'BayerGR': 'COLOR_BayerGB2BGR',
+    'BayerGB': 'COLOR_BayerGR2BGR',
+}
+
+# Unpacked formats store each pixel in the low bits of a 16-bit word
+_BIT_DEPTHS = {'10': 10, '12': 12, '16': 16}
+
+
+def _to_8bit(raw, bits):
+    return np.right_shift(raw, bits - 8).astype(np.uint8)
+
+
+def _copy(raw):
+    # Already encodable; the grab buffer goes back to pylon right after conversion, so keep a copy
+    return np.array(raw, copy=True)
+
+
+def _make_mono(bits):
+    return lambda raw: _to_8bit(raw, bits)
+
+
+def _make_bayer(code, bits=8):
+    if bits == 8:
+        return lambda raw: cv2.cvtColor(raw, getattr(cv2, code))
+    return lambda raw: cv2.cvtColor(_to_8bit(raw, bits), getattr(cv2, code))
+
+
+CONVERTERS = {
+    'Mono8': _copy,
+    'BGR8packed': _copy,
+    'RGB8packed': lambda raw: cv2.cvtColor(raw, cv2.COLOR_RGB2BGR),
+}
+CONVERTERS.update({f'Mono{suffix}': _make_mono(bits) for suffix, bits in _BIT_DEPTHS.items()})
+CONVERTERS.update({f'{pattern}8': _make_bayer(code) for pattern, code in _BAYER_TO_BGR.items()})
+CONVERTERS.update({
+    f'{pattern}{suffix}': _make_bayer(code, bits)
+    for pattern, code in _BAYER_TO_BGR.items()
+    for suffix, bits in _BIT_DEPTHS.items()
+})
+
+
+def convert_raw(raw, pixel_format):
+    """
+    Converts a raw image array in the given pixel format into an 8-bit grayscale
+    or BGR array that does not share memory with raw. Returns None when the
+    format has no fast path and the generic converter has to be used instead.
+    """
+    converter = CONVERTERS.get(pixel_format)
+    if converter is None:
+        return None
+    return converter(raw)
@@ -0,0 +1,415 @@
+# camera_manager/recording.py
+import collections
+import os
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from django.conf import settings
+from django.utils.text import slugify
+from .backend import cv2
+from . import events
+from .frames import Subscription
+from .stream_manager import stream_manager
+
+# Recording attaches to a camera like any other stream viewer, so the grab loop
+# never waits for it: frames reach the recorder through its own bounded channel,
+# and disk writes happen on writer threads behind a bounded queue that drops
+# frames (and counts them) when the disk cannot keep up. Pre-trigger dumps are
+# written by a small pool whose threads the interpreter joins at exit, so a dump
+# that has started is finished before the process ends.
+
+TRANSPORT_RECORDER = 'recorder'
+FORMAT_JPEG = 'jpeg'
+FORMAT_AVI = 'avi'
+FORMATS = (FORMAT_JPEG, FORMAT_AVI)
+
+# Pre-trigger dumps reported per camera, most recent last
+TRIGGER_DUMPS_KEPT = 10
+
+
+def recording_root(serial_number):
+    root = getattr(settings, 'CAMERA_RECORDING_DIR', os.path.join(settings.BASE_DIR, 'recordings'))
+    return os.path.join(root, slugify(serial_number) or 'camera')
+
+
+class PreTriggerBuffer:
+    """The most recent encoded frames, capped both by age and by total size."""
+    def __init__(self, seconds, max_bytes):
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self._frames = collections.deque()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def append(self, frame):
+        with self._lock:
+            self._frames.append(frame)
+            self._bytes += len(frame.data)
+            oldest_allowed = frame.timestamp - self.seconds * 1000.0
+            while self._frames and (self._bytes > self.max_bytes or self._frames[0].timestamp < oldest_allowed):
+                self._bytes -= len(self._frames.popleft().data)
+
+    def frames(self):
+        with self._lock:
+            return list(self._frames)
+
+    def get_stats(self):
+        with self._lock:
+            return {'seconds': self.seconds, 'max_bytes': self.max_bytes,
+                    'frames': len(self._frames), 'bytes': self._bytes}
+
+
+class JpegSequenceWriter:
+    """Writes each frame's JPEG bytes to its own file; no re-encoding."""
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, frame):
+        path = os.path.join(self.directory, f"{frame.frame_id:08d}_{frame.timestamp:.0f}.jpg")
+        with open(path, 'wb') as f:
+            f.write(frame.data)
+
+    def close(self):
+        pass
+
+
+class AviWriter:
+    """Motion-JPEG AVI through cv2.VideoWriter, opened with the first frame's size."""
+    def __init__(self, path, fps):
+        self.path = path
+        self.fps = fps
+        self._writer = None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def write(self, frame):
+        image = cv2.imdecode(np.frombuffer(frame.data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            return
+        if self._writer is None:
+            height, width = image.shape[:2]
+            self._writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*'MJPG'), self.fps, (width, height))
+        self._writer.write(image)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.release()
+
+
+def create_writer(fmt, base_path, fps):
+    if fmt == FORMAT_AVI:
+        return AviWriter(base_path + '.avi', fps)
+    return JpegSequenceWriter(base_path)
+
+
+def write_frames(fmt, base_path, frames, fps):
+    writer = create_writer(fmt, base_path, fps)
+    try:
+        for frame in frames:
+            writer.write(frame)
+    finally:
+        writer.close()
+
+
+def frame_rate(frames, default):
+    """The rate the frames were captured at, from their timestamps (ms); `default` for fewer than two."""
+    if len(frames) < 2 or frames[-1].timestamp <= frames[0].timestamp:
+        return default
+    return (len(frames) - 1) * 1000.0 / (frames[-1].timestamp - frames[0].timestamp)
+
+
+class TriggerDump:
+    """One pre-trigger dump being written, or written, to disk."""
+    def __init__(self, path, fmt, frames):
+        self.path = path
+        self.format = fmt
+        self.frames = frames
+        self.triggered_at = time.time()
+        self.state = 'writing'
+        self.error = None
+
+    def as_dict(self):
+        return {
+            'path': self.path, 'format': self.format, 'frames': self.frames,
+            'triggered_at': self.triggered_at, 'state': self.state, 'error': self.error,
+        }
+
+
+class RecordingSession:
+    """
+    Continuous recording on a writer thread, rotated into a new segment every
+    `segment_seconds`. Frames are queued without blocking; when the queue is
+    full the frame is dropped. If the writer fails, the session ends and `error`
+    says why.
+    """
+    def __init__(self, serial_number, fmt, segment_seconds, queue_size, fps):
+        self.serial_number = serial_number
+        self.format = fmt
+        self.segment_seconds = segment_seconds
+        self.fps = fps
+        self.directory = os.path.join(recording_root(serial_number), time.strftime('recording-%Y%m%d-%H%M%S'))
+        self.started_at = time.time()
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.segments = []
+        self.error = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        # Set once the session takes no more frames: stopped, or the writer failed
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def offer(self, frame):
+        if self._closed.is_set():
+            return
+        try:
+            self._queue.put_nowait(frame)
+        except queue.Full:
+            self.frames_dropped += 1
+
+    def stop(self, timeout=None):
+        """
+        Ends the session; frames already queued are still written. Waits at most
+        `timeout` seconds (CAMERA_RECORDING_STOP_TIMEOUT) for the writer to finish.
+        """
+        timeout = timeout if timeout is not None else getattr(settings, 'CAMERA_RECORDING_STOP_TIMEOUT', 10.0)
+        deadline = time.monotonic() + timeout
+        self._closed.set()
+        if self._thread.is_alive():
+            try:
+                # Room frees up as the writer drains the queue
+                self._queue.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+        self._thread.join(max(deadline - time.monotonic(), 0))
+        if self._thread.is_alive():
+            logging.warning(f"[{self.serial_number}] Recording is still writing queued frames after {timeout:g}s.")
+
+    def get_stats(self):
+        return {
+            'format': self.format,
+            'directory': self.directory,
+            'started_at': self.started_at,
+            'segments': len(self.segments),
+            'frames_written': self.frames_written,
+            'frames_dropped': self.frames_dropped,
+            'queued': self._queue.qsize(),
+            'error': self.error,
+        }
+
+    def _open_segment(self):
+        base_path = os.path.join(self.directory, f"segment-{len(self.segments) + 1:04d}")
+        self.segments.append(base_path)
+        return create_writer(self.format, base_path, self.fps), time.monotonic() + self.segment_seconds
+
+    def _run(self):
+        writer, rotate_at = None, None
+        try:
+            while True:
+                frame = self._queue.get()
+                if frame is None:
+                    return
+                if writer is None or time.monotonic() >= rotate_at:
+                    if writer is not None:
+                        writer, previous = None, writer
+                        previous.close()
+                    writer, rotate_at = self._open_segment()
+                try:
+                    writer.write(frame)
+                    self.frames_written += 1
+                except OSError as e:
+                    self.frames_dropped += 1
+                    logging.error(f"[{self.serial_number}] Recording write failed: {e}")
+        except Exception as e:
+            # Creating the segment or encoding failed; later frames would fail the same way
+            self.error = str(e)
+            logging.error(f"[{self.serial_number}] Recording failed: {e}")
+        finally:
+            self._closed.set()
+            try:
+                if writer is not None:
+                    writer.close()
+            except Exception as e:
+                self.error = self.error or str(e)
+                logging.error(f"[{self.serial_number}] Closing the recording failed: {e}")
+            logging.info(f"[{self.serial_number}] Recording stopped: {self.frames_written} frame(s) written.")
+
+
+class CameraRecorder:
+    """
+    Stream consumer holding a camera's pre-trigger buffer and continuous recording.
+    It stays attached to the stream while either of them is active.
+    """
+    transport = TRANSPORT_RECORDER
+
+    def __init__(self, serial_number):
+        self.serial_number = serial_number
+        fps = getattr(settings, 'CAMERA_RECORDING_FPS', 15.0)
+        self.subscription = Subscription(fps=fps)
+        self.scope = {'client': None}
+        self.buffer = None
+        self.session = None
+
+    @property
+    def fps(self):
+        return self.subscription.fps or 15.0
+
+    def is_active(self):
+        return self.buffer is not None or self.session is not None
+
+    def send_frame(self, frame):
+        buffer, session = self.buffer, self.session
+        if buffer is not None:
+            buffer.append(frame)
+        if session is not None:
+            session.offer(frame)
+
+    def close(self, code=None):
+        # The stream failed; nothing more will arrive. This runs on the dying grab
+        # thread, which must not wait for the manager's lock.
+        threading.Thread(target=recording_manager.detach, args=(self.serial_number,), daemon=True).start()
+
+    def get_stats(self):
+        return {
+            'serial_number': self.serial_number,
+            'pretrigger': self.buffer.get_stats() if self.buffer else None,
+            'recording': self.session.get_stats() if self.session else None,
+        }
+
+
+class RecordingManager:
+    """Per-camera recorders, started and stopped through the REST API."""
+    def __init__(self):
+        self._recorders = {}
+        # serial number -> deque of its recent TriggerDumps
+        self._dumps = {}
+        self._lock = threading.Lock()
+        self._dump_writer = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'CAMERA_TRIGGER_WRITERS', 2), thread_name_prefix='trigger-writer'
+        )
+
+    def _recorder(self, serial_number):
+        # Called with self._lock held
+        recorder = self._recorders.get(serial_number)
+        if recorder is None:
+            recorder = self._recorders[serial_number] = CameraRecorder(serial_number)
+            stream_manager.start_stream(serial_number, recorder)
+        return recorder
+
+    def _release(self, serial_number, recorder):
+        """
+        Called with self._lock held. Forgets an idle recorder and returns it; the caller
+        detaches it from the stream after releasing the lock.
+        """
+        if not recorder.is_active() and self._recorders.get(serial_number) is recorder:
+            del self._recorders[serial_number]
+            return recorder
+        return None
+
+    def arm(self, serial_number, seconds=None, max_bytes=None):
+        """Starts (or resizes) the pre-trigger buffer."""
+        seconds = seconds or getattr(settings, 'CAMERA_PRETRIGGER_SECONDS', 5.0)
+        max_bytes = max_bytes or getattr(settings, 'CAMERA_PRETRIGGER_MAX_BYTES', 64 * 1024 * 1024)
+        with self._lock:
+            recorder = self._recorder(serial_number)
+            if recorder.buffer is None:
+                recorder.buffer = PreTriggerBuffer(seconds, max_bytes)
+            else:
+                recorder.buffer.seconds, recorder.buffer.max_bytes = seconds, max_bytes
+            return recorder.get_stats()
+
+    def disarm(self, serial_number):
+        with self._lock:
+            recorder = self._recorders.get(serial_number)
+            if recorder is None or recorder.buffer is None:
+                return False
+            recorder.buffer = None
+            idle = self._release(serial_number, recorder)
+        if idle is not None:
+            stream_manager.stop_stream(serial_number, idle)
+        return True
+
+    def trigger(self, serial_number, label='', fmt=FORMAT_JPEG):
+        """
+        Writes the current pre-trigger buffer to disk in the background; the recording
+        status reports how the write went. Returns (path, frame count), or None when
+        the camera is not armed.
+        """
+        with self._lock:
+            recorder = self._recorders.get(serial_number)
+            buffer = recorder.buffer if recorder else None
+        if buffer is None:
+            return None
+        frames = buffer.frames()
+        name = time.strftime('trigger-%Y%m%d-%H%M%S') + (f"-{slugify(label)}" if slugify(label) else '')
+        base_path = os.path.join(recording_root(serial_number), name)
+        dump = TriggerDump(base_path + ('.avi' if fmt == FORMAT_AVI else ''), fmt, len(frames))
+        with self._lock:
+            self._dumps.setdefault(serial_number, collections.deque(maxlen=TRIGGER_DUMPS_KEPT)).append(dump)
+        # The buffer holds what the camera delivered, which may be less than the recorder's nominal rate
+        self._dump_writer.submit(self._write_dump, serial_number, dump, base_path, frames, frame_rate(frames, recorder.fps))
+        logging.info(f"[{serial_number}] Pre-trigger dump of {len(frames)} frame(s) to {base_path}.")
+        return dump.path, len(frames)
+
+    def _write_dump(self, serial_number, dump, base_path, frames, fps):
+        try:
+            write_frames(dump.format, base_path, frames, fps)
+        except Exception as e:
+            dump.state, dump.error = 'failed', str(e)
+            logging.error(f"[{serial_number}] Writing the pre-trigger dump {dump.path} failed: {e}")
+        else:
+            dump.state = 'written'
+        events.publish(events.TRIGGER_DUMPED, serial_number, **dump.as_dict())
+
+    def start_recording(self, serial_number, fmt=FORMAT_JPEG, segment_seconds=None):
+        segment_seconds = segment_seconds or getattr(settings, 'CAMERA_RECORDING_SEGMENT_SECONDS', 300)
+        with self._lock:
+            recorder = self._recorder(serial_number)
+            if recorder.session is None:
+                recorder.session = RecordingSession(
+                    serial_number, fmt, segment_seconds,
+                    getattr(settings, 'CAMERA_RECORDING_QUEUE_SIZE', 64), recorder.fps,
+                )
+            return recorder.get_stats()
+
+    def stop_recording(self, serial_number):
+        with self._lock:
+            recorder = self._recorders.get(serial_number)
+            session = recorder.session if recorder else None
+            if session is None:
+                return None
+            recorder.session = None
+            idle = self._release(serial_number, recorder)
+        if idle is not None:
+            stream_manager.stop_stream(serial_number, idle)
+        session.stop()
+        return session.get_stats()
+
+    def detach(self, serial_number):
+        """Drops a camera's recorder after its stream ended, finishing any recording."""
+        with self._lock:
+            recorder = self._recorders.pop(serial_number, None)
+        if recorder is None:
+            return
+        session, recorder.session, recorder.buffer = recorder.session, None, None
+        stream_manager.stop_stream(serial_number, recorder)
+        if session is not None:
+            session.stop()
+        logging.warning(f"[{serial_number}] Stream ended; recording and pre-trigger buffer stopped.")
+
+    def get_stats(self, serial_number):
+        """The recorder's state and its recent pre-trigger dumps, or None if it has neither."""
+        with self._lock:
+            recorder = self._recorders.get(serial_number)
+            dumps = [dump.as_dict() for dump in self._dumps.get(serial_number, ())]
+        if recorder is None and not dumps:
+            return None
+        stats = recorder.get_stats() if recorder else {'serial_number': serial_number, 'pretrigger': None, 'recording': None}
+        stats['triggers'] = dumps
+        return stats
+
+
+recording_manager = RecordingManager()
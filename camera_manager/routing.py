@@ -3,4 +3,5 @@ from . import consumers
 
 websocket_urlpatterns = [
     path('ws/camera_stream/<str:serial_number>/', consumers.CameraStreamConsumer.as_asgi()),
+    path('ws/camera_events/', consumers.CameraEventsConsumer.as_asgi()),
 ]
\ No newline at end of file
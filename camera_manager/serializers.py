@@ -2,6 +2,30 @@
 from rest_framework import serializers
 from .models import Camera, ConfigurationProfile
 
+
+def selected_fields(query_params, available):
+    """
+    Field names a request asked for: ?fields=a,b keeps only those, ?omit=a,b drops
+    those. Unknown names are ignored.
+    """
+    selected = set(available)
+    if query_params.get('fields'):
+        selected &= {name.strip() for name in query_params['fields'].split(',')}
+    if query_params.get('omit'):
+        selected -= {name.strip() for name in query_params['omit'].split(',')}
+    return selected
+
+
+class FieldSelectionMixin:
+    """Serializes only the fields selected by the request's ?fields= and ?omit= parameters."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None:
+            return
+        for name in set(self.fields) - selected_fields(request.query_params, self.fields):
+            self.fields.pop(name)
+
 # A lightweight serializer for nesting inside the camera list
 class ProfileSummarySerializer(serializers.ModelSerializer):
     class Meta:
@@ -10,15 +34,21 @@ class ProfileSummarySerializer(serializers.ModelSerializer):
 
 # A full serializer for creating/retrieving a single profile
 class ConfigurationProfileSerializer(serializers.ModelSerializer):
+    # Set through the pin endpoint; the .pfs string itself is not exposed
+    pinned = serializers.SerializerMethodField()
+
     class Meta:
         model = ConfigurationProfile
-        fields = ['id', 'camera', 'name', 'settings_json', 'created_at']
-        read_only_fields = ['camera', 'settings_json', 'created_at']
+        fields = ['id', 'camera', 'name', 'settings_json', 'created_at', 'user_set', 'pinned']
+        read_only_fields = ['camera', 'settings_json', 'created_at', 'user_set']
+
+    def get_pinned(self, obj):
+        return bool(obj.pin_digest)
 
-class CameraSerializer(serializers.ModelSerializer):
+class CameraSerializer(FieldSelectionMixin, serializers.ModelSerializer):
     # Use the summary serializer for the nested list
     profiles = ProfileSummarySerializer(many=True, read_only=True)
 
     class Meta:
         model = Camera
-        fields = ['id', 'serial_number', 'friendly_name', 'model_name', 'current_ip', 'status', 'profiles']
\ No newline at end of file
+        fields = ['id', 'serial_number', 'friendly_name', 'model_name', 'current_ip', 'status', 'profiles']
@@ -0,0 +1,140 @@
+# camera_manager/session_pool.py
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from django.conf import settings
+from .acquisition import open_camera
+
+
+class CameraSession:
+    """
+    One open InstantCamera shared by everything in this process that talks to the device.
+    Hold `lock` around nodemap reads and writes; the grab loop itself does not take it.
+    """
+    def __init__(self, serial_number):
+        self.serial_number = serial_number
+        self.camera = open_camera(serial_number)
+        self.lock = threading.RLock()
+        self.refcount = 0
+        self.last_used = time.monotonic()
+
+    def is_healthy(self):
+        try:
+            return self.camera.IsOpen() and not self.camera.IsCameraDeviceRemoved()
+        except Exception:
+            return False
+
+    def close(self):
+        try:
+            if self.camera.IsGrabbing(): self.camera.StopGrabbing()
+            if self.camera.IsOpen(): self.camera.Close()
+        except Exception as e:
+            logging.warning(f"[{self.serial_number}] Error while closing camera session: {e}")
+        logging.info(f"[{self.serial_number}] Camera session closed.")
+
+
+class CameraSessionPool:
+    """
+    Process-wide, reference-counted pool of open cameras keyed by serial number.
+    Opening a GigE device takes hundreds of milliseconds and fails while another
+    InstantCamera holds it, so streams, feature reads and configuration writes all
+    borrow the same session. Unused sessions are closed after an idle timeout and
+    sessions whose device went away are reopened on the next acquire.
+    """
+    def __init__(self, idle_timeout):
+        self.idle_timeout = idle_timeout
+        self._sessions = {}
+        # serial number -> lock serialising opens of that device
+        self._open_locks = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def acquire(self, serial_number):
+        with self._lock:
+            open_lock = self._open_locks.setdefault(serial_number, threading.Lock())
+        with open_lock:
+            stale = None
+            with self._lock:
+                session = self._sessions.get(serial_number)
+                if session is not None and session.is_healthy():
+                    session.refcount += 1
+                    session.last_used = time.monotonic()
+                    return session
+                if session is not None:
+                    stale = self._sessions.pop(serial_number)
+            if stale is not None:
+                logging.warning(f"[{serial_number}] Camera session failed its health check; reopening.")
+                stale.close()
+            # Opening happens outside the pool lock so other devices are not held up
+            session = CameraSession(serial_number)
+            with self._lock:
+                session.refcount = 1
+                self._sessions[serial_number] = session
+            logging.info(f"[{serial_number}] Camera session opened.")
+        self._start_reaper()
+        return session
+
+    def release(self, session, keep=True):
+        """Returns a session; with keep=False it is closed at once unless someone else is using it."""
+        with self._lock:
+            session.refcount -= 1
+            session.last_used = time.monotonic()
+            if keep or session.refcount or self._sessions.get(session.serial_number) is not session:
+                return
+            del self._sessions[session.serial_number]
+        session.close()
+
+    def is_open(self, serial_number):
+        """Whether the pool holds a session for the camera, in use or idle."""
+        with self._lock:
+            return serial_number in self._sessions
+
+    @contextmanager
+    def session(self, serial_number, keep=True):
+        """
+        Borrows the camera's session. keep=False is for one-off reads of cameras the
+        pool did not hold: the device is not kept open for the idle timeout afterwards.
+        """
+        session = self.acquire(serial_number)
+        try:
+            yield session
+        finally:
+            self.release(session, keep)
+
+    @contextmanager
+    def camera(self, serial_number):
+        """Like session(), but yields the shared InstantCamera itself."""
+        with self.session(serial_number) as session:
+            yield session.camera
+
+    def evict_idle(self):
+        """Closes sessions nobody uses that are idle past the timeout or no longer healthy."""
+        now = time.monotonic()
+        with self._lock:
+            idle = [
+                session for session in self._sessions.values()
+                if session.refcount == 0 and (now - session.last_used > self.idle_timeout or not session.is_healthy())
+            ]
+            for session in idle:
+                del self._sessions[session.serial_number]
+        for session in idle:
+            session.close()
+
+    def _start_reaper(self):
+        with self._lock:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._reap, daemon=True)
+        self._reaper.start()
+
+    def _reap(self):
+        while True:
+            time.sleep(max(self.idle_timeout / 4, 1.0))
+            try:
+                self.evict_idle()
+            except Exception as e:
+                logging.error(f"Camera session eviction failed: {e}")
+
+
+session_pool = CameraSessionPool(getattr(settings, 'CAMERA_SESSION_IDLE_TIMEOUT', 60.0))
@@ -0,0 +1,113 @@
+# camera_manager/snapshots.py
+import collections
+import threading
+import time
+import numpy as np
+from django.conf import settings
+from .backend import cv2
+from .acquisition import encode_variants
+from .camera_interface import grab_one
+from .frames import DEFAULT_VARIANT
+
+# Single images over HTTP. While a stream runs, snapshots come from the frames it
+# already encoded, so polling costs no camera I/O and, for a variant the stream
+# produces anyway, no encoding either. Other sizes and formats are rendered once
+# per frame and reused by every poller until the next frame arrives. Only the
+# renders of each camera's latest frame are kept, at most RENDERS_PER_FRAME of them,
+# since the size and quality come from the client. One-shot grabs are kept only
+# until they expire, for at most GRABS_KEPT cameras.
+
+# format name -> (OpenCV extension, content type)
+FORMATS = {
+    'jpeg': ('.jpg', 'image/jpeg'),
+    'png': ('.png', 'image/png'),
+}
+
+RENDERS_PER_FRAME = 8
+GRABS_KEPT = 16
+
+# serial number -> ((frame id, timestamp), {(format, variant): Snapshot}) for its latest stream frame
+_rendered = {}
+# serial number -> (expiry, frame id, timestamp, image) of the last one-shot grab,
+# least recently used first
+_grabbed = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+class Snapshot:
+    def __init__(self, frame_id, timestamp, data, fmt, variant):
+        self.frame_id = frame_id
+        self.timestamp = timestamp
+        self.data = data
+        self.content_type = FORMATS[fmt][1]
+        max_width, quality = variant
+        self.etag = f'"{frame_id}-{int(timestamp)}-{fmt}-{max_width or 0}-{quality}"'
+
+
+def render_image(frame_id, timestamp, image, fmt, variant):
+    """Encodes an image at the variant's width cap in the given format."""
+    if fmt == 'jpeg':
+        frame = encode_variants(frame_id, image, timestamp, [variant]).get(variant)
+        if frame is None:
+            raise ValueError("Could not encode the frame as jpeg.")
+        return Snapshot(frame_id, timestamp, frame.data, fmt, variant)
+    max_width = variant[0]
+    if max_width and image.shape[1] > max_width:
+        height = max(1, round(image.shape[0] * max_width / image.shape[1]))
+        image = cv2.resize(image, (max_width, height), interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode(FORMATS[fmt][0], image)
+    if not ok:
+        raise ValueError(f"Could not encode the frame as {fmt}.")
+    return Snapshot(frame_id, timestamp, buffer.tobytes(), fmt, variant)
+
+
+def from_stream(serial_number, frames, fmt, variant):
+    """Snapshot from a stream's latest {variant: EncodedFrame}."""
+    frame = frames.get(variant)
+    if fmt == 'jpeg' and frame is not None:
+        return Snapshot(frame.frame_id, frame.timestamp, frame.data, fmt, variant)
+    source = frames.get(DEFAULT_VARIANT) or next(iter(frames.values()))
+    frame = (source.frame_id, source.timestamp)
+    with _lock:
+        rendered_frame, renders = _rendered.get(serial_number, (None, {}))
+        cached = renders.get((fmt, variant)) if rendered_frame == frame else None
+    if cached is not None:
+        return cached
+    image = cv2.imdecode(np.frombuffer(source.data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    snapshot = render_image(source.frame_id, source.timestamp, image, fmt, variant)
+    with _lock:
+        rendered_frame, renders = _rendered.get(serial_number, (None, {}))
+        if rendered_frame != frame:
+            # A newer frame's renders replace the older ones, never the other way round
+            if rendered_frame is not None and rendered_frame[1] > frame[1]:
+                return snapshot
+            renders = {}
+            _rendered[serial_number] = (frame, renders)
+        if len(renders) >= RENDERS_PER_FRAME:
+            del renders[next(iter(renders))]
+        renders[(fmt, variant)] = snapshot
+    return snapshot
+
+
+def one_shot(serial_number, fmt, variant):
+    """
+    Snapshot from a single grab, for cameras that are not streaming. A grab is
+    reused for CAMERA_SNAPSHOT_MAX_AGE seconds so pollers do not trigger one each.
+    """
+    now = time.monotonic()
+    with _lock:
+        for expired in [serial for serial, (expiry, *_) in _grabbed.items() if expiry <= now]:
+            del _grabbed[expired]
+        cached = _grabbed.get(serial_number)
+        if cached is not None:
+            _grabbed.move_to_end(serial_number)
+    if cached is None:
+        frame_id, timestamp, image = grab_one(serial_number)
+        cached = (now + getattr(settings, 'CAMERA_SNAPSHOT_MAX_AGE', 0.5), frame_id, timestamp, image)
+        with _lock:
+            _grabbed[serial_number] = cached
+            _grabbed.move_to_end(serial_number)
+            while len(_grabbed) > GRABS_KEPT:
+                _grabbed.popitem(last=False)
+    _, frame_id, timestamp, image = cached
+    return render_image(frame_id, timestamp, image, fmt, variant)
@@ -1,105 +1,513 @@
+import collections
+import os
 import threading
 import time
 import logging
-import cv2
-import base64
-import json
-import pypylon.pylon as pylon
+from django.conf import settings
+from . import events
+from .acquisition import run_acquisition, transcode_variants
+from .bandwidth import bandwidth_planner
+from .frame_ring import FrameRing, ring_name
+from .frames import DEFAULT_VARIANT, Subscription
+from .metrics import registry, stream_metrics
+from .session_pool import session_pool
+from .stream_worker import WorkerSupervisor
+
+STREAM_MODE_THREAD = 'thread'
+STREAM_MODE_PROCESS = 'process'
+
+# Process mode: how often the relay thread polls the ring and renews its lease
+RING_POLL_INTERVAL = 0.005
+LEASE_RENEW_INTERVAL = 1.0
+# How often a sender waiting for a slow client checks its unsent bytes again
+UNSENT_POLL_INTERVAL = 0.01
+
+
+def acquisition_options():
+    """Keyword arguments for acquisition.run_acquisition(), taken from the Django settings."""
+    change_detection = None
+    if getattr(settings, 'CAMERA_CHANGE_DETECTION', False):
+        change_detection = {
+            'tile_size': getattr(settings, 'CAMERA_CHANGE_TILE_SIZE', 64),
+            'threshold': getattr(settings, 'CAMERA_CHANGE_THRESHOLD', 4.0),
+            'keyframe_interval': getattr(settings, 'CAMERA_KEYFRAME_INTERVAL', 2.0),
+        }
+    return {
+        'encode_workers': getattr(settings, 'CAMERA_ENCODE_WORKERS', 2),
+        'pipeline_depth': getattr(settings, 'CAMERA_PIPELINE_DEPTH', 4),
+        'change_detection': change_detection,
+        'grab_mode': getattr(settings, 'CAMERA_GRAB_MODE', 'retrieve'),
+        'grab_strategy': getattr(settings, 'CAMERA_GRAB_STRATEGY', 'LatestImageOnly'),
+        'max_num_buffer': getattr(settings, 'CAMERA_MAX_NUM_BUFFER', None),
+        'output_queue_size': getattr(settings, 'CAMERA_OUTPUT_QUEUE_SIZE', None),
+        'packet_size': getattr(settings, 'CAMERA_GIGE_PACKET_SIZE', None),
+    }
 
 class CameraStreamManager:
-    def __init__(self):
+    def __init__(self, camera_source=None):
+        # camera_source(serial_number) is a context manager yielding an open camera,
+        # e.g. a synthetic one for benchmarks; by default cameras come from the session pool
+        self._camera_source = camera_source
         self._streams = {}
+        # Handlers taken out of _streams whose threads are still finishing
+        self._stopping = {}
         self._lock = threading.Lock()
 
     def start_stream(self, serial_number, consumer):
         with self._lock:
             if serial_number not in self._streams:
-                self._streams[serial_number] = self._StreamHandler(serial_number)
-                self._streams[serial_number].start()
+                # A stream that is still stopping holds the camera until its thread ends
+                handler = self._StreamHandler(serial_number, self._camera_source, on_exit=self._discard,
+                                              predecessor=self._stopping.get(serial_number))
+                self._streams[serial_number] = handler
+                handler.start()
+                events.publish(events.STREAM_STARTED, serial_number)
+                self._replan_bandwidth()
             self._streams[serial_number].add_consumer(consumer)
 
     def stop_stream(self, serial_number, consumer):
         with self._lock:
-            if serial_number in self._streams:
-                handler = self._streams[serial_number]
-                handler.remove_consumer(consumer)
-                if handler.get_consumer_count() == 0:
-                    handler.stop()
-                    del self._streams[serial_number]
+            handler = self._streams.get(serial_number)
+            if handler is None:
+                return
+            handler.remove_consumer(consumer)
+            if handler.get_consumer_count() != 0:
+                return
+            del self._streams[serial_number]
+            self._stopping[serial_number] = handler
+            events.publish(events.STREAM_STOPPED, serial_number)
+            self._replan_bandwidth()
+        # Joining the grab thread can take up to a grab timeout; other streams must not wait for it
+        handler.stop()
+        with self._lock:
+            if self._stopping.get(serial_number) is handler:
+                del self._stopping[serial_number]
+
+    def _discard(self, handler):
+        """Called by a handler whose thread ended on its own, e.g. after a fatal error."""
+        with self._lock:
+            if self._streams.get(handler.serial_number) is not handler:
+                return
+            del self._streams[handler.serial_number]
+            events.publish(events.STREAM_STOPPED, handler.serial_number)
+            self._replan_bandwidth()
+
+    def _replan_bandwidth(self):
+        # Called with self._lock held; the planner works on its own thread
+        if getattr(settings, 'CAMERA_BANDWIDTH_PLANNING', False) and not self._camera_source:
+            bandwidth_planner.request_replan(self._streams.keys())
+
+    def update_subscription(self, serial_number, consumer, subscription):
+        """Switches a connected consumer to another variant and/or frame rate."""
+        with self._lock:
+            handler = self._streams.get(serial_number)
+        if handler:
+            handler.update_subscription(consumer, subscription)
+
+    def get_latest_frames(self, serial_number):
+        """
+        The most recently published {variant: EncodedFrame} of a running stream,
+        None if no stream runs, or an empty dict if it has not produced a frame yet.
+        """
+        with self._lock:
+            handler = self._streams.get(serial_number)
+        return handler.latest_frames if handler else None
+
+    def wait_for_frames(self, serial_number, after, timeout):
+        """
+        The first full {variant: EncodedFrame} a running stream publishes with a
+        timestamp (ms since the epoch) at or after `after`; None if no stream runs or
+        none arrives within `timeout` seconds.
+        """
+        with self._lock:
+            handler = self._streams.get(serial_number)
+        return handler.wait_for_frames(after, timeout) if handler else None
+
+    def get_consumer_counts(self):
+        """{serial number: consumer count} for every running stream."""
+        with self._lock:
+            handlers = list(self._streams.values())
+        return {handler.serial_number: handler.get_consumer_count() for handler in handlers}
+
+    def get_stream_stats(self, serial_number):
+        """Returns per-consumer delivery counters for a running stream, or None."""
+        with self._lock:
+            handler = self._streams.get(serial_number)
+        return handler.get_stats() if handler else None
+
+    class _ConsumerChannel:
+        """
+        Bounded outbound queue for a single consumer.
+        The grab thread only ever appends to it; a dedicated sender thread drains it.
+        When a client falls behind, the oldest pending frame is dropped (latest wins),
+        so one slow viewer can never hold back the producer or the other viewers.
+        A consumer with unsent_bytes() (see connections.py) counts as behind while
+        more than CAMERA_STREAM_MAX_UNSENT_BYTES sent to it are still in the
+        server's buffer. A subscription with an fps cap simply lets fewer frames
+        into the queue.
+
+        Delta frames only make sense on top of the frames before them, so for a
+        consumer that composites deltas nothing is sent until a full frame arrives,
+        and instead of being dropped, deltas are merged into the next one.
+        """
+        def __init__(self, serial_number, consumer, max_pending, subscription):
+            self.serial_number = serial_number
+            self.consumer = consumer
+            self.subscription = subscription
+            self._last_offer = 0.0
+            self._metrics = stream_metrics(serial_number)
+            self.frames_sent = 0
+            self.frames_dropped = 0
+            self._max_pending = max_pending
+            self._max_unsent = getattr(settings, 'CAMERA_STREAM_MAX_UNSENT_BYTES', 1024 * 1024)
+            self._pending = collections.deque()
+            # Delta consumers: whether a full frame was queued since (re)subscribing,
+            # and a delta held back by the fps cap, to be merged into the next one
+            self._synced = False
+            self._carry = None
+            self._ready = threading.Condition()
+            self._is_running = False
+            self._thread = None
+
+        def start(self):
+            self._is_running = True
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+        def stop(self):
+            with self._ready:
+                self._is_running = False
+                self._pending.clear()
+                self._ready.notify()
+
+        def resync(self):
+            """Waits for the next full frame again, e.g. after the subscription changed."""
+            with self._ready:
+                self._synced = False
+                self._carry = None
+
+        def offer(self, frame):
+            # Called from the stream's publishing thread; resync() may run concurrently
+            with self._ready:
+                if frame.delta:
+                    if not self._synced:
+                        return
+                    if self._carry is not None:
+                        frame, self._carry = frame.merged_over(self._carry), None
+                if self.subscription.fps:
+                    now = time.monotonic()
+                    if now - self._last_offer < 1.0 / self.subscription.fps:
+                        if frame.delta:
+                            self._carry = frame
+                        return
+                    self._last_offer = now
+                if self.subscription.delta:
+                    self._enqueue_delta(frame)
+                else:
+                    if len(self._pending) >= self._max_pending:
+                        self._pending.popleft()
+                        self._dropped(1)
+                    self._pending.append(frame)
+                self._ready.notify()
+
+        def _enqueue_delta(self, frame):
+            # Called with self._ready held
+            if not frame.delta:
+                # A full frame supersedes everything still pending
+                self._synced = True
+                self._dropped(len(self._pending))
+                self._pending.clear()
+            elif self._pending and self._pending[-1].delta:
+                self._pending[-1] = frame.merged_over(self._pending[-1])
+                return
+            elif len(self._pending) >= max(self._max_pending, 2):
+                # Keep the newest full frame the deltas build on
+                while len(self._pending) > 1:
+                    self._pending.popleft()
+                    self._dropped(1)
+            self._pending.append(frame)
+
+        def _dropped(self, count):
+            if count:
+                self.frames_dropped += count
+                self._metrics.frames_dropped.inc(count)
+
+        def close(self, code):
+            self.stop()
+            try:
+                self.consumer.close(code=code)
+            except Exception as e:
+                logging.warning(f"[{self.serial_number}] Could not close consumer: {e}")
+
+        def get_stats(self):
+            client = getattr(self.consumer, 'scope', {}).get('client')
+            return {
+                'client': f"{client[0]}:{client[1]}" if client else None,
+                'transport': getattr(self.consumer, 'transport', None),
+                'subscription': self.subscription.as_dict(),
+                'frames_sent': self.frames_sent,
+                'frames_dropped': self.frames_dropped,
+                'pending': len(self._pending),
+                'unsent_bytes': self._unsent_bytes(),
+            }
+
+        def _unsent_bytes(self):
+            unsent_bytes = getattr(self.consumer, 'unsent_bytes', None)
+            return unsent_bytes() if unsent_bytes else None
+
+        def _wait_for_client(self):
+            # Frames offered meanwhile replace the pending ones, as if send_frame() blocked
+            while self._is_running:
+                unsent = self._unsent_bytes()
+                if unsent is None or unsent <= self._max_unsent:
+                    return
+                time.sleep(UNSENT_POLL_INTERVAL)
+
+        def _run(self):
+            while True:
+                with self._ready:
+                    while self._is_running and not self._pending:
+                        self._ready.wait()
+                self._wait_for_client()
+                with self._ready:
+                    if not self._is_running:
+                        return
+                    frame = self._pending.popleft()
+                try:
+                    started = time.perf_counter()
+                    self.consumer.send_frame(frame)
+                    self._metrics.send.observe(time.perf_counter() - started)
+                    self.frames_sent += 1
+                    self._metrics.frames_sent.inc()
+                    self._metrics.bytes_sent.inc(len(frame.data))
+                except Exception as e:
+                    logging.warning(f"[{self.serial_number}] Failed to send frame to consumer: {e}")
 
     class _StreamHandler:
-        def __init__(self, serial_number):
+        def __init__(self, serial_number, camera_source=None, on_exit=None, predecessor=None):
             self.serial_number = serial_number
-            self._consumers = set()
+            self._camera_source = camera_source
+            # on_exit(handler) runs when the stream thread ends; the thread first waits
+            # for the predecessor's, which may still be releasing the same camera
+            self._on_exit = on_exit
+            self._predecessor = predecessor
+            # consumer -> _ConsumerChannel
+            self._consumers = {}
+            # Distinct (max_width, quality) variants the current consumers asked for, and
+            # those whose consumers all composite deltas; replaced wholesale so the
+            # encoder threads can read them without locking
+            self._variants = frozenset()
+            self._delta_variants = frozenset()
+            # Set when a consumer needs a full frame to build deltas on
+            self._keyframe_requested = False
+            # Last published frames, kept for snapshot requests; replaced, never mutated
+            self.latest_frames = {}
+            # Notified whenever latest_frames is replaced
+            self._published = threading.Condition()
             self._lock = threading.Lock()
             self._thread = None
             self._is_running = False
+            self._max_pending = getattr(settings, 'CAMERA_STREAM_QUEUE_SIZE', 2)
+            self._metrics = stream_metrics(serial_number)
+            # Worker processes open real devices, so a custom camera source always streams in-process
+            self._mode = STREAM_MODE_THREAD if camera_source else getattr(settings, 'CAMERA_STREAM_MODE', STREAM_MODE_THREAD)
 
         def get_consumer_count(self):
             return len(self._consumers)
 
         def add_consumer(self, consumer):
+            subscription = getattr(consumer, 'subscription', None) or Subscription()
+            channel = CameraStreamManager._ConsumerChannel(self.serial_number, consumer, self._max_pending, subscription)
+            channel.start()
             with self._lock:
-                self._consumers.add(consumer)
+                self._consumers[consumer] = channel
+                self._refresh_variants()
+            if subscription.delta:
+                self._keyframe_requested = True
             logging.info(f"[{self.serial_number}] Consumer joined. Total: {self.get_consumer_count()}.")
 
         def remove_consumer(self, consumer):
             with self._lock:
-                self._consumers.discard(consumer)
+                channel = self._consumers.pop(consumer, None)
+                self._refresh_variants()
+            if channel:
+                channel.stop()
             logging.info(f"[{self.serial_number}] Consumer left. Total: {self.get_consumer_count()}.")
 
+        def update_subscription(self, consumer, subscription):
+            with self._lock:
+                channel = self._consumers.get(consumer)
+                if channel:
+                    channel.subscription = subscription
+                    channel.resync()
+                    self._refresh_variants()
+            if subscription.delta:
+                self._keyframe_requested = True
+
+        def _refresh_variants(self):
+            # Called with self._lock held; variants nobody asks for any more are no longer encoded
+            self._variants = frozenset(channel.subscription.variant for channel in self._consumers.values())
+            self._delta_variants = self._variants - frozenset(
+                channel.subscription.variant for channel in self._consumers.values() if not channel.subscription.delta
+            )
+
+        def _take_keyframe_request(self):
+            requested, self._keyframe_requested = self._keyframe_requested, False
+            return requested
+
+        def wait_for_frames(self, after, timeout):
+            deadline = time.monotonic() + timeout
+            with self._published:
+                while True:
+                    frame = next(iter(self.latest_frames.values()), None)
+                    if frame is not None and frame.timestamp >= after:
+                        return self.latest_frames
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._is_running:
+                        return None
+                    self._published.wait(remaining)
+
+        def get_stats(self):
+            with self._lock:
+                channels = list(self._consumers.values())
+            return {
+                'serial_number': self.serial_number,
+                'consumer_count': len(channels),
+                'variants': [{'max_width': max_width, 'quality': quality} for max_width, quality in self._variants],
+                'consumers': [channel.get_stats() for channel in channels],
+            }
+
+        def _broadcast(self, frames):
+            started = time.perf_counter()
+            full = {variant: frame for variant, frame in frames.items() if not frame.delta}
+            if full:
+                with self._published:
+                    self.latest_frames = full
+                    self._published.notify_all()
+            # Only the snapshot of channels is taken under the lock; enqueueing never blocks
+            with self._lock:
+                channels = list(self._consumers.values())
+            for channel in channels:
+                frame = (frames if channel.subscription.delta else full).get(channel.subscription.variant)
+                if frame is None:
+                    # A consumer that just re-subscribed may not have its variant in this frame yet
+                    frame = full.get(DEFAULT_VARIANT) or next(iter(full.values()), None)
+                if frame is not None:
+                    channel.offer(frame)
+            now = time.perf_counter()
+            self._metrics.publish.observe(now - started)
+            self._metrics.published(now)
+
         def start(self):
             if self._is_running: return
             self._is_running = True
-            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread = threading.Thread(target=self._main, daemon=True)
             self._thread.start()
-            logging.info(f"[{self.serial_number}] Stream thread started.")
+            logging.info(f"[{self.serial_number}] Stream thread started ({self._mode} mode).")
 
         def stop(self):
             self._is_running = False
-            if self._thread: self._thread.join()
+            self.join()
             logging.info(f"[{self.serial_number}] Stream thread stopped.")
 
+        def join(self):
+            if self._thread: self._thread.join()
+
+        def _main(self):
+            try:
+                if self._predecessor:
+                    self._predecessor.join()
+                    self._predecessor = None
+                if self._mode == STREAM_MODE_PROCESS:
+                    self._run_from_worker()
+                else:
+                    self._run()
+            finally:
+                self._is_running = False
+                self._metrics.stopped()
+                with self._published:
+                    # Wakes snapshot requests waiting on a stream that just ended
+                    self._published.notify_all()
+                # Taken out of the manager first, so new consumers start a fresh stream
+                if self._on_exit:
+                    self._on_exit(self)
+                # If there was a fatal error, we should inform any remaining clients
+                self._close_consumers(4000)
+
+        def _close_consumers(self, code):
+            with self._lock:
+                channels = list(self._consumers.values())
+            for channel in channels:
+                channel.close(code=code)
+
         def _run(self):
-            camera = None
             try:
-                tl_factory = pylon.TlFactory.GetInstance()
-                camera = pylon.InstantCamera(tl_factory.CreateDevice(pylon.CDeviceInfo().SetSerialNumber(self.serial_number)))
-                camera.Open()
-                camera.StartGrabbing(pylon.GrabStrategy_LatestOneOnly)
-                converter = pylon.ImageFormatConverter()
-                converter.OutputPixelFormat = pylon.PixelType_BGR8packed
-
-                while self._is_running and camera.IsGrabbing():
-                    try:
-                        grab_result = camera.RetrieveResult(2000, pylon.TimeoutHandling_ThrowException)
-                        if not grab_result.GrabSucceeded(): continue
-                        
-                        image = converter.Convert(grab_result).GetArray()
-                        grab_result.Release()
-                        
-                        ret, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 75])
-                        if not ret: continue
-                        
-                        jpg_as_text = base64.b64encode(buffer).decode('utf-8')
-                        payload = json.dumps({'image': jpg_as_text})
-
-                        with self._lock:
-                            for consumer in self._consumers:
-                                consumer.send(text_data=payload)
-                        
-                        time.sleep(0.033) # ~30fps
-                    except pylon.TimeoutException:
-                        logging.warning(f"[{self.serial_number}] Frame grab timeout.")
+                run_acquisition(self.serial_number, lambda: self._is_running, self._broadcast,
+                                variants=lambda: self._variants,
+                                camera_source=self._camera_source or session_pool.camera,
+                                delta_variants=lambda: self._delta_variants,
+                                keyframe_requested=self._take_keyframe_request,
+                                **acquisition_options())
+            except Exception as e:
+                logging.error(f"[{self.serial_number}] FATAL STREAM ERROR: {e}")
+
+        def _run_from_worker(self):
+            """
+            Process mode: the camera is owned by a supervised worker process that publishes
+            encoded frames into a shared-memory ring; this thread only relays them to the
+            local consumers. Any number of server processes can read the same ring.
+            The ring only carries the default variant, so other variants are transcoded here,
+            and consumers that composite deltas receive full frames.
+            """
+            name = ring_name(self.serial_number)
+            lease_timeout = getattr(settings, 'CAMERA_WORKER_LEASE_TIMEOUT', 5.0)
+            pid = os.getpid()
+            ring = None
+            lease = None
+            supervisor = None
+            try:
+                ring = FrameRing.open(
+                    name,
+                    getattr(settings, 'CAMERA_WORKER_RING_SLOTS', 4),
+                    getattr(settings, 'CAMERA_WORKER_SLOT_SIZE', 8 * 1024 * 1024),
+                )
+                lease = ring.acquire_lease(pid)
+                supervisor = WorkerSupervisor(self.serial_number, ring, name, lease_timeout, acquisition_options())
+                last_seq = ring.latest_seq()
+                next_renew = 0.0
+
+                while self._is_running:
+                    now = time.monotonic()
+                    if now >= next_renew:
+                        ring.renew_lease(lease, pid)
+                        supervisor.check()
+                        next_renew = now + LEASE_RENEW_INTERVAL
+                    result = ring.read_latest(last_seq)
+                    if result is None:
+                        time.sleep(RING_POLL_INTERVAL)
                         continue
+                    last_seq, frame = result
+                    self._broadcast(transcode_variants(frame, self._variants))
             except Exception as e:
                 logging.error(f"[{self.serial_number}] FATAL STREAM ERROR: {e}")
             finally:
-                if camera and camera.IsOpen(): camera.Close()
-                logging.info(f"[{self.serial_number}] Camera connection closed.")
-                # If there was a fatal error, we should inform any remaining clients
-                with self._lock:
-                    for consumer in self._consumers:
-                        consumer.close(code=4000)
+                if ring:
+                    if lease is not None:
+                        ring.release_lease(lease)
+                    # The worker and the ring outlive us while other server processes still read them
+                    last_reader = not ring.has_readers(lease_timeout)
+                    if supervisor:
+                        supervisor.stop(terminate=last_reader)
+                    ring.close(unlink=last_reader)
+
+stream_manager = CameraStreamManager()
+
+
+def _collect_consumers():
+    return [
+        ('camera_stream_consumers', 'gauge', 'Consumers attached to a running stream.', {'camera': serial_number}, count)
+        for serial_number, count in stream_manager.get_consumer_counts().items()
+    ]
+
 
-stream_manager = CameraStreamManager()
\ No newline at end of file
+registry.add_collector(_collect_consumers)
@@ -0,0 +1,119 @@
+# camera_manager/stream_worker.py
+import fcntl
+import multiprocessing
+import os
+import tempfile
+import time
+import logging
+from .acquisition import run_acquisition
+from .frame_ring import FrameRing
+from .frames import DEFAULT_VARIANT
+
+# How often the worker re-checks the lease table while grabbing
+LEASE_CHECK_INTERVAL = 0.5
+# Backoff between restarts of a crashing worker, in seconds
+RESTART_DELAY_MIN = 1.0
+RESTART_DELAY_MAX = 30.0
+
+
+def run_worker(serial_number, name, lease_timeout, options):
+    """
+    Entry point of a per-camera worker process (started with the 'spawn' method).
+    Grabs and encodes frames into the shared-memory ring until no reader in any
+    process has renewed its lease for lease_timeout seconds. Only the default
+    variant goes into the ring; readers derive other variants themselves.
+    """
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    ring = FrameRing.attach(name)
+    pid = os.getpid()
+    ring.writer_pid = pid
+    next_check = 0.0
+    has_readers = True
+
+    def is_running():
+        nonlocal next_check, has_readers
+        now = time.monotonic()
+        if now >= next_check:
+            next_check = now + LEASE_CHECK_INTERVAL
+            has_readers = ring.has_readers(lease_timeout)
+        return has_readers
+
+    def publish(frames):
+        frame = frames[DEFAULT_VARIANT]
+        if not ring.publish(frame):
+            logging.warning(f"[{serial_number}] Encoded frame of {len(frame.data)} bytes exceeds the ring slot size.")
+
+    logging.info(f"[{serial_number}] Stream worker process {pid} started.")
+    try:
+        run_acquisition(serial_number, is_running, publish, **options)
+    finally:
+        if ring.writer_pid == pid:
+            ring.writer_pid = 0
+        ring.close()
+        logging.info(f"[{serial_number}] Stream worker process {pid} exited.")
+
+
+class WorkerSupervisor:
+    """
+    Keeps a camera's worker process alive on behalf of one server process.
+    The spawn lock file ensures only one process on the host starts a worker
+    for a given camera, so several Daphne workers watching the same camera
+    never try to open it twice. Crashed workers are restarted with backoff.
+    """
+    def __init__(self, serial_number, ring, name, lease_timeout, options):
+        self.serial_number = serial_number
+        self._ring = ring
+        self._name = name
+        self._lease_timeout = lease_timeout
+        self._options = options
+        self._context = multiprocessing.get_context('spawn')
+        self._process = None
+        self._started_at = 0.0
+        self._lock_file = None
+        self._restart_delay = RESTART_DELAY_MIN
+        self._next_start = 0.0
+
+    def check(self):
+        """Starts or restarts the worker if nobody on this host is publishing into the ring."""
+        now = time.monotonic()
+        if self._process is not None:
+            if self._process.is_alive():
+                return
+            logging.error(f"[{self.serial_number}] Stream worker exited with code {self._process.exitcode}; "
+                          f"restarting in {self._restart_delay:.0f}s.")
+            if now - self._started_at > RESTART_DELAY_MAX:
+                self._restart_delay = RESTART_DELAY_MIN
+            self._process = None
+            self._next_start = now + self._restart_delay
+            self._restart_delay = min(self._restart_delay * 2, RESTART_DELAY_MAX)
+
+        if now < self._next_start or self._ring.writer_alive() or not self._claim():
+            return
+        self._process = self._context.Process(
+            target=run_worker, args=(self.serial_number, self._name, self._lease_timeout, self._options),
+            name=f"stream-worker-{self.serial_number}", daemon=True
+        )
+        self._process.start()
+        self._started_at = now
+
+    def stop(self, terminate):
+        """Releases the spawn lock; terminates the worker too if no reader is left anywhere."""
+        if terminate and self._process is not None and self._process.is_alive():
+            self._process.terminate()
+            self._process.join(timeout=5)
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _claim(self):
+        if self._lock_file is not None:
+            return True
+        lock_file = open(os.path.join(tempfile.gettempdir(), f"{self._name}.lock"), 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
@@ -0,0 +1,301 @@
+# camera_manager/sync_capture.py
+import io
+import json
+import threading
+import time
+import zipfile
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.utils import timezone
+from .acquisition import create_converter, grab_to_image
+from .backend import genicam, pylon
+from .frames import DEFAULT_VARIANT
+from .session_pool import session_pool
+from .snapshots import FORMATS, from_stream, render_image
+from .stream_manager import stream_manager
+
+# Near-simultaneous snapshots from a set of cameras for calibration and multi-view
+# inspection. Every camera is armed in parallel (trigger mode on, grabbing and
+# waiting for its trigger); once all are ready, one GigE action command triggers
+# them all at once, or software triggers are fired back to back. Frames are then
+# retrieved in parallel, so a capture takes about one exposure plus the transfer
+# of the slowest camera instead of the sum over cameras. Cameras that are already
+# streaming are not re-armed: they contribute the first frame their stream grabs
+# after the trigger, which is at most one frame period later.
+
+TRIGGER_AUTO = 'auto'
+TRIGGER_SOFTWARE = 'software'
+TRIGGER_ACTION = 'action'
+TRIGGERS = (TRIGGER_AUTO, TRIGGER_SOFTWARE, TRIGGER_ACTION)
+
+SOURCE_TRIGGERED = 'triggered'
+SOURCE_STREAM = 'stream'
+
+# Trigger features of every trigger selector entry; while armed only FrameStart is
+# triggered, and all of them are restored afterwards
+_TRIGGER_FEATURES = ('TriggerMode', 'TriggerSource')
+
+# One capture at a time: two captures arming the same camera would undo each other
+_capture_lock = threading.Lock()
+
+
+def _node(nodemap, name):
+    node = nodemap.GetNode(name)
+    return node if node is not None and genicam.IsAvailable(node) else None
+
+
+def _action_keys():
+    """(device key, group key, group mask) shared by the cameras and the action command."""
+    return (
+        getattr(settings, 'CAMERA_ACTION_DEVICE_KEY', 0x4711),
+        getattr(settings, 'CAMERA_ACTION_GROUP_KEY', 1),
+        getattr(settings, 'CAMERA_ACTION_GROUP_MASK', 0xFFFFFFFF),
+    )
+
+
+def supports_action_commands(camera):
+    return 'GigE' in camera.GetDeviceInfo().GetDeviceClass() and _node(camera.GetNodeMap(), 'ActionDeviceKey') is not None
+
+
+class _ArmedCamera:
+    """A camera that is not streaming, armed to grab exactly one triggered frame."""
+    def __init__(self, serial_number):
+        self.serial_number = serial_number
+        self.session = None
+        self.camera = None
+        self._previous_selector = None
+        self._previous = []
+
+    def open(self):
+        self.session = session_pool.acquire(self.serial_number)
+        self.camera = self.session.camera
+
+    def arm(self, trigger, timeout_ms):
+        nodemap = self.camera.GetNodeMap()
+        with self.session.lock:
+            selector = nodemap.GetNode('TriggerSelector')
+            previous_selector = selector.ToString()
+            # The whole trigger state is read before anything is written, so close()
+            # only ever restores a complete copy of it
+            previous = []
+            try:
+                for entry in selector.GetSymbolics():
+                    selector.FromString(entry)
+                    previous.append((entry, [(name, nodemap.GetNode(name).ToString()) for name in _TRIGGER_FEATURES]))
+            finally:
+                selector.FromString(previous_selector)
+            if 'FrameStart' not in [entry for entry, _ in previous]:
+                raise Exception("The camera has no FrameStart trigger.")
+            self._previous_selector, self._previous = previous_selector, previous
+            for entry, values in previous:
+                if entry != 'FrameStart' and dict(values)['TriggerMode'] != 'Off':
+                    # Another trigger (e.g. FrameBurstStart) would hold the frame back
+                    selector.FromString(entry)
+                    nodemap.GetNode('TriggerMode').FromString('Off')
+            # Software triggers go to the selected trigger
+            selector.FromString('FrameStart')
+            nodemap.GetNode('TriggerMode').FromString('On')
+            if trigger == TRIGGER_ACTION:
+                nodemap.GetNode('TriggerSource').FromString('Action1')
+                nodemap.GetNode('ActionSelector').SetValue(1)
+                for name, value in zip(('ActionDeviceKey', 'ActionGroupKey', 'ActionGroupMask'), _action_keys()):
+                    nodemap.GetNode(name).SetValue(value)
+            else:
+                nodemap.GetNode('TriggerSource').FromString('Software')
+            self.camera.StartGrabbing(pylon.GrabStrategy_OneByOne)
+        if self.camera.CanWaitForFrameTriggerReady():
+            self.camera.WaitForFrameTriggerReady(timeout_ms, pylon.TimeoutHandling_ThrowException)
+
+    def retrieve(self, timeout_ms):
+        grab_result = self.camera.RetrieveResult(timeout_ms, pylon.TimeoutHandling_ThrowException)
+        try:
+            received = time.time() * 1000.0
+            if not grab_result.GrabSucceeded():
+                raise Exception(f"Grab failed: {grab_result.GetErrorDescription()}")
+            image = grab_to_image(grab_result, create_converter())
+            return grab_result.GetID(), grab_result.GetTimeStamp(), received, image
+        finally:
+            grab_result.Release()
+
+    def close(self):
+        if self.session is None:
+            return
+        try:
+            if self.camera.IsGrabbing(): self.camera.StopGrabbing()
+            nodemap = self.camera.GetNodeMap()
+            if self._previous_selector is not None:
+                with self.session.lock:
+                    selector = nodemap.GetNode('TriggerSelector')
+                    # Undone in the reverse order of arming
+                    for entry, values in reversed(self._previous):
+                        selector.FromString(entry)
+                        for name, value in reversed(values):
+                            try:
+                                nodemap.GetNode(name).FromString(value)
+                            except Exception as e:
+                                logging.warning(f"[{self.serial_number}] Could not restore {name} of {entry}: {e}")
+                    selector.FromString(self._previous_selector)
+        except Exception as e:
+            logging.warning(f"[{self.serial_number}] Could not restore the trigger settings after a synchronized capture: {e}")
+        finally:
+            session_pool.release(self.session)
+            self.session = None
+
+
+def _fire(armed, trigger, errors):
+    """
+    Triggers every armed camera; returns {serial number: time.perf_counter() of its
+    trigger}. Cameras whose software trigger failed are added to `errors` instead.
+    """
+    if trigger == TRIGGER_ACTION:
+        transport_layer = pylon.TlFactory.GetInstance().CreateTl('BaslerGigE')
+        try:
+            fired = time.perf_counter()
+            transport_layer.IssueActionCommandNoWait(
+                *_action_keys(), getattr(settings, 'CAMERA_ACTION_BROADCAST_ADDRESS', '255.255.255.255')
+            )
+        finally:
+            pylon.TlFactory.GetInstance().ReleaseTl(transport_layer)
+        return {camera.serial_number: fired for camera in armed}
+    fired = {}
+    for camera in armed:
+        try:
+            camera.camera.ExecuteSoftwareTrigger()
+        except Exception as e:
+            errors[camera.serial_number] = f"Could not trigger the camera: {e}"
+            continue
+        fired[camera.serial_number] = time.perf_counter()
+    return fired
+
+
+def _run_all(executor, fn, items):
+    """Runs fn(item) for every item in parallel; returns {item: exception} for the ones that failed."""
+    futures = {item: executor.submit(fn, item) for item in items}
+    failed = {}
+    for item, future in futures.items():
+        try:
+            future.result()
+        except Exception as e:
+            failed[item] = e
+    return failed
+
+
+def capture(serial_numbers, fmt='jpeg', trigger=TRIGGER_AUTO, timeout=None):
+    """
+    Captures one frame from each camera as close to the same instant as possible.
+    Returns (manifest, {serial number: Snapshot}); cameras that could not be captured
+    are listed in the manifest with their error instead.
+    """
+    timeout = timeout or getattr(settings, 'CAMERA_SYNC_CAPTURE_TIMEOUT', 5.0)
+    timeout_ms = int(timeout * 1000)
+    variant = DEFAULT_VARIANT
+    streaming = set(stream_manager.get_consumer_counts())
+    cameras = [_ArmedCamera(serial_number) for serial_number in serial_numbers if serial_number not in streaming]
+    results = {}
+    snapshots = {}
+    errors = {}
+
+    with _capture_lock, ThreadPoolExecutor(max_workers=max(len(serial_numbers), 1), thread_name_prefix='sync-capture') as executor:
+        started = time.perf_counter()
+        try:
+            for camera, e in _run_all(executor, _ArmedCamera.open, cameras).items():
+                errors[camera.serial_number] = f"Could not open the camera: {e}"
+            armed = [camera for camera in cameras if camera.serial_number not in errors]
+            if trigger == TRIGGER_AUTO:
+                trigger = TRIGGER_ACTION if armed and all(supports_action_commands(camera.camera) for camera in armed) \
+                    else TRIGGER_SOFTWARE
+            for camera, e in _run_all(executor, lambda camera: camera.arm(trigger, timeout_ms), armed).items():
+                errors[camera.serial_number] = f"Could not arm the camera: {e}"
+            armed = [camera for camera in armed if camera.serial_number not in errors]
+            ready = time.perf_counter()
+
+            triggered_at = time.time() * 1000.0
+            fired = _fire(armed, trigger, errors)
+            armed = [camera for camera in armed if camera.serial_number in fired]
+            first_trigger = min(fired.values(), default=time.perf_counter())
+            images = {}
+
+            def collect(camera):
+                frame_id, camera_timestamp, received, image = camera.retrieve(timeout_ms)
+                images[camera.serial_number] = (frame_id, received, image)
+                results[camera.serial_number] = {
+                    'source': SOURCE_TRIGGERED,
+                    'frame_id': frame_id,
+                    'camera_timestamp': camera_timestamp,
+                    'trigger_offset_ms': round((fired[camera.serial_number] - first_trigger) * 1000.0, 3),
+                    'received_offset_ms': round(received - triggered_at, 3),
+                }
+
+            def from_live_stream(serial_number):
+                frames = stream_manager.wait_for_frames(serial_number, triggered_at, timeout)
+                if frames is None:
+                    raise Exception("The stream did not deliver a frame in time.")
+                snapshot = from_stream(serial_number, frames, fmt, variant)
+                snapshots[serial_number] = snapshot
+                results[serial_number] = {
+                    'source': SOURCE_STREAM,
+                    'frame_id': snapshot.frame_id,
+                    'camera_timestamp': None,
+                    'trigger_offset_ms': None,
+                    'received_offset_ms': round(snapshot.timestamp - triggered_at, 3),
+                }
+
+            def encode(serial_number):
+                frame_id, received, image = images[serial_number]
+                snapshots[serial_number] = render_image(frame_id, received, image, fmt, variant)
+
+            for camera, e in _run_all(executor, collect, armed).items():
+                errors[camera.serial_number] = f"No triggered frame: {e}"
+            live = [serial_number for serial_number in serial_numbers if serial_number in streaming]
+            for serial_number, e in _run_all(executor, from_live_stream, live).items():
+                errors[serial_number] = str(e)
+            finished = time.perf_counter()
+        finally:
+            _run_all(executor, _ArmedCamera.close, cameras)
+        # Encoding happens after the cameras are released and is not part of the capture time
+        for serial_number, e in _run_all(executor, encode, list(images)).items():
+            errors[serial_number] = f"Could not encode the frame: {e}"
+            del results[serial_number]
+
+    offsets = [result['received_offset_ms'] for result in results.values()]
+    manifest = {
+        'captured_at': timezone.now().isoformat(),
+        'trigger': trigger,
+        'format': fmt,
+        'arm_ms': round((ready - started) * 1000.0, 3),
+        'capture_ms': round((finished - ready) * 1000.0, 3),
+        # Spread of the trigger instants on the host; 0 for an action command
+        'trigger_skew_ms': max((result['trigger_offset_ms'] for result in results.values()
+                                if result['trigger_offset_ms'] is not None), default=None),
+        # Spread of the frames' arrival on the host
+        'arrival_skew_ms': round(max(offsets) - min(offsets), 3) if offsets else None,
+        'frames': [
+            {'serial_number': serial_number, 'file': archive_name(serial_number, fmt), **results[serial_number]}
+            for serial_number in serial_numbers if serial_number in results
+        ],
+        'errors': [{'serial_number': serial_number, 'error': error} for serial_number, error in errors.items()],
+    }
+    logging.info(
+        f"Synchronized capture of {len(results)}/{len(serial_numbers)} camera(s) by {trigger} trigger "
+        f"in {manifest['capture_ms']:.1f} ms (armed in {manifest['arm_ms']:.1f} ms)."
+    )
+    return manifest, snapshots
+
+
+def archive_name(serial_number, fmt):
+    """The file name of a camera's image in the ZIP; never a path, whatever the serial number holds."""
+    name = re.sub(r'[^\w-]+', '', serial_number) or 'camera'
+    return f"{name}{FORMATS[fmt][0]}"
+
+
+def bundle(manifest, snapshots):
+    """A ZIP archive with one image per camera and manifest.json."""
+    buffer = io.BytesIO()
+    # Images are compressed already
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+        for frame in manifest['frames']:
+            archive.writestr(frame['file'], snapshots[frame['serial_number']].data)
+        archive.writestr('manifest.json', json.dumps(manifest, indent=2))
+    return buffer.getvalue()
@@ -1,3 +1,1561 @@
-from django.test import TestCase
+import asyncio
+import base64
+import functools
+import importlib
+import json
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
+from unittest import mock
+import cv2
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.test import AsyncClient, Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from rest_framework.permissions import IsAuthenticated
 
-# Create your tests here.
+from .acquisition import GRAB_MODE_EVENT, EncodePipeline, run_acquisition
+from .bandwidth import BandwidthPlanner, bits_per_pixel, link_group, plan_link, read_stream_parameters
+from . import camera_interface, camera_io, events, metrics, views
+from .benchmark import SyntheticCamera, SyntheticSource, synthetic_frames
+from .change_detection import ChangeDetector, changed_runs
+from .connections import Connection, ConnectionMiddleware
+from .configuration import load_pinned, settings_digest, values_equal, write_order
+from .discovery import DiscoveryService, diff_inventory, inventory_events, sync_inventory
+from .events import EventLog
+from .feature_schema import invalidate_values, read_features, schema_for_model, store_values
+from .frame_ring import FrameRing
+from .frames import (
+    CODEC_JPEG, DEFAULT_VARIANT, FLAG_DELTA, FRAME_HEADER, FRAME_HEADER_VERSION, DeltaFrame, EncodedFrame, Subscription,
+)
+from .metrics import Registry, stream_metrics
+from .models import Camera, CameraEvent, ConfigurationProfile, FeatureSchema
+from .pixel_formats import convert_raw
+from .recording import FORMAT_AVI, FORMAT_JPEG, RecordingManager, RecordingSession
+from .serializers import selected_fields
+from .session_pool import CameraSessionPool
+from . import snapshots
+from .snapshots import Snapshot
+from .stream_manager import CameraStreamManager
+from .sync_capture import archive_name, bundle, capture
+
+
+class PixelFormatConversionTests(SimpleTestCase):
+    """Fast conversion routes on synthetic raw buffers."""
+
+    def test_mono8_is_encoded_as_single_channel_copy(self):
+        raw = np.arange(64, dtype=np.uint8).reshape(8, 8)
+        image = convert_raw(raw, 'Mono8')
+        self.assertEqual(image.shape, (8, 8))
+        self.assertEqual(image.dtype, np.uint8)
+        np.testing.assert_array_equal(image, raw)
+        self.assertFalse(np.shares_memory(image, raw))
+
+    def test_mono12_is_shifted_to_8_bit(self):
+        raw = np.array([[0, 16, 4095], [2048, 15, 4080]], dtype=np.uint16)
+        image = convert_raw(raw, 'Mono12')
+        self.assertEqual(image.dtype, np.uint8)
+        np.testing.assert_array_equal(image, [[0, 1, 255], [128, 0, 255]])
+
+    def test_mono16_keeps_most_significant_byte(self):
+        raw = np.array([[0x1234, 0xFF00]], dtype=np.uint16)
+        np.testing.assert_array_equal(convert_raw(raw, 'Mono16'), [[0x12, 0xFF]])
+
+    def test_bayer_rg8_demosaics_red_pixels_to_red(self):
+        # BayerRG: red on even rows/even columns
+        raw = np.zeros((8, 8), dtype=np.uint8)
+        raw[0::2, 0::2] = 200
+        image = convert_raw(raw, 'BayerRG8')
+        self.assertEqual(image.shape, (8, 8, 3))
+        blue, green, red = image[3, 3]
+        self.assertEqual((blue, green, red), (0, 0, 200))
+
+    def test_bayer_bg8_demosaics_blue_pixels_to_blue(self):
+        # BayerBG: blue on even rows/even columns
+        raw = np.zeros((8, 8), dtype=np.uint8)
+        raw[0::2, 0::2] = 200
+        blue, green, red = convert_raw(raw, 'BayerBG8')[3, 3]
+        self.assertEqual((blue, green, red), (200, 0, 0))
+
+    def test_bayer_gr12_is_shifted_then_demosaiced(self):
+        # BayerGR: green on even rows/even and odd rows/odd columns
+        raw = np.zeros((8, 8), dtype=np.uint16)
+        raw[0::2, 0::2] = 4000
+        raw[1::2, 1::2] = 4000
+        image = convert_raw(raw, 'BayerGR12')
+        self.assertEqual(image.dtype, np.uint8)
+        blue, green, red = image[3, 3]
+        self.assertEqual((blue, green, red), (0, 250, 0))
+
+    def test_rgb8_is_reordered_to_bgr(self):
+        raw = np.zeros((2, 2, 3), dtype=np.uint8)
+        raw[..., 0] = 255
+        image = convert_raw(raw, 'RGB8packed')
+        np.testing.assert_array_equal(image[0, 0], [0, 0, 255])
+
+    def test_converted_images_can_be_jpeg_encoded(self):
+        raw = np.random.default_rng(0).integers(0, 4096, (16, 16), dtype=np.uint16)
+        for pixel_format in ('Mono8', 'Mono12', 'BayerRG12'):
+            source = raw.astype(np.uint8) if pixel_format == 'Mono8' else raw
+            ok, _ = cv2.imencode('.jpg', convert_raw(source, pixel_format))
+            self.assertTrue(ok, pixel_format)
+
+    def test_unsupported_format_falls_back_to_generic_converter(self):
+        raw = np.zeros((4, 6), dtype=np.uint8)
+        self.assertIsNone(convert_raw(raw, 'Mono12p'))
+        self.assertIsNone(convert_raw(raw, 'YCbCr422_8'))
+
+
+class BinaryFrameTests(SimpleTestCase):
+    """The header of binary WebSocket frames and the JSON payload built from the same frame."""
+
+    def test_header_round_trip(self):
+        frame = EncodedFrame(2**32 + 7, b'\xff\xd8jpeg', 1920, 1080, timestamp=1700000000123.5)
+        payload = frame.as_bytes()
+        self.assertEqual(len(payload), FRAME_HEADER.size + 6)
+        self.assertEqual(
+            FRAME_HEADER.unpack_from(payload),
+            (FRAME_HEADER_VERSION, CODEC_JPEG, 0, 7, 1700000000123.5, 1920, 1080),
+        )
+        self.assertEqual(payload[FRAME_HEADER.size:], b'\xff\xd8jpeg')
+        # Serialized once per transport, however many consumers send it
+        self.assertIs(frame.as_bytes(), payload)
+
+    def test_json_payload_carries_the_same_image(self):
+        frame = EncodedFrame(3, b'jpeg', 64, 48, timestamp=5.0)
+        data = json.loads(frame.as_json())
+        self.assertEqual(base64.b64decode(data['image']), b'jpeg')
+        self.assertEqual((data['frame_id'], data['timestamp'], data['width'], data['height']), (3, 5.0, 64, 48))
+
+
+class RecordingConsumer:
+    """A stream consumer that keeps the frames it is sent."""
+
+    def __init__(self, subscription=None):
+        self.subscription = subscription
+        self.frames = []
+        self.closed = None
+        self.received = threading.Event()
+
+    def send_frame(self, frame):
+        self.frames.append(frame)
+        self.received.set()
+
+    def close(self, code=None):
+        self.closed = code
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Condition not met in time.")
+        time.sleep(0.01)
+
+
+class StreamManagerTests(SimpleTestCase):
+    """Starting, stopping and losing streams."""
+
+    def test_failed_stream_is_discarded_and_restarted(self):
+        attempts = []
+
+        @contextmanager
+        def failing_source(serial_number):
+            attempts.append(serial_number)
+            raise RuntimeError("Camera unplugged.")
+            yield
+
+        manager = CameraStreamManager(camera_source=failing_source)
+        consumer = RecordingConsumer()
+        manager.start_stream('dead', consumer)
+        wait_until(lambda: consumer.closed is not None)
+        self.assertEqual(consumer.closed, 4000)
+        wait_until(lambda: manager.get_consumer_counts() == {})
+        # A new consumer starts a new stream instead of joining the dead one
+        manager.start_stream('dead', RecordingConsumer())
+        wait_until(lambda: len(attempts) == 2)
+
+    def test_stopping_a_stream_does_not_block_the_manager(self):
+        manager = CameraStreamManager(camera_source=SyntheticSource(32, 16, 'Mono8', fps=2.0))
+        slow, other = RecordingConsumer(), RecordingConsumer()
+        manager.start_stream('slow', slow)
+        self.assertTrue(slow.received.wait(5))
+        stopping = threading.Thread(target=manager.stop_stream, args=('slow', slow))
+        stopping.start()
+        # The slow stream's grab thread waits up to a frame period (0.5 s) before it sees the stop
+        started = time.monotonic()
+        manager.start_stream('other', other)
+        self.assertEqual(manager.get_consumer_counts(), {'other': 1})
+        self.assertLess(time.monotonic() - started, 0.25)
+        stopping.join()
+        manager.stop_stream('other', other)
+        self.assertEqual(manager.get_consumer_counts(), {})
+
+
+class SlowClient(RecordingConsumer):
+    """A consumer whose earlier frames are still waiting in the server's buffer."""
+
+    def __init__(self, subscription=None):
+        super().__init__(subscription)
+        self.unsent = 0
+
+    def unsent_bytes(self):
+        return self.unsent
+
+
+class SlowClientTests(SimpleTestCase):
+    """Frames for a client that reads slower than the server buffers them."""
+
+    def test_frames_are_dropped_while_the_client_is_behind(self):
+        client = SlowClient()
+        channel = CameraStreamManager._ConsumerChannel('slow', client, 2, Subscription())
+        channel._max_unsent = 1000
+        channel.start()
+        self.addCleanup(channel.stop)
+        channel.offer(EncodedFrame(1, b'jpeg', 16, 16))
+        wait_until(lambda: len(client.frames) == 1)
+        client.unsent = 5000
+        for frame_id in range(2, 12):
+            channel.offer(EncodedFrame(frame_id, b'jpeg', 16, 16))
+        time.sleep(0.05)
+        self.assertEqual(len(client.frames), 1)
+        self.assertEqual(channel.get_stats()['unsent_bytes'], 5000)
+        client.unsent = 0
+        wait_until(lambda: len(client.frames) == 3)
+        # Latest wins: only the two newest frames were still pending
+        self.assertEqual([frame.frame_id for frame in client.frames], [1, 10, 11])
+        self.assertEqual(channel.frames_dropped, 8)
+
+    def test_unsent_bytes_of_a_daphne_connection(self):
+        async def handle_reply(protocol, message):
+            pass
+
+        tcp = mock.Mock(spec=['dataBuffer', 'offset', '_tempDataLen'], dataBuffer=b'x' * 300, offset=100, _tempDataLen=50)
+        tls = mock.Mock(spec=['transport'], transport=tcp)
+        self.assertEqual(Connection(None, functools.partial(handle_reply, mock.Mock(transport=tcp))).unsent_bytes(), 250)
+        self.assertEqual(Connection(None, functools.partial(handle_reply, mock.Mock(transport=tls))).unsent_bytes(), 250)
+        # Other servers do not say
+        self.assertIsNone(Connection(None, handle_reply).unsent_bytes())
+
+
+class DaphneLikeServer:
+    """
+    Calls an ASGI application the way Daphne does: send() returns once a message is
+    buffered, and the buffer only drains when the test says so.
+    """
+
+    def __init__(self):
+        self.transport = mock.Mock(spec=['dataBuffer', 'offset', '_tempDataLen'], dataBuffer=b'', offset=0, _tempDataLen=0)
+        self.messages = []
+        self.requested = False
+        self.gone = asyncio.Event()
+
+    async def handle_reply(self, protocol, message):
+        self.messages.append(message)
+        self.transport.dataBuffer += message.get('body', b'')
+
+    def parts(self):
+        return sum(message.get('body', b'').count(b'--frame') for message in self.messages)
+
+    async def receive(self):
+        if not self.requested:
+            self.requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await self.gone.wait()
+        return {'type': 'http.disconnect'}
+
+    def request(self, path):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'root_path': '', 'query_string': b'',
+            'headers': [(b'host', b'testserver')], 'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        }
+        send = functools.partial(self.handle_reply, mock.Mock(transport=self.transport))
+        return asyncio.ensure_future(ConnectionMiddleware(get_asgi_application())(scope, self.receive, send))
+
+
+async def async_wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Condition not met in time.")
+        await asyncio.sleep(0.01)
+
+
+class MjpegEndpointTests(SimpleTestCase):
+    """The MJPEG endpoint under a server whose send() does not wait for the client."""
+
+    def setUp(self):
+        self.manager = CameraStreamManager(camera_source=SyntheticSource(32, 16, 'Mono8', fps=50.0))
+        patcher = mock.patch.object(views, 'stream_manager', self.manager)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_disconnect_stops_the_stream(self):
+        server = DaphneLikeServer()
+        response = server.request('/api/cameras/cam/mjpeg/')
+        await async_wait_until(lambda: server.parts() >= 1)
+        self.assertEqual(self.manager.get_consumer_counts(), {'cam': 1})
+        server.gone.set()
+        await asyncio.wait_for(response, 5)
+        self.assertEqual(self.manager.get_consumer_counts(), {})
+
+    @override_settings(CAMERA_STREAM_MAX_UNSENT_BYTES=1, CAMERA_MJPEG_MAX_FPS=50.0)
+    async def test_frames_are_dropped_for_a_slow_reader(self):
+        server = DaphneLikeServer()
+        response = server.request('/api/cameras/cam/mjpeg/')
+        await async_wait_until(lambda: server.parts() >= 1)
+        await asyncio.sleep(0.3)
+        # The first part never left the server's buffer, so the sender held back
+        self.assertLessEqual(server.parts(), 2)
+        [stats] = self.manager.get_stream_stats('cam')['consumers']
+        self.assertEqual(stats['transport'], 'mjpeg')
+        self.assertGreater(stats['frames_dropped'], 0)
+        self.assertGreater(stats['unsent_bytes'], 1)
+        # Once the client catches up, frames flow again
+        server.transport.offset = len(server.transport.dataBuffer)
+        sent = server.parts()
+        await async_wait_until(lambda: server.parts() > sent)
+        server.gone.set()
+        await asyncio.wait_for(response, 5)
+        self.assertEqual(self.manager.get_consumer_counts(), {})
+
+
+class FrameRingTests(SimpleTestCase):
+    """The shared-memory ring worker processes publish frames into."""
+
+    def setUp(self):
+        self.name = f"basler_test_{os.getpid()}"
+        self.ring = FrameRing.open(self.name, 3, 64)
+        self.addCleanup(self.ring.close, unlink=True)
+
+    def test_frames_written_by_another_process(self):
+        # The writer publishes five frames into three slots, so the ring wraps
+        code = (
+            "import os, sys; from camera_manager.frame_ring import FrameRing; "
+            "from camera_manager.frames import EncodedFrame; "
+            f"ring = FrameRing.open({self.name!r}, 3, 64); ring.writer_pid = os.getpid(); "
+            "[ring.publish(EncodedFrame(i, bytes([i]) * (10 + i), 320, 240, timestamp=float(i))) for i in range(1, 6)]; "
+            "print(ring.created, ring.publish(EncodedFrame(6, bytes(65), 320, 240))); ring.close()"
+        )
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        # Attached to the ring this process created; the oversized frame was refused
+        self.assertEqual(result.stdout.split(), ['False', 'False'])
+        self.assertFalse(self.ring.writer_alive())
+        self.assertEqual(self.ring.latest_seq(), 5)
+        seq, frame = self.ring.read_latest(0)
+        self.assertEqual((seq, frame.frame_id, frame.data, frame.width, frame.timestamp), (5, 5, bytes([5]) * 15, 320, 5.0))
+        self.assertIsNone(self.ring.read_latest(5))
+
+    def test_reader_leases(self):
+        attached = FrameRing.attach(self.name)
+        self.addCleanup(attached.close)
+        self.assertFalse(self.ring.has_readers(1.0))
+        lease = attached.acquire_lease(os.getpid())
+        self.assertTrue(self.ring.has_readers(1.0))
+        attached.release_lease(lease)
+        self.assertFalse(self.ring.has_readers(1.0))
+
+
+class EncodePipelineTests(SimpleTestCase):
+    """Frames encoded in parallel are published in grab order."""
+
+    class _UnevenPipeline(EncodePipeline):
+        # Earlier frames take longer, so their encodes finish after later ones
+        def _encode(self, frame_id, image, timestamp, variants, deltas, changed):
+            time.sleep(0.02 * (5 - frame_id))
+            self.finished.append(frame_id)
+            return super()._encode(frame_id, image, timestamp, variants, deltas, changed)
+
+    def test_out_of_order_encodes_are_published_in_order(self):
+        published = []
+        pipeline = self._UnevenPipeline('pipeline-test', published.append, lambda: {DEFAULT_VARIANT}, workers=4, depth=4)
+        pipeline.finished = []
+        image = np.zeros((16, 32), dtype=np.uint8)
+        for frame_id in range(1, 5):
+            pipeline.submit(frame_id, image, float(frame_id))
+        pipeline.close()
+        self.assertNotEqual(pipeline.finished, [1, 2, 3, 4])
+        self.assertEqual([frames[DEFAULT_VARIANT].frame_id for frames in published], [1, 2, 3, 4])
+
+
+class VariantTests(SimpleTestCase):
+    """Consumers asking for the same size and quality share one encode; fps caps thin a consumer's frames."""
+
+    def test_identical_subscriptions_share_encoded_frames(self):
+        manager = CameraStreamManager(camera_source=SyntheticSource(64, 32, 'Mono8', fps=50.0))
+        first = RecordingConsumer(Subscription(max_width=16, quality=50))
+        second = RecordingConsumer(Subscription(max_width=16, quality=50))
+        full = RecordingConsumer()
+        for consumer in (first, second, full):
+            manager.start_stream('variants', consumer)
+        try:
+            wait_until(lambda: len(first.frames) >= 3 and len(second.frames) >= 3 and len(full.frames) >= 3)
+            stats = manager.get_stream_stats('variants')
+        finally:
+            for consumer in (first, second, full):
+                manager.stop_stream('variants', consumer)
+        self.assertEqual({(variant['max_width'], variant['quality']) for variant in stats['variants']}, {(16, 50), (None, 75)})
+        by_id = {frame.frame_id: frame for frame in second.frames}
+        shared = [frame for frame in first.frames if frame.frame_id in by_id]
+        self.assertTrue(shared)
+        self.assertTrue(all(frame is by_id[frame.frame_id] for frame in shared))
+        self.assertEqual((first.frames[-1].width, first.frames[-1].height), (16, 8))
+        self.assertEqual(full.frames[-1].width, 64)
+
+    def test_fps_cap_lets_fewer_frames_through(self):
+        channel = CameraStreamManager._ConsumerChannel('fps', RecordingConsumer(), 100, Subscription(fps=5))
+        for frame_id in range(10):
+            channel.offer(EncodedFrame(frame_id, b'jpeg', 16, 16))
+        self.assertEqual(channel.get_stats()['pending'], 1)
+        time.sleep(0.21)
+        channel.offer(EncodedFrame(10, b'jpeg', 16, 16))
+        self.assertEqual(channel.get_stats()['pending'], 2)
+
+
+class FakeDevice:
+    """The part of an InstantCamera the session pool uses."""
+
+    def __init__(self, serial_number):
+        self.serial_number = serial_number
+        self.open = True
+        self.removed = False
+
+    def IsOpen(self):
+        return self.open
+
+    def IsCameraDeviceRemoved(self):
+        return self.removed
+
+    def IsGrabbing(self):
+        return False
+
+    def Close(self):
+        self.open = False
+
+
+class SessionPoolTests(SimpleTestCase):
+    """Sharing, releasing and reopening pooled camera sessions."""
+
+    def setUp(self):
+        self.pool = CameraSessionPool(idle_timeout=0.0)
+        patcher = mock.patch('camera_manager.session_pool.open_camera', side_effect=FakeDevice)
+        self.open_camera = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_concurrent_users_share_one_session(self):
+        with self.pool.session('A') as first, self.pool.session('A') as second:
+            self.assertIs(first, second)
+            self.assertEqual(first.refcount, 2)
+            self.pool.evict_idle()
+            self.assertTrue(first.camera.open)
+        self.assertEqual(first.refcount, 0)
+        self.assertEqual(self.open_camera.call_count, 1)
+        self.pool.evict_idle()
+        self.assertFalse(first.camera.open)
+
+    def test_session_is_released_when_the_caller_fails(self):
+        with self.assertRaises(RuntimeError):
+            with self.pool.session('A') as session:
+                raise RuntimeError("Write failed.")
+        self.assertEqual(session.refcount, 0)
+
+    def test_failed_open_and_unhealthy_sessions(self):
+        self.open_camera.side_effect = RuntimeError("Device is in use.")
+        with self.assertRaises(RuntimeError):
+            self.pool.acquire('A')
+        self.open_camera.side_effect = FakeDevice
+        with self.pool.session('A') as session:
+            session.camera.removed = True
+        with self.pool.session('A') as reopened:
+            self.assertIsNot(reopened, session)
+        self.assertFalse(session.camera.open)
+
+    def test_one_off_sessions_are_not_kept(self):
+        with self.pool.session('A', keep=False) as session:
+            self.assertTrue(self.pool.is_open('A'))
+        self.assertFalse(session.camera.open)
+        self.assertFalse(self.pool.is_open('A'))
+        # A session someone else is using stays open
+        with self.pool.session('B') as streaming:
+            with self.pool.session('B', keep=False):
+                pass
+            self.assertTrue(streaming.camera.open)
+
+
+class FeatureSchemaLookupTests(TestCase):
+    """Offline cameras use the schema stored for their model and firmware."""
+
+    def test_schemas_are_kept_apart_by_firmware(self):
+        for firmware_version in ('1.0', '2.0'):
+            FeatureSchema.objects.create(model_name='acA1920', firmware_version=firmware_version, features=[
+                {'name': f'Only{firmware_version[0]}', 'type': 'Integer', 'feature': True, 'visibility': 'Beginner',
+                 'selectors': [], 'dependents': []},
+            ])
+        self.assertEqual(schema_for_model('acA1920', '2.0')[0]['name'], 'Only2')
+        self.assertEqual(schema_for_model('acA1920', '1.0')[0]['name'], 'Only1')
+        self.assertIsNone(schema_for_model('acA1920', ''))
+
+
+class FeatureDetailsTests(TestCase):
+    """Ranges and options are re-read only where a value they depend on changed."""
+
+    SCHEMA = [
+        {'name': 'PixelFormat', 'type': 'Integer', 'selectors': [], 'dependents': ['Width']},
+        {'name': 'Width', 'type': 'Integer', 'selectors': [], 'dependents': []},
+        {'name': 'GainSelector', 'type': 'Integer', 'selectors': [], 'dependents': []},
+        {'name': 'Gain', 'type': 'Float', 'selectors': ['GainSelector'], 'dependents': []},
+    ]
+
+    def setUp(self):
+        self.nodes = {entry['name']: mock.Mock(**{'GetValue.return_value': 1}) for entry in self.SCHEMA}
+        self.nodemap = mock.Mock(**{'GetNode.side_effect': self.nodes.get})
+        self.described = []
+        for patcher in (
+            mock.patch('camera_manager.feature_schema.is_valid_node', return_value=True),
+            mock.patch('camera_manager.feature_schema.describe_node', side_effect=self.describe),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def describe(self, node, feature_type):
+        name = next(name for name, candidate in self.nodes.items() if candidate is node)
+        self.described.append(name)
+        return {'min': 0, 'max': node.GetValue() * 100}
+
+    def read(self, previous=None):
+        self.described = []
+        return read_features(self.nodemap, self.SCHEMA, previous)
+
+    def test_only_dependent_details_are_read_again(self):
+        features = self.read()
+        self.assertEqual(self.described, ['PixelFormat', 'Width', 'GainSelector', 'Gain'])
+        features = self.read(features)
+        self.assertEqual(self.described, [])
+        self.nodes['PixelFormat'].GetValue.return_value = 2
+        features = self.read(features)
+        self.assertEqual(self.described, ['PixelFormat', 'Width'])
+        self.assertEqual(features[1]['details'], {'min': 0, 'max': 100})
+        self.nodes['GainSelector'].GetValue.return_value = 3
+        self.read(features)
+        self.assertEqual(self.described, ['GainSelector', 'Gain'])
+
+    def test_offline_features_show_the_last_details_seen(self):
+        camera = Camera.objects.create(serial_number='cam', model_name='acA1920')
+        ConfigurationProfile.objects.create(camera=camera, name='Day', settings_json={'Width': 640})
+        store_values('cam', [{'name': 'Width', 'type': 'Integer', 'value': 640, 'details': {'min': 16, 'max': 1920}}])
+        self.addCleanup(invalidate_values, 'cam')
+        with mock.patch.object(camera_io, 'call', side_effect=asyncio.TimeoutError):
+            response = self.client.get('/api/cameras/cam/features/')
+        self.assertEqual(response.json()['status'], 'offline')
+        self.assertEqual(response.json()['features'], [{'name': 'Width', 'value': 640, 'details': {'min': 16, 'max': 1920}}])
+
+
+class CameraIOTests(SimpleTestCase):
+    """Camera calls made on behalf of async endpoints."""
+
+    def test_concurrent_identical_reads_share_one_call(self):
+        calls = []
+
+        def read_features(serial_number):
+            calls.append(serial_number)
+            time.sleep(0.1)
+            return [serial_number]
+
+        async def read_concurrently():
+            return await asyncio.gather(*(
+                camera_io.call(('features', 'A'), read_features, 'A') for _ in range(5)
+            ), camera_io.call(('features', 'B'), read_features, 'B'))
+
+        results = asyncio.run(read_concurrently())
+        self.assertEqual(results, [['A']] * 5 + [['B']])
+        self.assertEqual(sorted(calls), ['A', 'B'])
+
+
+class AsyncEndpointAccessTests(TestCase):
+    """Async camera endpoints apply the same access checks as the rest of the API."""
+
+    def test_default_permissions_apply(self):
+        self.assertEqual(self.client.get('/api/cameras/bandwidth_plan/?cameras=').status_code, 200)
+        # Like every APIView, the checks read the permission classes at import time
+        with mock.patch.object(views._EndpointAccess, 'permission_classes', [IsAuthenticated]):
+            self.assertEqual(self.client.get('/api/cameras/bandwidth_plan/?cameras=').status_code, 403)
+            self.assertEqual(self.client.post('/api/cameras/scan/').status_code, 403)
+
+    def test_logged_in_users_need_a_csrf_token(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(User.objects.create_user('operator'))
+        response = client.post('/api/cameras/sync_capture/', {'cameras': []}, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        self.assertIn('CSRF', response.json()['detail'])
+
+
+def fake_apply_configuration(serial_number, settings_dict, pin=None):
+    if serial_number == 'broken':
+        return False, "0 setting(s) changed, 0 unchanged, 1 rejected.", [
+            {'name': 'Width', 'status': 'rejected', 'value': settings_dict['Width'], 'reason': 'out of range'},
+        ]
+    return True, "1 setting(s) changed, 0 unchanged, 0 rejected.", [
+        {'name': 'Width', 'status': 'written', 'value': settings_dict['Width']},
+    ]
+
+
+class BulkApplyTests(TestCase):
+    """The NDJSON stream of a bulk profile apply."""
+
+    def setUp(self):
+        source = Camera.objects.create(serial_number='source', model_name='acA1920')
+        Camera.objects.create(serial_number='broken', model_name='acA1920')
+        Camera.objects.create(serial_number='other-model', model_name='a2A2590')
+        self.profile = ConfigurationProfile.objects.create(camera=source, name='wide', settings_json={'Width': 1920})
+
+    async def test_stream_has_start_results_and_done(self):
+        body = {'profile': self.profile.pk, 'cameras': ['source', 'broken', 'other-model', 'missing']}
+        with mock.patch('camera_manager.camera_interface.apply_configuration', fake_apply_configuration):
+            response = await AsyncClient().post('/api/profiles/bulk_apply/', body, content_type='application/json')
+            self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+            lines = [json.loads(line) async for chunk in response.streaming_content for line in chunk.decode().splitlines()]
+        start, *results, done = lines
+        self.assertEqual(start, {'event': 'start', 'cameras': ['source', 'broken', 'other-model', 'missing']})
+        by_camera = {result['serial_number']: result for result in results}
+        self.assertTrue(all(result['event'] == 'result' and result['profile'] == self.profile.pk for result in results))
+        self.assertEqual(by_camera['source']['status'], 'applied')
+        self.assertEqual(by_camera['source']['report'], [{'name': 'Width', 'status': 'written', 'value': 1920}])
+        self.assertEqual(by_camera['broken']['status'], 'failed')
+        self.assertEqual(by_camera['other-model']['status'], 'incompatible')
+        self.assertEqual(by_camera['missing']['status'], 'not_found')
+        self.assertEqual(done['event'], 'done')
+        self.assertEqual(done['counts'], {'applied': 1, 'failed': 1, 'incompatible': 1, 'not_found': 1})
+
+    def test_invalid_bodies_are_rejected(self):
+        response = self.client.post('/api/profiles/bulk_apply/', {'assignments': {'source': 'x'}}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.post('/api/profiles/bulk_apply/', {}, content_type='application/json').status_code, 400)
+
+
+class PinnedCamera:
+    """A camera whose pinned copies load_pinned can activate."""
+
+    def __init__(self, grabbing=False):
+        self.grabbing = grabbing
+        self.nodemap = mock.MagicMock()
+
+    def IsGrabbing(self):
+        return self.grabbing
+
+    def GetNodeMap(self):
+        return self.nodemap
+
+
+class LoadPinnedTests(SimpleTestCase):
+    """Choosing between the user set, the .pfs string and writing features one by one."""
+
+    settings_dict = {'Width': 640, 'ExposureTime': 3000.0}
+
+    def pin(self, **fields):
+        return {'serial_number': 'A1', 'user_set': 'UserSet1', 'pfs_data': 'pfs', 'pin_key': 'acA1920/1.0',
+                'pin_digest': settings_digest(self.settings_dict), **fields}
+
+    def load(self, camera, serial_number, pin):
+        with mock.patch('camera_manager.configuration.pin_key', return_value='acA1920/1.0'), \
+                mock.patch('camera_manager.configuration.pylon') as pylon:
+            loaded = load_pinned(camera, serial_number, self.settings_dict, pin)
+        return loaded, pylon.FeaturePersistence.LoadFromString
+
+    def test_user_set_on_its_own_camera(self):
+        camera = PinnedCamera()
+        loaded, load_pfs = self.load(camera, 'A1', self.pin())
+        self.assertEqual(loaded, 'user_set')
+        camera.nodemap.GetNode.return_value.SetValue.assert_called_once_with('UserSet1')
+        load_pfs.assert_not_called()
+
+    def test_pfs_on_another_camera_of_the_same_model(self):
+        loaded, load_pfs = self.load(PinnedCamera(), 'B2', self.pin())
+        self.assertEqual(loaded, 'pfs')
+        load_pfs.assert_called_once()
+
+    def test_falls_back_to_writing_features(self):
+        self.assertIsNone(self.load(PinnedCamera(), 'A1', None)[0])
+        # The profile was edited after it was pinned
+        self.assertIsNone(self.load(PinnedCamera(), 'A1', self.pin(pin_digest=settings_digest({'Width': 320})))[0])
+        self.assertIsNone(self.load(PinnedCamera(grabbing=True), 'A1', self.pin())[0])
+        # Another model or firmware
+        self.assertIsNone(self.load(PinnedCamera(), 'B2', self.pin(pin_key='a2A2590/2.0'))[0])
+
+    def test_failed_load_writes_features_instead(self):
+        session = mock.MagicMock()
+        with mock.patch('camera_manager.camera_interface.session_pool') as pool, \
+                mock.patch('camera_manager.configuration.load_pinned', side_effect=RuntimeError('corrupt')), \
+                mock.patch('camera_manager.configuration.apply_settings',
+                           return_value=[{'name': 'Width', 'status': 'written', 'value': 640}]) as apply_settings:
+            pool.session.return_value.__enter__.return_value = session
+            success, message, report = camera_interface.apply_configuration('A1', self.settings_dict, pin=self.pin())
+        self.assertTrue(success)
+        apply_settings.assert_called_once_with(session.camera, self.settings_dict)
+        self.assertEqual(report, [{'name': 'Width', 'status': 'written', 'value': 640}])
+
+
+def fake_pin_configuration(serial_number, settings_dict, user_set=None):
+    pin = {'user_set': user_set or '', 'pfs_data': 'pfs', 'pin_key': 'acA1920/1.0', 'pin_digest': settings_digest(settings_dict)}
+    return True, "Profile pinned.", pin, []
+
+
+class PinProfileTests(TestCase):
+    """Pinning and unpinning profiles through the API."""
+
+    def setUp(self):
+        self.camera = Camera.objects.create(serial_number='A1', model_name='acA1920')
+        self.profile = ConfigurationProfile.objects.create(camera=self.camera, name='wide', settings_json={'Width': 1920})
+        self.other = ConfigurationProfile.objects.create(
+            camera=self.camera, name='narrow', settings_json={'Width': 320}, user_set='UserSet1',
+            pfs_data='old', pin_key='acA1920/1.0', pin_digest=settings_digest({'Width': 320}),
+        )
+
+    def test_pin_apply_and_unpin(self):
+        applied = []
+
+        def fake_apply_configuration(serial_number, settings_dict, pin=None):
+            applied.append(pin)
+            return True, "Loaded.", []
+
+        with mock.patch('camera_manager.camera_interface.pin_configuration', fake_pin_configuration), \
+                mock.patch('camera_manager.camera_interface.apply_configuration', fake_apply_configuration):
+            url = f'/api/profiles/{self.profile.pk}/'
+            response = self.client.post(url + 'pin/', {'user_set': 'UserSet1'}, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['user_set'], 'UserSet1')
+            self.profile.refresh_from_db()
+            self.other.refresh_from_db()
+            self.assertEqual((self.profile.user_set, self.profile.pin_digest), ('UserSet1', settings_digest({'Width': 1920})))
+            # The user set now holds the pinned profile; the other keeps its .pfs copy
+            self.assertEqual((self.other.user_set, self.other.pfs_data), ('', 'old'))
+
+            self.assertEqual(self.client.post(url + 'apply/').status_code, 200)
+            self.assertEqual(applied[-1], {'serial_number': 'A1', 'user_set': 'UserSet1', 'pfs_data': 'pfs',
+                                           'pin_key': 'acA1920/1.0', 'pin_digest': settings_digest({'Width': 1920})})
+
+            self.assertEqual(self.client.delete(url + 'pin/').status_code, 200)
+            self.profile.refresh_from_db()
+            self.assertEqual((self.profile.user_set, self.profile.pfs_data, self.profile.pin_digest), ('', '', ''))
+            self.client.post(url + 'apply/')
+            self.assertIsNone(applied[-1])
+
+    def test_unknown_profile(self):
+        self.assertEqual(self.client.delete('/api/profiles/999/pin/').status_code, 404)
+
+
+def jpeg_frame(frame_id, timestamp):
+    ok, buffer = cv2.imencode('.jpg', np.full((48, 64), frame_id % 256, dtype=np.uint8))
+    return EncodedFrame(frame_id, buffer.tobytes(), 64, 48, timestamp=timestamp)
+
+
+class SnapshotTests(SimpleTestCase):
+    """Snapshots from a running stream or a single grab."""
+
+    def setUp(self):
+        snapshots._rendered.clear()
+        snapshots._grabbed.clear()
+
+    def test_only_the_latest_frames_renders_are_kept(self):
+        frames = {DEFAULT_VARIANT: jpeg_frame(1, 1000.0)}
+        png = snapshots.from_stream('A1', frames, 'png', (32, 80))
+        self.assertIs(snapshots.from_stream('A1', frames, 'png', (32, 80)), png)
+        for quality in range(10, 30):
+            snapshots.from_stream('A1', frames, 'png', (16, quality))
+        self.assertEqual(len(snapshots._rendered['A1'][1]), snapshots.RENDERS_PER_FRAME)
+
+        newer = {DEFAULT_VARIANT: jpeg_frame(2, 2000.0)}
+        self.assertEqual(snapshots.from_stream('A1', newer, 'png', (32, 80)).frame_id, 2)
+        self.assertEqual(snapshots._rendered['A1'][0], (2, 2000.0))
+        self.assertEqual(list(snapshots._rendered['A1'][1]), [('png', (32, 80))])
+        # A late render of an older frame does not replace the newer one's
+        snapshots.from_stream('A1', frames, 'png', (16, 50))
+        self.assertEqual(snapshots._rendered['A1'][0], (2, 2000.0))
+
+    def test_waits_for_a_starting_streams_first_frame(self):
+        frame = jpeg_frame(3, 3000.0)
+        with mock.patch.object(views, 'stream_manager') as manager:
+            manager.get_latest_frames.return_value = {}
+            manager.wait_for_frames.return_value = {DEFAULT_VARIANT: frame}
+            response = self.client.get('/api/cameras/A1/snapshot/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual((response.content, response['X-Frame-Id']), (frame.data, '3'))
+            manager.wait_for_frames.assert_called_once_with('A1', 0, views.SNAPSHOT_FIRST_FRAME_WAIT)
+
+            manager.wait_for_frames.return_value = None
+            self.assertEqual(self.client.get('/api/cameras/A1/snapshot/').status_code, 503)
+
+    def test_one_shot_grabs_are_bounded(self):
+        image = np.zeros((8, 8), dtype=np.uint8)
+        with mock.patch.object(snapshots, 'grab_one', return_value=(1, 1000.0, image)) as grab_one:
+            for index in range(snapshots.GRABS_KEPT + 4):
+                snapshots.one_shot(f'S{index}', 'jpeg', DEFAULT_VARIANT)
+            self.assertEqual(len(snapshots._grabbed), snapshots.GRABS_KEPT)
+            self.assertNotIn('S0', snapshots._grabbed)
+            # The most recently used grab stays
+            snapshots.one_shot('S4', 'jpeg', DEFAULT_VARIANT)
+            snapshots.one_shot('new', 'jpeg', DEFAULT_VARIANT)
+            self.assertIn('S4', snapshots._grabbed)
+            self.assertEqual(grab_one.call_count, snapshots.GRABS_KEPT + 5)
+            snapshots._grabbed.clear()
+            with override_settings(CAMERA_SNAPSHOT_MAX_AGE=0):
+                snapshots.one_shot('other', 'jpeg', DEFAULT_VARIANT)
+                # Expired grabs are dropped on the next one
+                snapshots.one_shot('last', 'jpeg', DEFAULT_VARIANT)
+            self.assertEqual(list(snapshots._grabbed), ['last'])
+
+    def test_uses_a_stream_that_took_the_camera_during_a_grab(self):
+        frame = jpeg_frame(4, 4000.0)
+        with mock.patch.object(views, 'stream_manager') as manager, \
+                mock.patch.object(snapshots, 'one_shot', side_effect=RuntimeError('The camera is grabbing.')):
+            manager.get_latest_frames.side_effect = [None, {DEFAULT_VARIANT: frame}]
+            response = self.client.get('/api/cameras/A1/snapshot/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, frame.data)
+            # Without a stream the grab's error stands
+            manager.get_latest_frames.side_effect = None
+            manager.get_latest_frames.return_value = None
+            self.assertEqual(self.client.get('/api/cameras/A1/snapshot/').status_code, 503)
+
+
+class BlockedWriter:
+    """A segment writer whose disk never finishes a write."""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def write(self, frame):
+        self.release.wait()
+
+    def close(self):
+        pass
+
+
+class RecordingSessionTests(SimpleTestCase):
+    """Writer failures and stopping continuous recordings."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(CAMERA_RECORDING_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_failing_writer_ends_the_session(self):
+        with mock.patch('camera_manager.recording.create_writer', side_effect=PermissionError('read-only file system')):
+            session = RecordingSession('A1', FORMAT_JPEG, 300, 4, 15.0)
+            session.offer(jpeg_frame(1, 1000.0))
+            wait_until(lambda: not session._thread.is_alive())
+        self.assertEqual(session.get_stats()['error'], 'read-only file system')
+        # A dead session takes no more frames and stops at once
+        for frame_id in range(2, 10):
+            session.offer(jpeg_frame(frame_id, 1000.0 * frame_id))
+        started = time.monotonic()
+        session.stop(timeout=5.0)
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(session.get_stats()['frames_written'], 0)
+
+    def test_stop_does_not_hang_on_a_full_queue(self):
+        writer = BlockedWriter()
+        self.addCleanup(writer.release.set)
+        with mock.patch('camera_manager.recording.create_writer', return_value=writer):
+            session = RecordingSession('A1', FORMAT_JPEG, 300, 2, 15.0)
+            for frame_id in range(1, 5):
+                session.offer(jpeg_frame(frame_id, 1000.0 * frame_id))
+            started = time.monotonic()
+            session.stop(timeout=0.2)
+            self.assertLess(time.monotonic() - started, 1.0)
+            self.assertTrue(session._thread.is_alive())
+            # Frames offered after stopping are ignored rather than queued or counted
+            dropped = session.frames_dropped
+            session.offer(jpeg_frame(5, 5000.0))
+            self.assertEqual(session.frames_dropped, dropped)
+            writer.release.set()
+            wait_until(lambda: not session._thread.is_alive())
+        self.assertEqual(session.frames_written, 4 - dropped)
+
+
+class TriggerDumpTests(SimpleTestCase):
+    """Pre-trigger dumps written in the background."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(CAMERA_RECORDING_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        patcher = mock.patch('camera_manager.recording.stream_manager')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manager = RecordingManager()
+        self.manager.arm('A1')
+        # Frames 100 ms apart, though the recorder's nominal rate is 15 fps
+        for frame_id in range(1, 6):
+            self.manager._recorders['A1'].send_frame(jpeg_frame(frame_id, 100.0 * frame_id))
+
+    def test_failed_dump_is_reported(self):
+        with mock.patch('camera_manager.recording.create_writer', side_effect=PermissionError('read-only file system')), \
+                mock.patch('camera_manager.events.publish') as publish:
+            path, frames = self.manager.trigger('A1', fmt=FORMAT_AVI)
+            self.manager._dump_writer.shutdown(wait=True)
+        [dump] = self.manager.get_stats('A1')['triggers']
+        self.assertEqual((dump['path'], dump['frames'], dump['state']), (path, 5, 'failed'))
+        self.assertEqual(dump['error'], 'read-only file system')
+        self.assertEqual(publish.call_args.args[0], 'trigger_dumped')
+        self.assertEqual(publish.call_args.kwargs['state'], 'failed')
+
+    def test_dump_keeps_the_captured_frame_rate(self):
+        with mock.patch('camera_manager.recording.write_frames') as write_frames:
+            self.manager.trigger('A1', fmt=FORMAT_AVI)
+            self.manager._dump_writer.shutdown(wait=True)
+        self.assertAlmostEqual(write_frames.call_args.args[3], 10.0)
+        self.manager.disarm('A1')
+        # The dump's status outlives the disarmed recorder
+        self.assertEqual(self.manager.get_stats('A1')['triggers'][0]['state'], 'written')
+
+
+class RecordingViewTests(TestCase):
+    """Recording endpoints for cameras that are not in the inventory."""
+
+    def test_unknown_camera_is_not_found(self):
+        self.assertEqual(self.client.post('/api/cameras/missing/pretrigger/').status_code, 404)
+        self.assertEqual(self.client.post('/api/cameras/missing/trigger/').status_code, 404)
+        self.assertEqual(self.client.post('/api/cameras/missing/recording/').status_code, 404)
+        self.assertEqual(self.client.get('/api/cameras/missing/recording/').status_code, 404)
+
+
+class CameraListTests(TestCase):
+    """Conditional requests and cursor pagination on the camera list."""
+
+    def setUp(self):
+        for index in range(5):
+            camera = Camera.objects.create(serial_number=f'L-{index}', model_name='acA1920')
+            ConfigurationProfile.objects.create(camera=camera, name='default', settings_json={})
+
+    def test_unchanged_list_is_not_modified(self):
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/cameras/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 5)
+        self.assertIn('no-cache', response['Cache-Control'])
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/api/cameras/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get('/api/cameras/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        # Other fields are another representation
+        self.assertNotEqual(self.client.get('/api/cameras/?omit=profiles')['ETag'], etag)
+
+        # Profile changes and removed cameras change the list
+        profile = ConfigurationProfile.objects.get(camera__serial_number='L-3')
+        self.assertEqual(self.client.delete(f'/api/profiles/{profile.pk}/').status_code, 204)
+        changed = self.client.get('/api/cameras/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        Camera.objects.filter(serial_number='L-4').delete()
+        self.assertEqual(self.client.get('/api/cameras/', HTTP_IF_NONE_MATCH=changed['ETag']).status_code, 200)
+
+    def test_pages_follow_the_cursor(self):
+        first = self.client.get('/api/cameras/?page_size=2&fields=serial_number').json()
+        self.assertEqual(first['results'], [{'serial_number': 'L-0'}, {'serial_number': 'L-1'}])
+        serial_numbers = [camera['serial_number'] for camera in first['results']]
+        page = first
+        while page['next']:
+            page = self.client.get(page['next']).json()
+            serial_numbers += [camera['serial_number'] for camera in page['results']]
+        self.assertEqual(serial_numbers, [f'L-{index}' for index in range(5)])
+
+
+class DiscoveryServiceTests(SimpleTestCase):
+    """Where background discovery runs, and scans in processes without it."""
+
+    def setUp(self):
+        self.found = [{'serial_number': 'A1', 'model_name': 'acA1920'}]
+        for name, value in (('discover_cameras', mock.Mock(return_value=self.found)), ('sync_inventory', mock.Mock(return_value=0))):
+            patcher = mock.patch(f'camera_manager.discovery.{name}', value)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def test_requested_scan_without_the_loop_is_one_pass(self):
+        service = DiscoveryService(interval=60.0)
+        snapshot = service.request_scan().result(timeout=5.0)
+        self.assertEqual(snapshot['cameras'], self.found)
+        self.assertIsNone(service._thread)
+        self.assertEqual(self.discover_cameras.call_count, 1)
+
+    def test_cameras_are_enumerated_when_stale(self):
+        service = DiscoveryService(interval=60.0)
+        self.assertEqual(service.cameras(), self.found)
+        self.assertEqual(service.cameras(), self.found)
+        self.assertEqual(self.discover_cameras.call_count, 1)
+        service.interval = 0.0
+        service.cameras()
+        self.assertEqual(self.discover_cameras.call_count, 2)
+
+    def test_server_process_runs_discovery_only_if_enabled(self):
+        for enabled in (False, True):
+            with self.settings(CAMERA_DISCOVERY_IN_SERVER=enabled), \
+                    mock.patch('camera_manager.backend.warm_up') as warm_up, \
+                    mock.patch('camera_manager.discovery.discovery_service.start') as start, \
+                    mock.patch.dict(sys.modules):
+                sys.modules.pop('project_config.asgi', None)
+                importlib.import_module('project_config.asgi')
+            warm_up.assert_called_once_with()
+            self.assertEqual(start.called, enabled)
+
+
+class DiscoveryDiffTests(SimpleTestCase):
+    """Only cameras that changed since the last pass are written."""
+
+    def test_unchanged_cameras_produce_no_writes(self):
+        found = [{'serial_number': 'A1', 'model_name': 'acA1920', 'ip_address': '10.0.0.5'}]
+        known = {'A1': ('acA1920', '10.0.0.5', 'Online'), 'B2': ('acA640', None, 'Offline')}
+        self.assertEqual(diff_inventory(found, known), ([], []))
+
+    def test_new_changed_and_missing_cameras(self):
+        found = [
+            {'serial_number': 'A1', 'model_name': 'acA1920', 'ip_address': '10.0.0.6'},
+            {'serial_number': 'C3', 'model_name': 'acA640', 'ip_address': None},
+        ]
+        known = {'A1': ('acA1920', '10.0.0.5', 'Online'), 'B2': ('acA640', None, 'Online')}
+        upserts, gone = diff_inventory(found, known)
+        self.assertEqual([row['serial_number'] for row in upserts], ['A1', 'C3'])
+        self.assertEqual(upserts[0]['current_ip'], '10.0.0.6')
+        self.assertEqual(upserts[1]['status'], 'Online')
+        self.assertEqual(gone, ['B2'])
+
+    def test_events_for_a_diff(self):
+        known = {'A1': ('acA1920', '10.0.0.5', 'Online'), 'B2': ('acA640', None, 'Offline')}
+        upserts = [
+            {'serial_number': 'A1', 'model_name': 'acA1920', 'current_ip': '10.0.0.6', 'status': 'Online'},
+            {'serial_number': 'B2', 'model_name': 'acA640', 'current_ip': None, 'status': 'Online'},
+        ]
+        self.assertEqual(inventory_events(upserts, ['C3'], known), [
+            ('camera_changed', 'A1', {'changes': {'current_ip': ['10.0.0.5', '10.0.0.6']}}),
+            ('camera_appeared', 'B2', {'model_name': 'acA640', 'current_ip': None}),
+            ('camera_disappeared', 'C3', {}),
+        ])
+
+
+class InventorySyncTests(TestCase):
+    """Writing a discovery pass to the Camera table."""
+
+    def test_found_changed_and_removed_cameras(self):
+        Camera.objects.create(serial_number='kept', model_name='acA1920', current_ip='10.0.0.1', status='Online')
+        Camera.objects.create(serial_number='moved', model_name='acA1920', current_ip='10.0.0.2', status='Online')
+        Camera.objects.create(serial_number='gone', model_name='acA640', current_ip='10.0.0.3', status='Online',
+                              friendly_name='Conveyor')
+        found = [
+            {'serial_number': 'kept', 'model_name': 'acA1920', 'ip_address': '10.0.0.1'},
+            {'serial_number': 'moved', 'model_name': 'acA1920', 'ip_address': '10.0.0.9'},
+            {'serial_number': 'new', 'model_name': 'a2A2590', 'ip_address': None},
+        ]
+        kept_at = Camera.objects.get(serial_number='kept').updated_at
+        self.assertEqual(sync_inventory(found), 3)
+        rows = {camera.serial_number: camera for camera in Camera.objects.all()}
+        self.assertEqual(rows['moved'].current_ip, '10.0.0.9')
+        self.assertEqual((rows['new'].model_name, rows['new'].status), ('a2A2590', 'Online'))
+        self.assertEqual((rows['gone'].status, rows['gone'].friendly_name), ('Offline', 'Conveyor'))
+        self.assertEqual(rows['kept'].updated_at, kept_at)
+        self.assertGreater(rows['moved'].updated_at, kept_at)
+        # An unchanged pass only reads the table
+        with self.assertNumQueries(1):
+            self.assertEqual(sync_inventory(found), 0)
+
+
+class EventLogTests(TransactionTestCase):
+    """Resuming the camera event stream from a sequence number."""
+
+    def setUp(self):
+        # The server's own log stores what earlier tests published before these tests look at the table
+        events.event_log.stop()
+        patcher = mock.patch.object(events.event_log, 'publish')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def event_log(self, size):
+        log = EventLog(size, poll_interval=0.05)
+        self.addCleanup(log.stop)
+        return log
+
+    def test_resume_within_and_beyond_history(self):
+        log = self.event_log(3)
+        before = log.latest_seq()
+        log.publish('stream_started', 'S0')
+        wait_until(lambda: log.latest_seq() > before)
+        first = log.latest_seq()
+        for index in range(1, 5):
+            log.publish('stream_started', f'S{index}')
+        wait_until(lambda: log.latest_seq() == first + 4)
+        self.assertEqual([seq for seq, _ in log.events_after(first + 2)], [first + 3, first + 4])
+        self.assertEqual(log.events_after(first + 4), [])
+        # Event S1 has been dropped from the history
+        self.assertIsNone(log.events_after(first))
+        self.assertEqual(json.loads(log.events_after(first + 3)[0][1])['serial_number'], 'S4')
+        # Only the kept history stays in the table
+        self.assertEqual(CameraEvent.objects.count(), 3)
+
+    def test_events_published_by_another_process(self):
+        # Two logs share nothing but the table, like discovery running in its own
+        # process (run_discovery) and a server worker with a subscriber
+        subscriber, discovery = self.event_log(10), self.event_log(10)
+        seq = subscriber.latest_seq()
+        discovery.publish('camera_appeared', 'A1', model_name='acA1920')
+        pending = []
+        deadline = time.monotonic() + 5.0
+        while not pending and time.monotonic() < deadline:
+            pending = subscriber.wait_after(seq, 0.5)
+        [(seq, text)] = pending
+        event = json.loads(text)
+        self.assertEqual((event['seq'], event['type'], event['serial_number']), (seq, 'camera_appeared', 'A1'))
+        self.assertEqual(event['data'], {'model_name': 'acA1920'})
+        # A client of one worker resumes on another
+        self.assertEqual(discovery.epoch, subscriber.epoch)
+        wait_until(lambda: discovery.latest_seq() == seq)
+        self.assertEqual(discovery.events_after(seq - 1), pending)
+
+
+class ConfigurationOrderTests(SimpleTestCase):
+    """Diffing and write ordering for profile application."""
+
+    class _EmptyNodeMap:
+        # No XML dependencies; only the built-in ordering rules apply
+        def GetNode(self, name):
+            return None
+
+    def test_float_comparison_tolerates_rounding(self):
+        self.assertTrue(values_equal(5000.0000001, 5000.0, 'Float'))
+        self.assertFalse(values_equal(5000.5, 5000.0, 'Float'))
+        self.assertTrue(values_equal(1, True, 'Boolean'))
+        self.assertFalse(values_equal('Mono8', 'Mono12', 'Enum'))
+
+    def test_known_interactions_are_written_first(self):
+        names = ['OffsetX', 'ExposureTime', 'Width', 'AcquisitionFrameRate', 'ExposureAuto',
+                 'PixelFormat', 'AcquisitionFrameRateEnable', 'Gain']
+        order = write_order(self._EmptyNodeMap(), ('test', ''), names)
+        self.assertEqual(sorted(order), sorted(names))
+        for first, then in [('PixelFormat', 'Width'), ('Width', 'OffsetX'), ('ExposureAuto', 'ExposureTime'),
+                            ('AcquisitionFrameRateEnable', 'AcquisitionFrameRate')]:
+            self.assertLess(order.index(first), order.index(then), (first, then))
+        # Unconstrained features keep their profile order
+        self.assertLess(order.index('ExposureAuto'), order.index('Gain'))
+
+
+class ProfileApplyTests(SimpleTestCase):
+    """Applying the same profile again changes nothing, on pylon's camera emulator."""
+
+    def test_applying_a_profile_twice(self):
+        # The emulator is configured through the environment before pylon starts,
+        # so this runs in its own process
+        code = (
+            "import json, django; django.setup(); "
+            "from camera_manager.backend import pylon; "
+            "from camera_manager.configuration import apply_settings; "
+            "camera = pylon.InstantCamera(pylon.TlFactory.GetInstance().CreateFirstDevice()); camera.Open(); "
+            "nodemap = camera.GetNodeMap(); "
+            "nodemap.GetNode('Width').SetValue(nodemap.GetNode('Width').GetMax()); "
+            # A profile saved before registers were left out, with a stale Width_Reg
+            "profile = {'Width': 320, 'Width_Reg': nodemap.GetNode('Width').GetValue(), "
+            "'PayloadSize': nodemap.GetNode('PayloadSize').GetValue(), 'OffsetX': 0}; "
+            "reports = [apply_settings(camera, profile) for _ in range(3)]; "
+            "print(json.dumps([[(entry['name'], entry['status']) for entry in report] for report in reports] "
+            "+ [nodemap.GetNode('Width').GetValue()]))"
+        )
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                env={**os.environ, 'PYLON_CAMEMU': '1'})
+        if result.returncode != 0:
+            self.skipTest(f"pylon's camera emulator is not available: {result.stderr.strip().splitlines()[-1:]}")
+        *reports, width = json.loads(result.stdout.strip().splitlines()[-1])
+        self.assertEqual(width, 320)
+        self.assertEqual(reports[0], [['Width', 'written'], ['Width_Reg', 'skipped'], ['PayloadSize', 'skipped'], ['OffsetX', 'skipped']])
+        self.assertEqual(reports[1], [['Width', 'skipped'], ['Width_Reg', 'skipped'], ['PayloadSize', 'skipped'], ['OffsetX', 'skipped']])
+        self.assertEqual(reports[2], reports[1])
+
+
+class MetricsRenderTests(SimpleTestCase):
+    """Prometheus text output of the in-process registry."""
+
+    def test_counters_histograms_and_collectors(self):
+        registry = Registry()
+        registry.counter('frames_total', 'Frames.', camera='A1').inc(3)
+        histogram = registry.histogram('wait_seconds', 'Wait.', camera='A1')
+        for value in (0.0004, 0.02, 20.0):
+            histogram.observe(value)
+        registry.add_collector(lambda: [('consumers', 'gauge', 'Consumers.', {'camera': 'A1'}, 2)])
+        lines = registry.render().splitlines()
+        self.assertIn('# TYPE frames_total counter', lines)
+        self.assertIn('frames_total{camera="A1"} 3', lines)
+        self.assertIn('wait_seconds_bucket{camera="A1",le="0.0005"} 1', lines)
+        self.assertIn('wait_seconds_bucket{camera="A1",le="0.025"} 2', lines)
+        self.assertIn('wait_seconds_bucket{camera="A1",le="+Inf"} 3', lines)
+        self.assertIn('wait_seconds_count{camera="A1"} 3', lines)
+        self.assertIn('consumers{camera="A1"} 2', lines)
+
+    def test_only_allowed_label_values_are_rendered(self):
+        registry = Registry()
+        registry.counter('frames_total', 'Frames.', camera='A1').inc()
+        registry.counter('frames_total', 'Frames.', camera='made-up').inc()
+        registry.counter('calls_total', 'Calls.', call='features').inc()
+        registry.add_collector(lambda: [('consumers', 'gauge', 'Consumers.', {'camera': 'made-up'}, 1)])
+        text = registry.render(allowed={'camera': {'A1'}})
+        self.assertIn('frames_total{camera="A1"} 1', text)
+        self.assertIn('calls_total{call="features"} 1', text)
+        self.assertNotIn('made-up', text)
+        registry.remove('camera', {'A1'})
+        self.assertNotIn('frames_total{camera="made-up"}', registry.render())
+
+
+class MetricsViewTests(TestCase):
+    """The metrics endpoint."""
+
+    def test_only_inventory_cameras_are_labelled(self):
+        Camera.objects.create(serial_number='known', model_name='acA1920')
+        stream_metrics('known').frames_sent.inc()
+        stream_metrics('made-up').frames_sent.inc()
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'camera_frames_sent_total{camera="known"}', response.content)
+        self.assertNotIn(b'made-up', response.content)
+        # Nor are they kept
+        self.assertNotIn('made-up', metrics._streams)
+
+    def test_default_permissions_apply(self):
+        with mock.patch.object(views._EndpointAccess, 'permission_classes', [IsAuthenticated]):
+            self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+
+class SyntheticSourceTests(SimpleTestCase):
+    """Benchmark frames and the synthetic camera's LatestImageOnly behaviour."""
+
+    def test_frames_match_pylon_buffer_layout(self):
+        mono12 = synthetic_frames(32, 16, 'Mono12', count=2)
+        self.assertEqual(len(mono12), 2)
+        self.assertEqual((mono12[0].shape, mono12[0].dtype), ((16, 32), np.uint16))
+        self.assertLessEqual(int(mono12[0].max()), 4095)
+        self.assertEqual(convert_raw(mono12[0], 'Mono12').dtype, np.uint8)
+        self.assertEqual(synthetic_frames(32, 16, 'RGB8packed', count=1)[0].shape, (16, 32, 3))
+
+    def test_late_retrieval_counts_skipped_images(self):
+        camera = SyntheticCamera(synthetic_frames(8, 8, 'Mono8', count=1), 'Mono8', fps=100.0)
+        camera.StartGrabbing()
+        self.assertEqual(camera.RetrieveResult(1000).GetNumberOfSkippedImages(), 0)
+        camera._next_frame -= 0.05
+        self.assertGreaterEqual(camera.RetrieveResult(1000).GetNumberOfSkippedImages(), 4)
+
+    def test_event_mode_delivers_frames_in_order(self):
+        published = []
+        run_acquisition('synthetic-test', lambda: len(published) < 5, published.append,
+                        camera_source=SyntheticSource(32, 16, 'Mono8', fps=200.0),
+                        grab_mode=GRAB_MODE_EVENT, grab_strategy='OneByOne', max_num_buffer=4)
+        frame_ids = [next(iter(frames.values())).frame_id for frames in published]
+        self.assertEqual(frame_ids, sorted(frame_ids))
+        self.assertGreaterEqual(len(frame_ids), 5)
+        with self.assertRaises(ValueError):
+            run_acquisition('synthetic-test', lambda: False, published.append, grab_strategy='Newest')
+        with self.assertRaises(ValueError):
+            run_acquisition('synthetic-test', lambda: False, published.append, grab_mode='events')
+
+
+class FieldSelectionTests(SimpleTestCase):
+    """?fields= and ?omit= on list endpoints."""
+
+    available = ['id', 'serial_number', 'status', 'profiles']
+
+    def test_fields_and_omit(self):
+        self.assertEqual(selected_fields({}, self.available), set(self.available))
+        self.assertEqual(selected_fields({'fields': 'serial_number, status,bogus'}, self.available),
+                         {'serial_number', 'status'})
+        self.assertEqual(selected_fields({'omit': 'profiles'}, self.available), {'id', 'serial_number', 'status'})
+        self.assertEqual(selected_fields({'fields': 'id,profiles', 'omit': 'profiles'}, self.available), {'id'})
+
+
+class ChangeDetectionTests(SimpleTestCase):
+    """Skipping unchanged frames and sending changed tiles between keyframes."""
+
+    def setUp(self):
+        self.image = np.full((100, 130), 80, dtype=np.uint8)
+        self.detector = ChangeDetector(tile_size=32, threshold=4.0, keyframe_interval=2.0)
+
+    def test_static_scene_only_sends_periodic_keyframes(self):
+        self.assertEqual(self.detector.detect(self.image, 0.0), (True, None))
+        self.assertIsNone(self.detector.detect(self.image.copy(), 1.0))
+        self.assertEqual(self.detector.detect(self.image, 2.5), (True, None))
+
+    def test_small_change_marks_its_tile_in_the_padded_grid(self):
+        self.detector.detect(self.image, 0.0)
+        moved = self.image.copy()
+        moved[90:96, 100:106] = 255
+        keyframe, changed = self.detector.detect(moved, 0.1)
+        self.assertFalse(keyframe)
+        self.assertEqual(changed.shape, (4, 5))
+        self.assertEqual(list(zip(*np.nonzero(changed))), [(2, 3)])
+        # The reference now holds the change, so the same image is unchanged
+        self.assertIsNone(self.detector.detect(moved, 0.2))
+
+    def test_runs_and_delta_frame_merging(self):
+        changed = np.array([[True, True, False, True], [False, False, False, False]])
+        self.assertEqual(changed_runs(changed), [(0, 0, 2), (0, 3, 1)])
+        older = DeltaFrame(1, [(0, 0, 32, 32, b'a'), (32, 0, 32, 32, b'b')], 128, 64)
+        newer = DeltaFrame(2, [(32, 0, 32, 32, b'c')], 128, 64)
+        merged = newer.merged_over(older)
+        self.assertEqual([tile[4] for tile in merged.tiles], [b'a', b'c'])
+        header = FRAME_HEADER.unpack_from(merged.as_bytes())
+        self.assertEqual((header[2], header[3], header[5], header[6]), (FLAG_DELTA, 2, 128, 64))
+
+
+class BandwidthPlanTests(SimpleTestCase):
+    """Sharing a GigE link between the cameras streaming over it."""
+
+    def camera(self, serial_number, fps):
+        return {'serial_number': serial_number, 'payload_size': 1920 * 1080, 'fps': fps,
+                'packet_size': 1500, 'tick_frequency': 125000000}
+
+    def test_oversubscribed_link_is_shared_in_proportion(self):
+        link = plan_link([self.camera('A', 60.0), self.camera('B', 30.0)], 125e6, 0.1)
+        self.assertTrue(link['oversubscribed'])
+        first, second = link['cameras']
+        self.assertAlmostEqual(first['throughput_limit'] + second['throughput_limit'], link['usable_bytes_per_second'], delta=2)
+        self.assertAlmostEqual(first['throughput_limit'] / second['throughput_limit'], 2.0, places=3)
+        self.assertAlmostEqual(first['expected_fps'] / first['fps'], second['expected_fps'] / second['fps'], places=2)
+        self.assertGreater(second['inter_packet_delay'], first['inter_packet_delay'])
+
+    def test_headroom_and_grouping(self):
+        link = plan_link([self.camera('A', 10.0)], 125e6, 0.1)
+        self.assertFalse(link['oversubscribed'])
+        self.assertEqual(link['cameras'][0]['expected_fps'], 10.0)
+        self.assertEqual(bits_per_pixel('Mono12p'), 12)
+        self.assertEqual(bits_per_pixel('RGB8'), 24)
+        self.assertEqual(link_group({'ip_address': '10.0.0.5', 'interface': '10.0.0.1'}), '10.0.0.1')
+        self.assertEqual(link_group({'ip_address': '10.0.0.5', 'subnet_mask': '255.255.255.0'}), '10.0.0.0/24')
+        self.assertIsNone(link_group({'ip_address': None}))
+
+    def test_demand_is_the_frame_rate_setting(self):
+        # A throttled camera delivers fewer frames than it is set to
+        values = {'Width': 1920, 'Height': 1080, 'PixelFormat': 'Mono8', 'PayloadSize': 1920 * 1080,
+                  'AcquisitionFrameRate': 30.0, 'ResultingFrameRate': 12.5}
+        nodemap = mock.Mock(**{'GetNode.side_effect': lambda name: mock.Mock(**{'GetValue.return_value': values[name]})
+                               if name in values else None})
+        camera = mock.Mock(**{'GetNodeMap.return_value': nodemap})
+        with mock.patch('camera_manager.bandwidth.genicam'):
+            self.assertEqual(read_stream_parameters(camera)['fps'], 30.0)
+
+    @override_settings(CAMERA_BANDWIDTH_READ_TIMEOUT=0.3, CAMERA_GIGE_PACKET_SIZE=None)
+    def test_cameras_are_read_in_parallel_with_a_timeout(self):
+        answered = threading.Event()
+        self.addCleanup(answered.set)
+
+        def read_camera(serial_number):
+            if serial_number == 'hung':
+                answered.wait(5)
+            time.sleep(0.2)
+            return self.camera(serial_number, 10.0)
+
+        cameras = [{'serial_number': serial_number, 'ip_address': f'10.0.0.{index}', 'subnet_mask': '255.255.255.0'}
+                   for index, serial_number in enumerate(('A', 'B', 'C', 'hung'), 1)]
+        started = time.monotonic()
+        with mock.patch('camera_manager.bandwidth.read_camera', side_effect=read_camera):
+            plan = BandwidthPlanner().plan(['A', 'B', 'C', 'hung', 'usb'], cameras)
+        self.assertLess(time.monotonic() - started, 0.6)
+        [link] = plan['links']
+        self.assertEqual([entry['serial_number'] for entry in link['cameras']], ['A', 'B', 'C'])
+        self.assertEqual([entry['serial_number'] for entry in plan['skipped']], ['usb', 'hung'])
+        self.assertIn('0.3s', plan['skipped'][1]['reason'])
+
+
+class LazyBackendTests(SimpleTestCase):
+    """Django startup and the app's modules must not import pypylon or OpenCV."""
+
+    def test_app_modules_do_not_load_camera_libraries(self):
+        code = (
+            "import sys, django; django.setup(); "
+            "import camera_manager.views, camera_manager.routing, camera_manager.stream_worker; "
+            "print(sorted(name for name in ('cv2', 'pypylon.pylon', 'pypylon.genicam') if name in sys.modules))"
+        )
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip().splitlines()[-1], '[]')
+
+
+class SyncCaptureBundleTests(SimpleTestCase):
+    """The ZIP returned by a synchronized capture."""
+
+    def test_bundle_holds_every_frame_and_the_manifest(self):
+        manifest = {'trigger': 'software', 'trigger_skew_ms': 0.1, 'frames': [
+            {'serial_number': serial_number, 'file': f"{serial_number}.jpg", 'frame_id': 1}
+            for serial_number in ('A1', 'B2')
+        ], 'errors': []}
+        images = {serial_number: Snapshot(1, 0.0, serial_number.encode(), 'jpeg', (None, 80)) for serial_number in ('A1', 'B2')}
+        with zipfile.ZipFile(io.BytesIO(bundle(manifest, images))) as archive:
+            self.assertEqual(archive.namelist(), ['A1.jpg', 'B2.jpg', 'manifest.json'])
+            self.assertEqual(archive.read('B2.jpg'), b'B2')
+            self.assertEqual(json.loads(archive.read('manifest.json')), manifest)
+
+    def test_archive_names_are_never_paths(self):
+        self.assertEqual(archive_name('A1', 'jpeg'), 'A1.jpg')
+        self.assertEqual(archive_name('../../etc/cron.d/x', 'png'), 'etccrondx.png')
+        self.assertEqual(archive_name('/..', 'jpeg'), 'camera.jpg')
+
+
+class SyncCaptureRequestTests(TestCase):
+    """The checks a synchronized capture request goes through before any camera is touched."""
+
+    def post(self, body):
+        return self.client.post('/api/cameras/sync_capture/', body, content_type='application/json')
+
+    def test_unknown_cameras_are_rejected(self):
+        Camera.objects.create(serial_number='A1', model_name='acA1920')
+        with mock.patch.object(views.sync_capture, 'capture') as capture:
+            response = self.post({'cameras': ['A1', '../evil']})
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('../evil', response.json()['error'])
+        capture.assert_not_called()
+
+    def test_timeout_must_be_positive(self):
+        Camera.objects.create(serial_number='A1', model_name='acA1920')
+        with mock.patch.object(views.sync_capture, 'capture') as capture:
+            for timeout in (-1, 'soon', 'nan', 'inf'):
+                self.assertEqual(self.post({'cameras': ['A1'], 'timeout': timeout}).status_code, 400, timeout)
+        capture.assert_not_called()
+
+
+class TriggerNode:
+    """A trigger feature node of a TriggerNodeMap."""
+
+    def __init__(self, nodemap, name):
+        self.nodemap = nodemap
+        self.name = name
+
+    def ToString(self):
+        if self.name == 'TriggerSelector':
+            return self.nodemap.selector
+        return self.nodemap.triggers[self.nodemap.selector][self.name]
+
+    def FromString(self, value):
+        self.nodemap.writes.append((self.nodemap.selector, self.name, value))
+        if self.name == 'TriggerSelector':
+            self.nodemap.selector = value
+        else:
+            self.nodemap.triggers[self.nodemap.selector][self.name] = value
+
+    def GetSymbolics(self):
+        return tuple(self.nodemap.triggers)
+
+
+class TriggerNodeMap:
+    """Per-selector TriggerMode and TriggerSource, recording every write."""
+
+    def __init__(self):
+        self.selector = 'ExposureStart'
+        self.triggers = {
+            'FrameBurstStart': {'TriggerMode': 'On', 'TriggerSource': 'Line1'},
+            'FrameStart': {'TriggerMode': 'Off', 'TriggerSource': 'Line2'},
+            'ExposureStart': {'TriggerMode': 'Off', 'TriggerSource': 'Software'},
+        }
+        self.writes = []
+
+    def GetNode(self, name):
+        return TriggerNode(self, name)
+
+
+class TriggeredCamera:
+    """A USB camera that grabs one frame per software trigger of its FrameStart trigger."""
+
+    def __init__(self, frame_id):
+        self.frame_id = frame_id
+        self.nodemap = TriggerNodeMap()
+        self.grabbing = False
+        self.armed_state = None
+        self.triggered = False
+
+    def GetNodeMap(self):
+        return self.nodemap
+
+    def GetDeviceInfo(self):
+        return mock.Mock(GetDeviceClass=mock.Mock(return_value='BaslerUsb'))
+
+    def StartGrabbing(self, strategy):
+        self.grabbing = True
+        self.armed_state = (self.nodemap.selector, {entry: dict(values) for entry, values in self.nodemap.triggers.items()})
+
+    def IsGrabbing(self):
+        return self.grabbing
+
+    def StopGrabbing(self):
+        self.grabbing = False
+
+    def CanWaitForFrameTriggerReady(self):
+        return False
+
+    def ExecuteSoftwareTrigger(self):
+        self.triggered = self.nodemap.selector == 'FrameStart'
+
+    def RetrieveResult(self, timeout_ms, timeout_handling):
+        if not self.triggered:
+            raise TimeoutError("Grab timed out.")
+        return mock.Mock(GrabSucceeded=mock.Mock(return_value=True), GetID=mock.Mock(return_value=self.frame_id),
+                         GetTimeStamp=mock.Mock(return_value=123))
+
+
+class SyncCaptureTests(SimpleTestCase):
+    """Arming, triggering and collecting frames, without cameras."""
+
+    def test_capture_restores_triggers_and_reports_every_camera(self):
+        cameras = {'A1': TriggeredCamera(7), 'B2': TriggeredCamera(8)}
+
+        def acquire(serial_number):
+            if serial_number == 'gone':
+                raise RuntimeError('No device is available.')
+            return mock.Mock(camera=cameras[serial_number], lock=threading.Lock())
+
+        streamed = {DEFAULT_VARIANT: jpeg_frame(9, time.time() * 1000.0 + 1000.0)}
+        with mock.patch('camera_manager.sync_capture.session_pool') as pool, \
+                mock.patch('camera_manager.sync_capture.stream_manager') as manager, \
+                mock.patch('camera_manager.sync_capture.create_converter'), \
+                mock.patch('camera_manager.sync_capture.grab_to_image', return_value=np.zeros((48, 64), dtype=np.uint8)):
+            pool.acquire.side_effect = acquire
+            manager.get_consumer_counts.return_value = {'S': 1}
+            manager.wait_for_frames.return_value = streamed
+            manifest, images = capture(['A1', 'gone', 'S', 'B2'], timeout=1.0)
+
+        self.assertEqual(manifest['trigger'], 'software')
+        self.assertEqual([(frame['serial_number'], frame['source'], frame['frame_id']) for frame in manifest['frames']],
+                         [('A1', 'triggered', 7), ('S', 'stream', 9), ('B2', 'triggered', 8)])
+        self.assertEqual(manifest['errors'], [{'serial_number': 'gone', 'error': 'Could not open the camera: No device is available.'}])
+        self.assertEqual(pool.release.call_count, 2)
+        with zipfile.ZipFile(io.BytesIO(bundle(manifest, images))) as archive:
+            self.assertEqual(archive.namelist(), ['A1.jpg', 'S.jpg', 'B2.jpg', 'manifest.json'])
+            self.assertEqual(archive.read('S.jpg'), streamed[DEFAULT_VARIANT].data)
+
+        nodemap = cameras['A1'].nodemap
+        # Armed: only FrameStart triggers the frame, by software, and stays selected
+        self.assertEqual(cameras['A1'].armed_state, ('FrameStart', {
+            'FrameBurstStart': {'TriggerMode': 'Off', 'TriggerSource': 'Line1'},
+            'FrameStart': {'TriggerMode': 'On', 'TriggerSource': 'Software'},
+            'ExposureStart': {'TriggerMode': 'Off', 'TriggerSource': 'Software'},
+        }))
+        # Afterwards every selector is as it was, restored in the reverse order of arming
+        self.assertEqual((nodemap.selector, nodemap.triggers), ('ExposureStart', TriggerNodeMap().triggers))
+        self.assertEqual(nodemap.writes[-10:], [
+            ('FrameStart', 'TriggerSelector', 'ExposureStart'),
+            ('ExposureStart', 'TriggerSource', 'Software'), ('ExposureStart', 'TriggerMode', 'Off'),
+            ('ExposureStart', 'TriggerSelector', 'FrameStart'),
+            ('FrameStart', 'TriggerSource', 'Line2'), ('FrameStart', 'TriggerMode', 'Off'),
+            ('FrameStart', 'TriggerSelector', 'FrameBurstStart'),
+            ('FrameBurstStart', 'TriggerSource', 'Line1'), ('FrameBurstStart', 'TriggerMode', 'On'),
+            ('FrameBurstStart', 'TriggerSelector', 'ExposureStart'),
+        ])
+
+    def test_arming_failure_leaves_the_triggers_untouched(self):
+        camera = TriggeredCamera(1)
+        del camera.nodemap.triggers['FrameStart']
+        with mock.patch('camera_manager.sync_capture.session_pool') as pool, \
+                mock.patch('camera_manager.sync_capture.stream_manager') as manager:
+            pool.acquire.return_value = mock.Mock(camera=camera, lock=threading.Lock())
+            manager.get_consumer_counts.return_value = {}
+            manifest, images = capture(['A1'], timeout=1.0)
+        self.assertEqual(manifest['frames'], [])
+        self.assertEqual(manifest['errors'], [{'serial_number': 'A1', 'error': 'Could not arm the camera: The camera has no FrameStart trigger.'}])
+        self.assertEqual((camera.nodemap.selector, camera.IsGrabbing()), ('ExposureStart', False))
+        self.assertEqual([write for write in camera.nodemap.writes if write[1] != 'TriggerSelector'], [])
@@ -7,7 +7,19 @@ router = DefaultRouter()
 router.register(r'cameras', views.CameraViewSet, basename='camera')
 router.register(r'profiles', views.ConfigurationProfileViewSet)
 
-# The API URLs are now determined automatically by the router.
+# Endpoints that talk to cameras are async views; they sit in front of the
+# router so the same URLs keep working.
 urlpatterns = [
+    path('metrics/', views.metrics, name='metrics'),
+    path('cameras/scan/', views.scan, name='camera-scan'),
+    path('cameras/bandwidth_plan/', views.bandwidth_plan, name='camera-bandwidth-plan'),
+    path('cameras/sync_capture/', views.synchronized_capture, name='camera-sync-capture'),
+    path('cameras/<str:serial_number>/features/', views.camera_features, name='camera-features'),
+    path('cameras/<str:serial_number>/snapshot/', views.snapshot, name='camera-snapshot'),
+    path('cameras/<str:serial_number>/mjpeg/', views.mjpeg_stream, name='camera-mjpeg'),
+    path('cameras/<str:serial_number>/save_profile/', views.save_profile, name='camera-save-profile'),
+    path('profiles/bulk_apply/', views.bulk_apply, name='configurationprofile-bulk-apply'),
+    path('profiles/<int:pk>/apply/', views.apply_profile, name='configurationprofile-apply'),
+    path('profiles/<int:pk>/pin/', views.pin_profile, name='configurationprofile-pin'),
     path('', include(router.urls)),
-]
\ No newline at end of file
+]
@@ -1,10 +1,31 @@
-from django.shortcuts import render
+import asyncio
+import hashlib
+import json
+import time
+import functools
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Count, Max, Prefetch
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, render
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from .models import Camera, ConfigurationProfile
-from .serializers import CameraSerializer, ConfigurationProfileSerializer
-from . import camera_interface
+from .serializers import CameraSerializer, ConfigurationProfileSerializer, selected_fields
+from . import camera_interface, camera_io, events, feature_schema, snapshots, sync_capture
+from .connections import connection_of
+from .mjpeg import CONTENT_TYPE as MJPEG_CONTENT_TYPE, MjpegConsumer
+from .frames import Subscription
+from .stream_manager import stream_manager
+from .bandwidth import bandwidth_planner
+from .discovery import discovery_service
+from .metrics import forget_streams, registry as metrics_registry
+from .recording import FORMAT_JPEG, FORMATS as RECORDING_FORMATS, recording_manager
 
 # --- View to serve the HTML shell for our single-page app ---
 def index(request):
@@ -16,97 +37,685 @@ def index(request):
 
 # --- API ViewSets for the backend ---
 
+class OptionalCursorPagination(CursorPagination):
+    """
+    Cursor pagination for clients that ask for it with ?page_size= or ?cursor=;
+    without either the list stays a plain JSON array.
+    """
+    ordering = 'id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.page_size_query_param not in request.query_params and self.cursor_query_param not in request.query_params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
 class CameraViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Camera.objects.all()
+    # scan, features and save_profile talk to the camera and are served by the
+    # async views below, so they never tie up the thread these views run on
     serializer_class = CameraSerializer
+    pagination_class = OptionalCursorPagination
     lookup_field = 'serial_number'
 
-    @action(detail=False, methods=['post'])
-    def scan(self, request):
-        # This function remains the same
-        found_cameras = camera_interface.discover_cameras()
-        found_serials = {cam['serial_number'] for cam in found_cameras}
-        for cam_data in found_cameras:
-            Camera.objects.update_or_create(
-                serial_number=cam_data['serial_number'],
-                defaults={'model_name': cam_data['model_name'], 'current_ip': cam_data.get('ip_address'), 'status': 'Online'}
-            )
-        Camera.objects.exclude(serial_number__in=found_serials).update(status='Offline')
-        return Response({'status': 'Scan complete'}, status=status.HTTP_200_OK)
+    def get_queryset(self):
+        queryset = Camera.objects.order_by('id')
+        # Profile summaries for all listed cameras in one query, unless the client omitted them
+        if 'profiles' in selected_fields(self.request.query_params, CameraSerializer.Meta.fields):
+            queryset = queryset.prefetch_related(Prefetch(
+                'profiles', queryset=ConfigurationProfile.objects.only('id', 'camera_id', 'name', 'created_at').order_by('created_at'),
+            ))
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        """
+        The camera list with ETag and Last-Modified validators, answering 304 when
+        nothing changed. Any change to a camera or its profiles bumps its updated_at,
+        and the row count covers cameras that were removed.
+        """
+        state = Camera.objects.aggregate(count=Count('id'), updated_at=Max('updated_at'))
+        updated_at = state['updated_at']
+        # The representation depends on the selected fields and the page
+        etag = quote_etag(hashlib.md5(
+            f"{state['count']}|{updated_at.isoformat() if updated_at else ''}|{request.get_full_path()}".encode()
+        ).hexdigest())
+        last_modified = int(updated_at.timestamp()) if updated_at else None
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().list(request, *args, **kwargs)
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        # Browsers revalidate on every fetch instead of reusing a stale list
+        patch_cache_control(response, no_cache=True)
+        return response
 
     @action(detail=True, methods=['get'])
-    def features(self, request, serial_number=None):
+    def stream_stats(self, request, serial_number=None):
+        """Reports per-viewer sent/dropped frame counters for the camera's live stream."""
+        stats = stream_manager.get_stream_stats(serial_number)
+        if stats is None:
+            return Response({'error': 'No live stream is running for this camera.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(stats)
+
+    @action(detail=True, methods=['post', 'delete'])
+    def pretrigger(self, request, serial_number=None):
         """
-        Gets features for a camera.
-        If online, gets live features.
-        If offline, gets features from the last saved profile.
+        POST arms the pre-trigger buffer, keeping the last `seconds` of frames (at most
+        `max_mb` megabytes) in memory; DELETE disarms it.
         """
+        get_object_or_404(Camera, serial_number=serial_number)
+        if request.method == 'DELETE':
+            if not recording_manager.disarm(serial_number):
+                return Response({'error': 'The pre-trigger buffer is not armed.'}, status=status.HTTP_404_NOT_FOUND)
+            return Response({'status': 'Pre-trigger buffer disarmed.'})
         try:
-            # Try to get live features first
-            live_features = camera_interface.get_camera_features(serial_number)
-            return Response({
-                "status": "online",
-                "features": live_features
-            })
-        except Exception:
-            # If it fails, camera is likely offline. Try to find the last saved profile.
-            camera = self.get_object()
-            last_profile = camera.profiles.order_by('-created_at').first()
-            
-            if last_profile:
-                # Convert the saved JSON into the same list format as live features
-                stale_features = [{'name': name, 'value': value} for name, value in last_profile.settings_json.items()]
-                return Response({
-                    "status": "offline",
-                    "message": f"Camera is offline. Showing settings from profile '{last_profile.name}'.",
-                    "features": stale_features
-                })
-            else:
-                # Camera is offline and has no saved profiles
-                return Response({
-                    "status": "offline",
-                    "message": "Camera is offline and has no saved configurations.",
-                    "features": []
-                }, status=status.HTTP_404_NOT_FOUND)
+            seconds = float(request.data.get('seconds') or 0) or None
+            max_mb = float(request.data.get('max_mb') or 0) or None
+        except (TypeError, ValueError):
+            return Response({'error': 'seconds and max_mb must be numbers.'}, status=status.HTTP_400_BAD_REQUEST)
+        stats = recording_manager.arm(serial_number, seconds, int(max_mb * 1024 * 1024) if max_mb else None)
+        return Response(stats)
 
     @action(detail=True, methods=['post'])
-    def save_profile(self, request, serial_number=None):
-        """Saves the camera's current settings as a new named profile."""
-        camera = self.get_object()
-        profile_name = request.data.get('name')
-        if not profile_name:
-            return Response({'error': 'Profile name is required.'}, status=status.HTTP_400_BAD_REQUEST)
+    def trigger(self, request, serial_number=None):
+        """
+        Writes the pre-trigger buffer to disk, e.g. when an inspection fails. The write
+        happens in the background; GET recording/ reports whether it succeeded.
+        """
+        get_object_or_404(Camera, serial_number=serial_number)
+        fmt = request.data.get('format', FORMAT_JPEG)
+        if fmt not in RECORDING_FORMATS:
+            return Response({'error': f"format must be one of: {', '.join(RECORDING_FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST)
+        result = recording_manager.trigger(serial_number, request.data.get('label', ''), fmt)
+        if result is None:
+            return Response({'error': 'The pre-trigger buffer is not armed.'}, status=status.HTTP_409_CONFLICT)
+        path, frame_count = result
+        return Response({'path': path, 'frames': frame_count}, status=status.HTTP_202_ACCEPTED)
 
+    @action(detail=True, methods=['get', 'post', 'delete'])
+    def recording(self, request, serial_number=None):
+        """
+        GET reports the recorder's state and its recent pre-trigger dumps, POST starts
+        continuous recording ({"format": "jpeg" | "avi", "segment_seconds": 300}) and
+        DELETE stops it.
+        """
+        get_object_or_404(Camera, serial_number=serial_number)
+        if request.method == 'GET':
+            stats = recording_manager.get_stats(serial_number)
+            if stats is None:
+                return Response({'error': 'Nothing is being recorded for this camera.'}, status=status.HTTP_404_NOT_FOUND)
+            return Response(stats)
+        if request.method == 'DELETE':
+            stats = recording_manager.stop_recording(serial_number)
+            if stats is None:
+                return Response({'error': 'Nothing is being recorded for this camera.'}, status=status.HTTP_404_NOT_FOUND)
+            return Response(stats)
+        fmt = request.data.get('format', FORMAT_JPEG)
+        if fmt not in RECORDING_FORMATS:
+            return Response({'error': f"format must be one of: {', '.join(RECORDING_FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST)
         try:
-            current_features = camera_interface.get_camera_features(serial_number)
-            settings_dict = {feature['name']: feature['value'] for feature in current_features}
-            profile = ConfigurationProfile.objects.create(
-                camera=camera, name=profile_name, settings_json=settings_dict
-            )
-            # Use the full serializer for the response
-            serializer = ConfigurationProfileSerializer(profile)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        except Exception as e:
-            return Response(
-                {'error': f"Could not save profile. Is the camera online? Error: {e}"},
-                status=status.HTTP_503_SERVICE_UNAVAILABLE
-            )
+            segment_seconds = float(request.data.get('segment_seconds') or 0) or None
+        except (TypeError, ValueError):
+            return Response({'error': 'segment_seconds must be a number.'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(recording_manager.start_recording(serial_number, fmt, segment_seconds))
 
 
 class ConfigurationProfileViewSet(viewsets.ModelViewSet):
     """
     API endpoint for managing configuration profiles.
+    Applying a profile is served by the async apply_profile view.
     """
     queryset = ConfigurationProfile.objects.all()
     serializer_class = ConfigurationProfileSerializer
 
-    @action(detail=True, methods=['post'])
-    def apply(self, request, pk=None):
-        """Applies this profile's settings to its camera."""
-        profile = self.get_object()
-        success, message = camera_interface.apply_configuration(
-            profile.camera.serial_number, profile.settings_json
+
+# --- Async camera I/O endpoints ---
+# Blocking pylon calls run on the bounded camera_io pool with a per-request timeout.
+# Concurrent identical reads (the same camera's features) share one call.
+# Like DRF's APIView they are exempt from Django's CSRF middleware and go through
+# the API's authentication, permission and throttle checks instead.
+
+class _EndpointAccess(APIView):
+    """The DRF checks every API view runs before its handler, for the async endpoints."""
+
+    def check(self, request, *args, **kwargs):
+        """Returns None if the request may proceed, else the rendered error response."""
+        self.args, self.kwargs = args, kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            # Authenticates (SessionAuthentication enforces CSRF for logged-in users),
+            # then checks the default permission and throttle classes
+            self.initial(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.finalize_response(request, self.handle_exception(exc), *args, **kwargs)
+            return response.render()
+        return None
+
+    def perform_content_negotiation(self, request, force=False):
+        # The endpoints pick their own content types (images, MJPEG, ZIP, NDJSON)
+        return super().perform_content_negotiation(request, force=True)
+
+
+def async_endpoint(*methods):
+    """
+    Restricts an async view to the given HTTP methods and runs DRF's access checks on
+    it. Django's require_http_methods and csrf_exempt only learned to wrap async views in 5.0.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+            # Authentication may read the session and user from the database
+            denied = await sync_to_async(_EndpointAccess().check)(request, *args, **kwargs)
+            if denied is not None:
+                return denied
+            return await view(request, *args, **kwargs)
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+
+def _timeout_response():
+    return JsonResponse(
+        {'error': 'The camera did not respond in time.'}, status=status.HTTP_504_GATEWAY_TIMEOUT
+    )
+
+
+def _request_data(request):
+    if request.content_type == 'application/json':
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError:
+            return {}
+    return request.POST
+
+
+@async_endpoint('GET')
+async def metrics(request):
+    """
+    Stream, stage and camera call metrics in the Prometheus text format. Only cameras
+    in the inventory are labelled; metrics for other serial numbers clients asked for
+    are dropped, so made-up serial numbers cannot grow the series without bound.
+    """
+    cameras = {serial_number async for serial_number in Camera.objects.values_list('serial_number', flat=True)}
+    forget_streams(cameras)
+    return HttpResponse(
+        metrics_registry.render(allowed={'camera': cameras}), content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+
+@async_endpoint('POST')
+async def scan(request):
+    """
+    Returns the latest background discovery snapshot and triggers a new pass.
+    Pass ?wait=1 to wait for that pass and return its result instead.
+    """
+    future = discovery_service.request_scan()
+    if request.GET.get('wait') not in ('1', 'true'):
+        return JsonResponse({'status': 'Scan started', **discovery_service.snapshot()})
+    try:
+        snapshot = await asyncio.wait_for(
+            asyncio.shield(asyncio.wrap_future(future)), getattr(settings, 'CAMERA_IO_TIMEOUT', 10.0)
+        )
+    except asyncio.TimeoutError:
+        return _timeout_response()
+    except Exception as e:
+        return JsonResponse({'error': f"Scan failed: {e}"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return JsonResponse({'status': 'Scan complete', **snapshot})
+
+
+@async_endpoint('GET')
+async def bandwidth_plan(request):
+    """
+    Dry run of the GigE bandwidth planner: reports how the host links would be shared
+    without writing to any camera. Plans the cameras streaming now, or those listed in
+    ?cameras=SN1,SN2 (?cameras=all for every discovered camera). The plan applied
+    last, if any, is included as `last_applied`.
+    """
+    requested = request.GET.get('cameras')
+    try:
+        if requested == 'all':
+            cameras = await camera_io.call('discovered_cameras', discovery_service.cameras)
+            serial_numbers = [camera['serial_number'] for camera in cameras]
+        elif requested:
+            serial_numbers = [value.strip() for value in requested.split(',') if value.strip()]
+        else:
+            serial_numbers = list(stream_manager.get_consumer_counts())
+        plan = await camera_io.call(('bandwidth_plan', tuple(sorted(serial_numbers))), bandwidth_planner.plan, serial_numbers)
+    except asyncio.TimeoutError:
+        return _timeout_response()
+    return JsonResponse({**plan, 'last_applied': bandwidth_planner.last_plan()})
+
+
+@async_endpoint('GET')
+async def camera_features(request, serial_number):
+    """
+    Gets features for a camera.
+    If online, gets live features.
+    If offline, gets features from the last saved profile.
+    Pass ?refresh=1 to bypass the value cache and rebuild the model's schema.
+    """
+    camera = await Camera.objects.filter(serial_number=serial_number).afirst()
+    if camera is None:
+        return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+    refresh = request.GET.get('refresh') in ('1', 'true')
+    try:
+        # Try to get live features first
+        live_features = await camera_io.call(
+            ('features', serial_number, refresh), camera_interface.get_camera_features, serial_number, refresh=refresh
+        )
+        return JsonResponse({
+            "status": "online",
+            "features": live_features
+        })
+    except Exception:
+        # If it fails (or times out), camera is likely offline. Try to find the last saved profile.
+        last_profile = await camera.profiles.order_by('-created_at').afirst()
+
+        if last_profile:
+            # Convert the saved JSON into the same list format as live features, with the
+            # type from the schema of the camera's model and firmware where we have it,
+            # and the ranges and options last read from the camera
+            stored_schema = await sync_to_async(feature_schema.schema_for_model)(camera.model_name, camera.firmware_version)
+            schema = {entry['name']: entry for entry in stored_schema or []}
+            stale_features = []
+            for name, value in last_profile.settings_json.items():
+                feature = {'name': name, 'value': value}
+                if name in schema:
+                    feature['type'] = schema[name]['type']
+                if name in camera.feature_details:
+                    feature['details'] = camera.feature_details[name]
+                stale_features.append(feature)
+            return JsonResponse({
+                "status": "offline",
+                "message": f"Camera is offline. Showing settings from profile '{last_profile.name}'.",
+                "features": stale_features
+            })
+        else:
+            # Camera is offline and has no saved profiles
+            return JsonResponse({
+                "status": "offline",
+                "message": "Camera is offline and has no saved configurations.",
+                "features": []
+            }, status=status.HTTP_404_NOT_FOUND)
+
+
+# How long a snapshot request waits for a just-started stream's first frame
+SNAPSHOT_FIRST_FRAME_WAIT = 1.0
+
+
+async def _stream_frames(serial_number):
+    """
+    The latest frames of the camera's stream, waiting briefly for the first one of a
+    stream that has just started: None if no stream runs, {} if it has no frame yet.
+    """
+    frames = stream_manager.get_latest_frames(serial_number)
+    if frames == {}:
+        frames = await sync_to_async(stream_manager.wait_for_frames, thread_sensitive=False)(
+            serial_number, 0, SNAPSHOT_FIRST_FRAME_WAIT
+        )
+        if frames is None:
+            # The stream stopped meanwhile or still has no frame
+            frames = stream_manager.get_latest_frames(serial_number)
+    return frames
+
+
+@async_endpoint('GET')
+async def snapshot(request, serial_number):
+    """
+    Returns the camera's most recent frame as an image. While a stream runs this is
+    its latest frame and costs no camera I/O; otherwise one frame is grabbed.
+    Query parameters: format (jpeg or png), quality and max_width. Responses carry
+    an ETag per frame, so clients polling with If-None-Match get 304 until a new frame arrives.
+    """
+    fmt = request.GET.get('format', 'jpeg')
+    if fmt not in snapshots.FORMATS:
+        return JsonResponse(
+            {'error': f"format must be one of: {', '.join(snapshots.FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        variant = Subscription.from_dict(request.GET).variant
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    frames = await _stream_frames(serial_number)
+    try:
+        if frames is None:
+            try:
+                image = await camera_io.call(('snapshot', serial_number, fmt, variant), snapshots.one_shot, serial_number, fmt, variant)
+            except Exception:
+                # A stream that started since the check owns the camera now; use its frames
+                frames = await _stream_frames(serial_number)
+                if frames is None:
+                    raise
+        if frames:
+            image = await sync_to_async(snapshots.from_stream, thread_sensitive=False)(
+                serial_number, frames, fmt, variant
+            )
+        elif frames is not None:
+            return JsonResponse({'error': 'The stream has not produced a frame yet.'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    except asyncio.TimeoutError:
+        return _timeout_response()
+    except Exception as e:
+        return JsonResponse(
+            {'error': f"Could not get a frame. Is the camera online? Error: {e}"}, status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+
+    if image.etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+        response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = HttpResponse(image.data, content_type=image.content_type)
+    response['ETag'] = image.etag
+    response['Cache-Control'] = 'no-cache'
+    response['X-Frame-Id'] = str(image.frame_id)
+    response['X-Frame-Timestamp'] = f"{image.timestamp:.0f}"
+    return response
+
+
+@async_endpoint('GET')
+async def mjpeg_stream(request, serial_number):
+    """
+    Streams the camera as multipart/x-mixed-replace MJPEG for players and recorders
+    that cannot speak the WebSocket protocol. Accepts the same max_width, quality and
+    fps parameters as the WebSocket; fps is capped at CAMERA_MJPEG_MAX_FPS.
+    """
+    try:
+        subscription = Subscription.from_dict(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    max_fps = getattr(settings, 'CAMERA_MJPEG_MAX_FPS', 15.0)
+    if max_fps and (subscription.fps is None or subscription.fps > max_fps):
+        subscription.fps = max_fps
+
+    loop = asyncio.get_running_loop()
+    connection = connection_of(request.scope)
+    consumer = MjpegConsumer(loop, subscription, client=request.scope.get('client'), connection=connection)
+
+    async def parts():
+        # Registered only once the response is sent, so a response that never is leaves no consumer behind
+        # (the manager's lock can be held while another stream shuts down)
+        await sync_to_async(stream_manager.start_stream, thread_sensitive=False)(serial_number, consumer)
+        # Django does not end a streaming response when the client goes away
+        disconnect = asyncio.ensure_future(connection.disconnected()) if connection else None
+        if disconnect:
+            disconnect.add_done_callback(lambda task: task.cancelled() or consumer.close())
+        try:
+            async for part in consumer.parts():
+                yield part
+        finally:
+            if disconnect:
+                disconnect.cancel()
+            # Stopping the last consumer joins the grab thread; keep that off the event loop,
+            # and finish it even if the response is being cancelled
+            await asyncio.shield(sync_to_async(stream_manager.stop_stream, thread_sensitive=False)(serial_number, consumer))
+
+    response = StreamingHttpResponse(parts(), content_type=MJPEG_CONTENT_TYPE)
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+@async_endpoint('POST')
+async def save_profile(request, serial_number):
+    """Saves the camera's current settings as a new named profile."""
+    camera = await Camera.objects.filter(serial_number=serial_number).afirst()
+    if camera is None:
+        return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+    profile_name = _request_data(request).get('name')
+    if not profile_name:
+        return JsonResponse({'error': 'Profile name is required.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        settings_dict = await camera_io.call(
+            ('settings', serial_number), camera_interface.get_camera_settings, serial_number
+        )
+    except asyncio.TimeoutError:
+        return _timeout_response()
+    except Exception as e:
+        return JsonResponse(
+            {'error': f"Could not save profile. Is the camera online? Error: {e}"},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    profile = await ConfigurationProfile.objects.acreate(
+        camera=camera, name=profile_name, settings_json=settings_dict
+    )
+    # Use the full serializer for the response
+    serializer = ConfigurationProfileSerializer(profile)
+    return JsonResponse(serializer.data, status=status.HTTP_201_CREATED)
+
+
+def _profile_pin(profile):
+    """The pinned-copy fields apply_configuration checks before writing features one by one."""
+    if not profile.pin_digest:
+        return None
+    return {
+        'serial_number': profile.camera.serial_number,
+        'user_set': profile.user_set,
+        'pfs_data': profile.pfs_data,
+        'pin_key': profile.pin_key,
+        'pin_digest': profile.pin_digest,
+    }
+
+
+def _publish_applied(serial_number, profile, message):
+    events.publish(events.PROFILE_APPLIED, serial_number, profile=profile.pk, name=profile.name, message=message)
+
+
+@async_endpoint('POST')
+async def apply_profile(request, pk):
+    """Applies this profile's settings to its camera."""
+    profile = await ConfigurationProfile.objects.select_related('camera').filter(pk=pk).afirst()
+    if profile is None:
+        return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        success, message, report = await camera_io.call(
+            None, camera_interface.apply_configuration, profile.camera.serial_number, profile.settings_json,
+            pin=_profile_pin(profile)
+        )
+    except asyncio.TimeoutError:
+        return _timeout_response()
+    if success:
+        _publish_applied(profile.camera.serial_number, profile, message)
+        return JsonResponse({'status': message, 'report': report})
+    return JsonResponse({'error': message, 'report': report}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@async_endpoint('POST', 'DELETE')
+async def pin_profile(request, pk):
+    """
+    POST applies the profile to its camera and pins the result: always as a cached
+    .pfs feature file, and also in an on-camera user set when {"user_set": "UserSet1"}
+    is given. DELETE drops the pinned copies so the profile is written feature by feature.
+    """
+    profile = await ConfigurationProfile.objects.select_related('camera').filter(pk=pk).afirst()
+    if profile is None:
+        return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+    if request.method == 'DELETE':
+        await ConfigurationProfile.objects.filter(pk=pk).aupdate(user_set='', pfs_data='', pin_key='', pin_digest='')
+        return JsonResponse({'status': 'Profile unpinned.'})
+
+    user_set = _request_data(request).get('user_set') or None
+    try:
+        success, message, pin, report = await camera_io.call(
+            None, camera_interface.pin_configuration, profile.camera.serial_number, profile.settings_json, user_set
+        )
+    except asyncio.TimeoutError:
+        return _timeout_response()
+    if not success:
+        return JsonResponse({'error': message, 'report': report}, status=status.HTTP_400_BAD_REQUEST)
+    if user_set:
+        # The camera's user set now holds this profile; others pinned to it are stale
+        await ConfigurationProfile.objects.filter(
+            camera=profile.camera, user_set=user_set
+        ).exclude(pk=pk).aupdate(user_set='')
+    await ConfigurationProfile.objects.filter(pk=pk).aupdate(**pin)
+    _publish_applied(profile.camera.serial_number, profile, message)
+    return JsonResponse({'status': message, 'user_set': pin['user_set'], 'report': report})
+
+
+# --- Bulk apply ---
+
+def _bulk_assignments(data):
+    """
+    Turns a bulk apply body into {serial number: profile id}. Accepts either
+    {"profile": <id>, "cameras": [<serial>, ...]} or {"assignments": {<serial>: <id>, ...}}.
+    """
+    if 'assignments' in data:
+        assignments = data['assignments']
+        if not isinstance(assignments, dict):
+            raise ValueError("'assignments' must map camera serial numbers to profile ids.")
+    elif 'profile' in data and 'cameras' in data:
+        if not isinstance(data['cameras'], list):
+            raise ValueError("'cameras' must be a list of serial numbers.")
+        assignments = {serial_number: data['profile'] for serial_number in data['cameras']}
+    else:
+        raise ValueError("Send either 'profile' and 'cameras', or 'assignments'.")
+    if not assignments:
+        raise ValueError("No cameras given.")
+    try:
+        return {str(serial_number): int(profile_id) for serial_number, profile_id in assignments.items()}
+    except (TypeError, ValueError):
+        raise ValueError("Profile ids must be integers.")
+
+
+def _ndjson(event):
+    return json.dumps(event) + '\n'
+
+
+async def _apply_to_camera(serial_number, camera, profile, force, limit):
+    result = {'serial_number': serial_number, 'profile': profile.pk if profile else None}
+    if camera is None:
+        return dict(result, status='not_found', message='Unknown camera.')
+    if profile is None:
+        return dict(result, status='not_found', message='Unknown profile.')
+    if not force and profile.camera.model_name != camera.model_name:
+        return dict(
+            result, status='incompatible',
+            message=f"Profile '{profile.name}' was saved on model {profile.camera.model_name}; this camera is {camera.model_name}."
+        )
+    async with limit:
+        started = time.monotonic()
+        try:
+            success, message, report = await camera_io.call(
+                None, camera_interface.apply_configuration, serial_number, profile.settings_json,
+                pin=_profile_pin(profile)
+            )
+        except asyncio.TimeoutError:
+            return dict(result, status='timeout', message='The camera did not respond in time.')
+    if success:
+        _publish_applied(serial_number, profile, message)
+    return dict(
+        result, status='applied' if success else 'failed', message=message, report=report,
+        elapsed_ms=round((time.monotonic() - started) * 1000),
+    )
+
+
+async def _bulk_apply_events(assignments, cameras, profiles, force):
+    started = time.monotonic()
+    yield _ndjson({'event': 'start', 'cameras': list(assignments)})
+    # Leave part of the camera I/O pool free for other requests
+    limit = asyncio.Semaphore(getattr(settings, 'CAMERA_BULK_APPLY_CONCURRENCY', 4))
+    tasks = [
+        asyncio.ensure_future(_apply_to_camera(
+            serial_number, cameras.get(serial_number), profiles.get(profile_id), force, limit
+        ))
+        for serial_number, profile_id in assignments.items()
+    ]
+    counts = {}
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            result = await next_result
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+            yield _ndjson(dict(result, event='result'))
+    finally:
+        # Client went away: cameras not started yet are left alone
+        for task in tasks:
+            task.cancel()
+    yield _ndjson({'event': 'done', 'counts': counts, 'elapsed_ms': round((time.monotonic() - started) * 1000)})
+
+
+@async_endpoint('POST')
+async def bulk_apply(request):
+    """
+    Applies profiles to many cameras concurrently and streams progress as NDJSON:
+    a "start" line, one "result" line per camera as it finishes, then a "done" line.
+    Profiles are only applied to cameras of the model they were saved on unless "force" is true.
+    """
+    data = _request_data(request)
+    try:
+        assignments = _bulk_assignments(data)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    profiles = {
+        profile.pk: profile async for profile in
+        ConfigurationProfile.objects.select_related('camera').filter(pk__in=set(assignments.values()))
+    }
+    cameras = {
+        camera.serial_number: camera async for camera in Camera.objects.filter(serial_number__in=list(assignments))
+    }
+    events = _bulk_apply_events(assignments, cameras, profiles, bool(data.get('force')))
+    return StreamingHttpResponse(events, content_type='application/x-ndjson')
+
+
+# --- Synchronized capture ---
+
+@async_endpoint('POST')
+async def synchronized_capture(request):
+    """
+    Captures one frame from each camera in {"cameras": [<serial>, ...]} at nearly the
+    same instant and returns them as a ZIP with a manifest.json of per-frame camera
+    timestamps and trigger skew. Optional: "format" (jpeg or png), "trigger" (auto,
+    software or action) and "timeout" in seconds for arming and for each frame.
+    """
+    data = _request_data(request)
+    serial_numbers = data.get('cameras')
+    if not isinstance(serial_numbers, list) or not serial_numbers:
+        return JsonResponse({'error': "'cameras' must be a non-empty list of serial numbers."}, status=status.HTTP_400_BAD_REQUEST)
+    serial_numbers = list(dict.fromkeys(str(serial_number) for serial_number in serial_numbers))
+    max_cameras = getattr(settings, 'CAMERA_SYNC_MAX_CAMERAS', 16)
+    if len(serial_numbers) > max_cameras:
+        return JsonResponse({'error': f"At most {max_cameras} cameras can be captured together."}, status=status.HTTP_400_BAD_REQUEST)
+    known = {
+        serial_number async for serial_number in
+        Camera.objects.filter(serial_number__in=serial_numbers).values_list('serial_number', flat=True)
+    }
+    unknown = [serial_number for serial_number in serial_numbers if serial_number not in known]
+    if unknown:
+        return JsonResponse({'error': f"Unknown camera(s): {', '.join(unknown)}."}, status=status.HTTP_404_NOT_FOUND)
+    fmt = data.get('format', 'jpeg')
+    if fmt not in snapshots.FORMATS:
+        return JsonResponse({'error': f"format must be one of: {', '.join(snapshots.FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST)
+    trigger = data.get('trigger', sync_capture.TRIGGER_AUTO)
+    if trigger not in sync_capture.TRIGGERS:
+        return JsonResponse({'error': f"trigger must be one of: {', '.join(sync_capture.TRIGGERS)}."}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        timeout = float(data.get('timeout') or getattr(settings, 'CAMERA_SYNC_CAPTURE_TIMEOUT', 5.0))
+    except (TypeError, ValueError):
+        timeout = None
+    # Also rules out NaN and infinity
+    if timeout is None or not 0 < timeout < float('inf'):
+        return JsonResponse({'error': 'timeout must be a positive number of seconds.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        # Arming, the frames and restoring the cameras each get up to `timeout`
+        manifest, images = await camera_io.call(
+            None, sync_capture.capture, serial_numbers, fmt, trigger, timeout, timeout=3 * timeout + 5.0
         )
-        if success:
-            return Response({'status': message})
-        return Response({'error': message}, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+    except asyncio.TimeoutError:
+        return _timeout_response()
+    except Exception as e:
+        return JsonResponse({'error': f"Synchronized capture failed: {e}"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    if not images:
+        return JsonResponse({'error': 'No camera delivered a frame.', **manifest}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    response = HttpResponse(sync_capture.bundle(manifest, images), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="capture-{int(time.time())}.zip"'
+    response['X-Trigger-Skew-Ms'] = str(manifest['trigger_skew_ms'])
+    response['X-Capture-Ms'] = str(manifest['capture_ms'])
+    return response
@@ -9,17 +9,34 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 
 import os
 from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project_config.settings')
+# Sets up Django; the consumers import models, so they are imported afterwards
+django_asgi_app = get_asgi_application()
+
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 import camera_manager.routing
+from camera_manager.connections import ConnectionMiddleware
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project_config.settings')
-
-application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+# Lets stream senders see how far behind a client is (see camera_manager/connections.py)
+application = ConnectionMiddleware(ProtocolTypeRouter({
+    "http": django_asgi_app,
     "websocket": AuthMiddlewareStack(
         URLRouter(
             camera_manager.routing.websocket_urlpatterns
         )
     ),
-})
\ No newline at end of file
+}))
+
+# Camera libraries are imported lazily (see camera_manager/backend.py); every serving
+# process loads them and pylon's transport layers in the background right away, so
+# the first camera request finds them warm. Background discovery keeps the inventory
+# fresh and publishes its events; it runs once per deployment, here unless
+# CAMERA_DISCOVERY_IN_SERVER is off (then via `manage.py run_discovery`)
+from django.conf import settings
+from camera_manager import backend
+from camera_manager.discovery import discovery_service
+backend.warm_up()
+if getattr(settings, 'CAMERA_DISCOVERY_IN_SERVER', True):
+    discovery_service.start()
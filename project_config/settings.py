@@ -130,4 +130,96 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'static'),
-]
\ No newline at end of file
+]
+
+# Camera streaming
+# Frames buffered per WebSocket viewer before the oldest one is dropped
+CAMERA_STREAM_QUEUE_SIZE = 2
+# Bytes already sent to a viewer that may wait in the server's buffer; beyond it the
+# viewer counts as behind and its frames are dropped as above
+CAMERA_STREAM_MAX_UNSENT_BYTES = 1024 * 1024
+# 'thread' grabs inside the server process; 'process' runs one supervised worker
+# process per camera that publishes frames through a shared-memory ring
+CAMERA_STREAM_MODE = 'thread'
+CAMERA_WORKER_RING_SLOTS = 4
+CAMERA_WORKER_SLOT_SIZE = 8 * 1024 * 1024
+# Seconds without any reader lease renewal before a worker process shuts itself down
+CAMERA_WORKER_LEASE_TIMEOUT = 5.0
+# Threads JPEG-encoding frames in parallel per camera, and how many frames may be
+# in flight between grabbing and publishing before grabbing waits
+CAMERA_ENCODE_WORKERS = 2
+CAMERA_PIPELINE_DEPTH = 4
+# Seconds an unused shared camera session stays open before it is closed
+CAMERA_SESSION_IDLE_TIMEOUT = 60.0
+# Seconds live feature values are reused before the camera is read again
+CAMERA_FEATURE_CACHE_TTL = 2.0
+# Threads serving blocking camera calls for HTTP requests, and how long a request waits for one
+CAMERA_IO_WORKERS = 8
+CAMERA_IO_TIMEOUT = 10.0
+# Seconds between background camera discovery passes
+CAMERA_DISCOVERY_INTERVAL = 10.0
+# Whether the ASGI server process runs background discovery. With several server
+# workers, turn it off and run `manage.py run_discovery` once, or leave it on for a
+# single worker; inventory events reach the clients of the process that runs it
+CAMERA_DISCOVERY_IN_SERVER = True
+# Cameras one bulk profile apply configures at the same time
+CAMERA_BULK_APPLY_CONCURRENCY = 4
+# Seconds a one-shot snapshot grab is reused while the camera is not streaming
+CAMERA_SNAPSHOT_MAX_AGE = 0.5
+# Frame rate cap for each MJPEG-over-HTTP connection
+CAMERA_MJPEG_MAX_FPS = 15.0
+# Pre-trigger buffer defaults: seconds of frames kept in memory per armed camera, capped in bytes
+CAMERA_PRETRIGGER_SECONDS = 5.0
+CAMERA_PRETRIGGER_MAX_BYTES = 64 * 1024 * 1024
+# Recordings and pre-trigger dumps are written below this directory, one folder per camera
+CAMERA_RECORDING_DIR = os.path.join(BASE_DIR, 'recordings')
+# Frame rate recorded (None keeps every frame), segment length, and frames queued for the disk before dropping
+CAMERA_RECORDING_FPS = 15.0
+CAMERA_RECORDING_SEGMENT_SECONDS = 300
+CAMERA_RECORDING_QUEUE_SIZE = 64
+# Seconds stopping a recording waits for the queued frames to be written
+CAMERA_RECORDING_STOP_TIMEOUT = 10.0
+# Threads writing pre-trigger dumps; further dumps wait for one of them
+CAMERA_TRIGGER_WRITERS = 2
+# Camera events kept for clients resuming ws/camera_events/ after a reconnect
+CAMERA_EVENT_HISTORY = 1000
+# Seconds between checks for events stored by other processes (discovery, other workers)
+CAMERA_EVENT_POLL_INTERVAL = 0.5
+# Skip frames in which no tile changed visibly, and send only the changed tiles to
+# clients that ask for deltas; a full keyframe still goes out every CAMERA_KEYFRAME_INTERVAL
+# seconds. Tiles are CAMERA_CHANGE_TILE_SIZE pixels square (a multiple of 4), and
+# CAMERA_CHANGE_THRESHOLD is the gray-level difference that counts as a change
+CAMERA_CHANGE_DETECTION = False
+CAMERA_CHANGE_TILE_SIZE = 64
+CAMERA_CHANGE_THRESHOLD = 4.0
+CAMERA_KEYFRAME_INTERVAL = 2.0
+# How live streams receive frames: 'retrieve' blocks in RetrieveResult on the stream
+# thread, 'event' lets pylon's grab loop thread deliver them as soon as each buffer fills
+CAMERA_GRAB_MODE = 'retrieve'
+# pylon grab strategy: LatestImageOnly, LatestImages, OneByOne or UpcomingImage
+CAMERA_GRAB_STRATEGY = 'LatestImageOnly'
+# Grab buffers pylon allocates per camera (None keeps pylon's default of 10), and the
+# frames LatestImages keeps queued (None keeps pylon's default of 1)
+CAMERA_MAX_NUM_BUFFER = None
+CAMERA_OUTPUT_QUEUE_SIZE = None
+# GigE bandwidth planning: when streams start or stop, share each host link between
+# the cameras streaming over it via throughput limits or inter-packet delays.
+# Link speeds are in Mbit/s, per host interface address where they differ from the
+# default; CAMERA_GIGE_LINK_RESERVE is the share of each link kept free. A packet
+# size (None leaves the camera's) is set before grabbing; jumbo sizes need a matching NIC MTU
+CAMERA_BANDWIDTH_PLANNING = False
+CAMERA_GIGE_LINK_SPEED = 1000
+CAMERA_GIGE_LINK_SPEEDS = {}
+CAMERA_GIGE_LINK_RESERVE = 0.1
+CAMERA_GIGE_PACKET_SIZE = None
+# Seconds a plan waits for each camera's stream parameters before leaving it out
+CAMERA_BANDWIDTH_READ_TIMEOUT = 3.0
+# Synchronized capture: cameras per request, seconds allowed for arming and for each
+# frame, and the GigE action command keys the cameras are armed with (TriggerSource
+# Action1) and the address the command is broadcast to
+CAMERA_SYNC_MAX_CAMERAS = 16
+CAMERA_SYNC_CAPTURE_TIMEOUT = 5.0
+CAMERA_ACTION_DEVICE_KEY = 0x4711
+CAMERA_ACTION_GROUP_KEY = 1
+CAMERA_ACTION_GROUP_MASK = 0xFFFFFFFF
+CAMERA_ACTION_BROADCAST_ADDRESS = '255.255.255.255'
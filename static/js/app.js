@@ -8,13 +8,21 @@ document.addEventListener('DOMContentLoaded', () => {
     
     let activeWebSocket = null;
 
+    // --- BINARY FRAME PROTOCOL (mirrors camera_manager/frames.py) ---
+    // version u8, codec u8, flags u16, frame id u32, timestamp f64, width u16, height u16
+    const FRAME_HEADER_SIZE = 20;
+    const CODEC_MIME = { 1: 'image/jpeg' };
+    // Header flag of a delta frame, and the size of each tile's record in its body
+    const FLAG_DELTA = 1;
+    const TILE_HEADER_SIZE = 12;
+
     // --- UTILITY ---
     const getCsrfToken = () => document.querySelector('[name=csrfmiddlewaretoken]')?.value || '';
 
     // --- API FUNCTIONS ---
     const api = {
-        fetchCameras: () => fetch('/api/cameras/'),
-        scan: () => fetch('/api/cameras/scan/', { method: 'POST', headers: {'X-CSRFToken': getCsrfToken()} }),
+        fetchCameras: () => fetch('/api/cameras/?omit=profiles'),
+        scan: () => fetch('/api/cameras/scan/?wait=1', { method: 'POST', headers: {'X-CSRFToken': getCsrfToken()} }),
         fetchCameraDetails: (sn) => fetch(`/api/cameras/${sn}/`),
         fetchCameraFeatures: (sn) => fetch(`/api/cameras/${sn}/features/`),
         applyProfile: (id) => fetch(`/api/profiles/${id}/apply/`, { method: 'POST', headers: {'X-CSRFToken': getCsrfToken()} }),
@@ -100,8 +108,9 @@ document.addEventListener('DOMContentLoaded', () => {
         document.querySelectorAll('.apply-profile-btn').forEach(btn => {
             btn.addEventListener('click', async () => {
                 const profileId = btn.dataset.profileId;
-                await api.applyProfile(profileId);
-                alert('Profile applied!');
+                const response = await api.applyProfile(profileId);
+                const result = await response.json();
+                alert(response.ok ? `Profile applied: ${result.status}` : `Could not fully apply profile: ${result.error}`);
                 showDetailView(camera.serial_number);
             });
         });
@@ -156,49 +165,154 @@ document.addEventListener('DOMContentLoaded', () => {
 
         renderCameraDetail(camera, featuresData);
 
-        const videoElement = document.getElementById('video-stream');
         if (featuresData.status === 'online') {
-            videoElement.alt = "Connecting to live feed...";
+            setVideoStatus("Connecting to live feed...");
             startVideoStream(serialNumber);
         } else {
             if (activeWebSocket) activeWebSocket.close();
-            videoElement.src = '';
-            videoElement.alt = "Camera is offline. No live feed available.";
+            clearVideo();
+            setVideoStatus("Camera is offline. No live feed available.");
+        }
+    };
+
+const setVideoStatus = (text) => {
+    document.getElementById('video-status').textContent = text;
+};
+
+const clearVideo = () => {
+    // Resizing a canvas also clears it
+    document.getElementById('video-stream').width = 0;
+};
+
+// Decodes off the main thread and draws frames in order. A full frame replaces
+// everything not drawn yet (latest wins); delta frames are drawn, tile by tile,
+// on top of the frame before them and are never skipped.
+let drawQueue = [];
+let drawing = false;
+const drawFrame = (blob) => enqueueDraw({ full: blob });
+const drawDelta = (width, height, tiles) => enqueueDraw({ width, height, tiles });
+
+const enqueueDraw = async (item) => {
+    if (item.full) {
+        drawQueue = [item];
+    } else {
+        drawQueue.push(item);
+    }
+    if (drawing) return;
+    drawing = true;
+    const canvas = document.getElementById('video-stream');
+    const ctx = canvas.getContext('2d');
+    while (drawQueue.length) {
+        const next = drawQueue.shift();
+        try {
+            if (next.full) {
+                const bitmap = await createImageBitmap(next.full);
+                if (canvas.width !== bitmap.width || canvas.height !== bitmap.height) {
+                    canvas.width = bitmap.width;
+                    canvas.height = bitmap.height;
+                    setVideoStatus(`Live feed: ${bitmap.width}×${bitmap.height}`);
+                }
+                ctx.drawImage(bitmap, 0, 0);
+                bitmap.close();
+            } else if (canvas.width === next.width && canvas.height === next.height) {
+                const bitmaps = await Promise.all(next.tiles.map(tile => createImageBitmap(tile.blob)));
+                bitmaps.forEach((bitmap, i) => {
+                    ctx.drawImage(bitmap, next.tiles[i].x, next.tiles[i].y);
+                    bitmap.close();
+                });
+            }
+        } catch (error) {
+            console.error("[WebSocket] Could not decode frame:", error);
         }
+    }
+    drawing = false;
+};
+
+const parseBinaryFrame = (buffer) => {
+    const view = new DataView(buffer);
+    return {
+        codec: view.getUint8(1),
+        flags: view.getUint16(2, true),
+        frameId: view.getUint32(4, true),
+        timestamp: view.getFloat64(8, true),
+        width: view.getUint16(16, true),
+        height: view.getUint16(18, true),
+        data: new Uint8Array(buffer, FRAME_HEADER_SIZE),
     };
+};
+
+// Delta frame body: tile count u16, then per tile x, y, width, height u16 and length u32, then the image
+const parseTiles = (buffer, mime) => {
+    const view = new DataView(buffer, FRAME_HEADER_SIZE);
+    const tiles = [];
+    let offset = 2;
+    for (let i = 0; i < view.getUint16(0, true); i++) {
+        const length = view.getUint32(offset + 8, true);
+        const start = FRAME_HEADER_SIZE + offset + TILE_HEADER_SIZE;
+        tiles.push({
+            x: view.getUint16(offset, true),
+            y: view.getUint16(offset + 2, true),
+            blob: new Blob([new Uint8Array(buffer, start, length)], { type: mime }),
+        });
+        offset += TILE_HEADER_SIZE + length;
+    }
+    return tiles;
+};
+
+const base64ToBlob = (text, mime) => {
+    const bytes = Uint8Array.from(atob(text), c => c.charCodeAt(0));
+    return new Blob([bytes], { type: mime });
+};
 
 const startVideoStream = (serialNumber) => {
     if (activeWebSocket) {
         activeWebSocket.close();
     }
     
-    const videoElement = document.getElementById('video-stream');
-    const socketUrl = `ws://${window.location.host}/ws/camera_stream/${serialNumber}/`;
+    // Binary frames need ImageBitmap support; older browsers stay on the JSON transport
+    const transport = window.createImageBitmap ? 'binary' : 'json';
+    // Clients that can composite ask for changed tiles between full frames
+    const socketUrl = `ws://${window.location.host}/ws/camera_stream/${serialNumber}/?transport=${transport}&delta=1`;
     
     console.log(`[WebSocket] Attempting to connect to: ${socketUrl}`);
     activeWebSocket = new WebSocket(socketUrl);
+    activeWebSocket.binaryType = 'arraybuffer';
 
     activeWebSocket.onopen = (event) => {
         console.log("[WebSocket] Connection opened successfully!");
-        videoElement.alt = "Live feed established. Waiting for frames...";
+        setVideoStatus("Live feed established. Waiting for frames...");
     };
 
     activeWebSocket.onmessage = (event) => {
+        if (event.data instanceof ArrayBuffer) {
+            const frame = parseBinaryFrame(event.data);
+            const mime = CODEC_MIME[frame.codec] || 'image/jpeg';
+            if (frame.flags & FLAG_DELTA) {
+                drawDelta(frame.width, frame.height, parseTiles(event.data, mime));
+            } else {
+                drawFrame(new Blob([frame.data], { type: mime }));
+            }
+            return;
+        }
         const data = JSON.parse(event.data);
-        if (data.image) {
-            videoElement.src = `data:image/jpeg;base64,${data.image}`;
+        if (data.tiles) {
+            drawDelta(data.width, data.height, data.tiles.map(tile => ({
+                x: tile.x, y: tile.y, blob: base64ToBlob(tile.image, 'image/jpeg'),
+            })));
+        } else if (data.image) {
+            drawFrame(base64ToBlob(data.image, 'image/jpeg'));
         }
     };
 
     activeWebSocket.onerror = (error) => {
         console.error("[WebSocket] Error occurred:", error);
-        videoElement.alt = "A WebSocket error occurred. See browser console for details.";
+        setVideoStatus("A WebSocket error occurred. See browser console for details.");
     };
 
     activeWebSocket.onclose = (event) => {
         console.log(`[WebSocket] Connection closed. Code: ${event.code}, Reason: ${event.reason}`);
         if (!event.wasClean) {
-            videoElement.alt = "Connection lost unexpectedly. Please refresh.";
+            setVideoStatus("Connection lost unexpectedly. Please refresh.");
         }
     };
 };
@@ -217,5 +331,34 @@ const startVideoStream = (serialNumber) => {
         showListView();
     });
 
+    // --- CAMERA EVENTS ---
+    // Inventory changes are pushed, so the list refreshes only when a camera actually
+    // appeared, disappeared or changed. After a reconnect the server resumes from the
+    // last event seen, or sends a fresh snapshot when it cannot.
+    const eventCursor = { epoch: null, seq: null };
+    const LIST_EVENTS = new Set(['camera_appeared', 'camera_disappeared', 'camera_changed']);
+
+    const connectEvents = () => {
+        let url = `ws://${window.location.host}/ws/camera_events/`;
+        if (eventCursor.epoch !== null) {
+            url += `?epoch=${eventCursor.epoch}&since=${eventCursor.seq}`;
+        }
+        const socket = new WebSocket(url);
+        socket.onmessage = (event) => {
+            const message = JSON.parse(event.data);
+            if (message.type === 'snapshot' || message.type === 'resumed') {
+                eventCursor.epoch = message.epoch;
+                eventCursor.seq = message.seq;
+                // A snapshot may follow missed events, so the list is reloaded
+                if (message.type === 'snapshot' && !cameraListView.classList.contains('d-none')) showListView();
+                return;
+            }
+            eventCursor.seq = message.seq;
+            if (LIST_EVENTS.has(message.type) && !cameraListView.classList.contains('d-none')) showListView();
+        };
+        socket.onclose = () => setTimeout(connectEvents, 2000);
+    };
+
     showListView();
+    connectEvents();
 });
\ No newline at end of file